@@ -1,17 +1,69 @@
 from flask import Flask
 from flask_cors import CORS
-from flask_bcrypt import Bcrypt
-from flask_sqlalchemy import SQLAlchemy
 
-from environment import DATABASE_URL, JWT_SECRET, BCRYPT_LOG_ROUNDS
+from environment import DATABASE_URL, JWT_SECRET, BCRYPT_LOG_ROUNDS, REFERENCE_DATA_TTL, \
+    TOKEN_CACHE_SIZE, TOKEN_CACHE_TTL, REVOCATION_REFRESH_INTERVAL, JWT_BLACKLIST_PURGE_INTERVAL, \
+    BCRYPT_POOL_SIZE, BCRYPT_QUEUE_DEPTH, BCRYPT_RETRY_AFTER, HTTP_CACHE_MAX_AGE, CORS_MAX_AGE, \
+    DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE, DB_POOL_PRE_PING, \
+    DB_STATEMENT_TIMEOUT, DATABASE_REPLICA_URLS, REPLICA_RETRY_INTERVAL, METRICS_ENABLED, \
+    LOGIN_ATTEMPTS_PER_ACCOUNT, LOGIN_ATTEMPTS_PER_IP, LOGIN_RATE_LIMIT_PATH, PROXY_COUNT, \
+    REFRESH_TOKEN_TTL
+from db_pool import engine_options
+import replicas
 
-# Create all the global context for the flask app
-app = Flask(__name__)
-cors = CORS(app)
-app.config['CORS_HEADERS'] = 'Content-Type'
-app.config["BCRYPT_LOG_ROUNDS"] = BCRYPT_LOG_ROUNDS
-app.config["JWT_SECRET"] = JWT_SECRET
-app.config["SQLALCHEMY_DATABASE_URI"] = DATABASE_URL
-app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
-db = SQLAlchemy(app)
-bcrypt = Bcrypt(app)
+# Not bound to an app until create_app() is called, so importing the models
+# doesn't require (or create) an app
+db = replicas.RoutingSQLAlchemy()
+
+# Creates the flask app with all of its global context, but none of the
+# endpoints: those are added by application.create_api_app. Tools that only
+# need the database, such as manage.py, use this directly and skip importing
+# the endpoints and everything they depend on.
+#
+# config: optionally, a dict of settings overriding the ones from environment.py
+def create_app(config=None):
+    app = Flask(__name__)
+    CORS(app)
+    app.config['CORS_HEADERS'] = 'Content-Type'
+    app.config["CORS_MAX_AGE"] = CORS_MAX_AGE
+    app.config["HTTP_CACHE_MAX_AGE"] = HTTP_CACHE_MAX_AGE
+    app.config["BCRYPT_LOG_ROUNDS"] = BCRYPT_LOG_ROUNDS
+    app.config["BCRYPT_POOL_SIZE"] = BCRYPT_POOL_SIZE
+    app.config["BCRYPT_QUEUE_DEPTH"] = BCRYPT_QUEUE_DEPTH
+    app.config["BCRYPT_RETRY_AFTER"] = BCRYPT_RETRY_AFTER
+    app.config["JWT_SECRET"] = JWT_SECRET
+    app.config["REFERENCE_DATA_TTL"] = REFERENCE_DATA_TTL
+    app.config["TOKEN_CACHE_SIZE"] = TOKEN_CACHE_SIZE
+    app.config["TOKEN_CACHE_TTL"] = TOKEN_CACHE_TTL
+    app.config["REVOCATION_REFRESH_INTERVAL"] = REVOCATION_REFRESH_INTERVAL
+    app.config["JWT_BLACKLIST_PURGE_INTERVAL"] = JWT_BLACKLIST_PURGE_INTERVAL
+    app.config["SQLALCHEMY_DATABASE_URI"] = DATABASE_URL
+    app.config["DATABASE_REPLICA_URLS"] = DATABASE_REPLICA_URLS
+    app.config["REPLICA_RETRY_INTERVAL"] = REPLICA_RETRY_INTERVAL
+    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    app.config["DB_POOL_SIZE"] = DB_POOL_SIZE
+    app.config["DB_MAX_OVERFLOW"] = DB_MAX_OVERFLOW
+    app.config["DB_POOL_TIMEOUT"] = DB_POOL_TIMEOUT
+    app.config["DB_POOL_RECYCLE"] = DB_POOL_RECYCLE
+    app.config["DB_POOL_PRE_PING"] = DB_POOL_PRE_PING
+    app.config["DB_STATEMENT_TIMEOUT"] = DB_STATEMENT_TIMEOUT
+    app.config["METRICS_ENABLED"] = METRICS_ENABLED
+    app.config["LOGIN_ATTEMPTS_PER_ACCOUNT"] = LOGIN_ATTEMPTS_PER_ACCOUNT
+    app.config["LOGIN_ATTEMPTS_PER_IP"] = LOGIN_ATTEMPTS_PER_IP
+    app.config["LOGIN_RATE_LIMIT_PATH"] = LOGIN_RATE_LIMIT_PATH
+    app.config["PROXY_COUNT"] = PROXY_COUNT
+    app.config["REFRESH_TOKEN_TTL"] = REFRESH_TOKEN_TTL
+    if config:
+        app.config.update(config)
+    app.config.setdefault("SQLALCHEMY_ENGINE_OPTIONS", engine_options(app.config))
+    app.config.setdefault("SQLALCHEMY_BINDS", replicas.replica_binds(app.config["DATABASE_REPLICA_URLS"]))
+
+    # The engine itself is only created on first use
+    db.init_app(app)
+    replicas.init_app(app, db)
+
+    # Imported here because models imports `db` from this module
+    import models
+    models.init_app(app)
+
+    return app
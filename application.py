@@ -1,158 +1,230 @@
 #!/usr/bin/env python3
 
-from datetime import date
-from backports.datetime_fromisoformat import MonkeyPatch
-MonkeyPatch.patch_fromisoformat()
-from flask import jsonify
+import sys
+from datetime import datetime
+from itertools import islice
+# date(time).fromisoformat is built in from Python 3.7; the backport is only
+# imported (and patched in) where it is missing
+if sys.version_info < (3, 7):
+    from backports.datetime_fromisoformat import MonkeyPatch
+    MonkeyPatch.patch_fromisoformat()
+from flask import Blueprint, Response, request
 from flask_cors import cross_origin
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import joinedload
 
-from app_init import app, bcrypt, db
+from app_init import create_app, db
 from environment import ENVIRONMENT
-from utility import APIError, format_phone_number, normalize_phone_number, request_access_token, parse_request
-from models import User, Customer, Employee, Store, Transaction, TransactionLine, ItemType, UnitType
+from utility import APIError, request_access_token, parse_request, parse_ndjson, request_page, \
+    encode_cursor, next_page_link, conditional_response
+from models import User, Customer, Employee, Store, Transaction, RefreshToken
+from db_pool import pool_stats
+from export import check_export_range, export_connection, export_transactions, gzip_chunks
+from history_snapshots import find_snapshot
+import metrics
+from reference_data import reference_data
+from rate_limit import limit_login_attempts
+from replicas import use_replica
+from serializers import CUSTOMER_COLUMNS, customer_dict, json_array_response, json_response, \
+    transaction_dict
+from transactions import BULK_BATCH_SIZE, check_transaction, existing_loyalty_ids, insert_transactions
 
 # See also: "specification.md" for details concerning each endpoint
 
+api = Blueprint("api", __name__)
+
 # An endpoint not in specification meant to be for informational use only.
 # Neither the web nor mobile frontends depend on this value.
-@app.route("/", methods=["GET"])
+@api.route("/", methods=["GET"])
 def api_root():
-    return jsonify({
+    return json_response({
         "application": "Goodwill Omaha Backend API for Northwest Missouri "
             "State University Software Engineering Practice (2020 Spring)",
         "environment": ENVIRONMENT,
         "specification": "https://github.com/KHart0012/goodwill-omaha-2020-api/blob/master/specification.md"
     })
 
+# Also not in specification: this worker's database connection pool statistics
+# (see db_pool.py), for sizing DB_POOL_SIZE and DB_MAX_OVERFLOW against the
+# number of gunicorn workers.
+@api.route("/status/db-pool", methods=["GET"])
+def api_status_db_pool():
+    employee = User.from_authorization(request_access_token(), Employee)
+    return json_response(pool_stats(db.engine))
+
+# Sessions, for customers and employees alike ##################################
+
+@api.route("/token/refresh", methods=["POST"])
+@cross_origin()
+def api_token_refresh():
+    access_token, refresh_token = RefreshToken.rotate(parse_request("refreshToken"))
+
+    return json_response({
+        "accessToken": access_token,
+        "refreshToken": refresh_token
+    })
+
+@api.route("/token/revoke", methods=["POST"])
+@cross_origin()
+def api_token_revoke():
+    RefreshToken.revoke(parse_request("refreshToken"))
+
+    return json_response({})
+
 # Service API For Goodwill Omaha Customers #####################################
 
-@app.route("/customer/login", methods=["POST"])
+@api.route("/customer/login", methods=["POST"])
 @cross_origin()
 def api_customer_login():
     loyalty_id, password = parse_request("loyaltyID", "password")
+    limit_login_attempts("customer", loyalty_id)
 
     customer = Customer.find_and_authenticate(loyalty_id, password)
     if not customer:
         raise APIError.customer_authentication_failure()
 
-    return jsonify({
-        "accessToken": customer.generate_access_token()
-    })
+    tokens = {
+        "accessToken": customer.generate_access_token(),
+        "refreshToken": customer.generate_refresh_token()
+    }
+    db.session.commit()
+    return json_response(tokens)
 
-@app.route("/customer/info", methods=["GET"])
+@api.route("/customer/info", methods=["GET"])
 @cross_origin()
+@use_replica
 def api_customer_info():
     customer = User.from_authorization(request_access_token(), Customer)
 
-    humanized_phone, uri_phone = format_phone_number(customer.phone)
-
-    return jsonify({
-        "loyaltyID": customer.loyalty_id,
-        "firstName": customer.first_name,
-        "lastName": customer.last_name,
-        "address": {
-            "line1": customer.address1,
-            "line2": customer.address2,
-            "city": customer.city,
-            "state": customer.state,
-            "zip": customer.zip_code
-        },
-        "email": customer.email,
-        "phone": humanized_phone,
-        "phoneURI": uri_phone
-    })
+    return conditional_response(f"info-{customer.user_id}-{customer.version_id}",
+        lambda: json_response(customer_dict(customer)))
 
-@app.route("/customer/history", methods=["GET"])
+@api.route("/customer/history", methods=["GET"])
 @cross_origin()
+@use_replica
 def api_customer_history():
     customer = User.from_authorization(request_access_token(), Customer)
-    transactions = Transaction.query.filter_by(loyalty_id=customer.loyalty_id)
-
-    tax_years = map(lambda x : x.tax_year, transactions)
-    return jsonify({
-        "taxYears": list(set(tax_years))
-    })
-
-@app.route("/customer/history/year/<year>", methods=["GET"])
+    tax_years = db.session.query(Transaction.tax_year,
+            db.func.max(Transaction.transaction_id), db.func.count()) \
+        .filter_by(loyalty_id=customer.loyalty_id) \
+        .group_by(Transaction.tax_year) \
+        .order_by(Transaction.tax_year) \
+        .all()
+
+    # Transactions are only ever added, so the newest one and the number of
+    # them identify the list of years
+    newest_id = max((max_id for tax_year, max_id, count in tax_years), default=0)
+    transaction_count = sum(count for tax_year, max_id, count in tax_years)
+
+    return conditional_response(f"history-{customer.loyalty_id}-{newest_id}-{transaction_count}",
+        lambda: json_response({
+            "taxYears": [tax_year for tax_year, max_id, count in tax_years]
+        }))
+
+@api.route("/customer/history/year/<year>", methods=["GET"])
 @cross_origin()
+@use_replica
 def api_customer_history_year(year):
     customer = User.from_authorization(request_access_token(), Customer)
-    transactions = Transaction.query.filter_by(loyalty_id=customer.loyalty_id)
-
-    history = []
-    for transaction in transactions:
-        if transaction.tax_year == int(year):
-            transaction_lines = TransactionLine.query.filter_by(transaction_id=transaction.transaction_id)
-            items = []
-            for transaction_line in transaction_lines:
-                items.append({
-                    "itemType": ItemType.query.get(transaction_line.item_type_id).item_type,
-                    "unit": UnitType.query.get(transaction_line.unit_type_id).unit_type,
-                    "quantity": transaction_line.quantity,
-                    "description": transaction_line.description
-                })
-
-            history.append({
-                "transactionID": transaction.transaction_id,
-                "date": str(transaction.date.date()),
-                "taxYear": year,
-                "items": items
-            })
-
-    return jsonify({
-        "history": history
-    })
+
+    reference = reference_data.current()
+    limit, after = request_page()
+
+    # The year's newest transaction and the number of them, together with the
+    # item and unit type names, identify the response
+    newest_id, transaction_count = db.session.query(
+            db.func.max(Transaction.transaction_id), db.func.count()) \
+        .filter_by(loyalty_id=customer.loyalty_id, tax_year=int(year)) \
+        .one()
+    etag = f"history-{customer.loyalty_id}-{int(year)}-{newest_id or 0}-{transaction_count}-{reference.version}"
+
+    def build_response():
+        # A closed year's history is usually served as built ahead of time,
+        # when it fits on the first page. The current year is still open and
+        # never has a snapshot.
+        if not after and transaction_count <= limit and int(year) < datetime.today().year:
+            payload = find_snapshot(customer.loyalty_id, int(year), newest_id, transaction_count,
+                reference)
+            if payload is not None:
+                return Response(b'{"history":' + payload + b',"next":null}',
+                    mimetype="application/json")
+
+        # Filter by year in SQL and pull every line in the same query, so the
+        # number of round trips doesn't grow with the number of transactions or
+        # lines. Item and unit type names come from the in-memory reference data.
+        transactions = Transaction.query \
+            .filter_by(loyalty_id=customer.loyalty_id, tax_year=int(year)) \
+            .options(joinedload(Transaction.lines)) \
+            .order_by(Transaction.date, Transaction.transaction_id)
+
+        # Transactions come a page at a time, in (date, transactionID) order
+        if after:
+            try:
+                after_date, after_id = datetime.fromisoformat(after[0]), int(after[1])
+            except (TypeError, ValueError, IndexError):
+                raise APIError.bad_cursor()
+            transactions = transactions.filter(or_(
+                Transaction.date > after_date,
+                and_(Transaction.date == after_date, Transaction.transaction_id > after_id)))
+
+        # One extra row tells whether there is another page
+        transactions = transactions.limit(limit + 1).all()
+        next_cursor = None
+        if len(transactions) > limit:
+            transactions = transactions[:limit]
+            last = transactions[-1]
+            next_cursor = encode_cursor(last.date.isoformat(), last.transaction_id)
+
+        # Types used by these lines may have been added since the reference
+        # data was loaded
+        names = reference_data.covering(reference, (line for transaction in transactions
+            for line in transaction.lines))
+        return json_response({
+            "history": [transaction_dict(transaction, names) for transaction in transactions],
+            "next": next_cursor
+        })
+
+    return conditional_response(etag, build_response)
 
 # Service API For Goodwill Omaha Employees #####################################
 
-@app.route("/employee/login", methods=["POST"])
+@api.route("/employee/login", methods=["POST"])
 @cross_origin()
 def api_employee_login():
     employee_id, password = parse_request("employeeID", "password")
+    limit_login_attempts("employee", employee_id)
 
     employee = Employee.find_and_authenticate(employee_id, password)
     if not employee:
         raise APIError.employee_authentication_failure()
 
-    return jsonify({
-        "accessToken": employee.generate_access_token()
-    })
+    tokens = {
+        "accessToken": employee.generate_access_token(),
+        "refreshToken": employee.generate_refresh_token()
+    }
+    db.session.commit()
+    return json_response(tokens)
 
-@app.route("/customer/<loyalty_id>/info", methods=["GET"])
+@api.route("/customer/<loyalty_id>/info", methods=["GET"])
 @cross_origin()
+@use_replica
 def api_customer_lookup_info(loyalty_id):
     # Authenticates the employee to access Database
     employee = User.from_authorization(request_access_token(), Employee)
 
     # Queries Database to find customer with entered loyalty_id
-    customer = Customer.query.filter_by(loyalty_id=loyalty_id).first()
+    customer = db.session.query(*CUSTOMER_COLUMNS).filter(Customer.loyalty_id == loyalty_id).first()
 
     # If no customer is found, raise a 404 error
     if customer is None:
         raise APIError(404, "NOT_FOUND", "Loyalty ID Not Found")
 
-    # Generated easily readable phone number and phone URI
-    humanized_phone, uri_phone = format_phone_number(customer.phone)
-
     # Return information of the customer that was matched with the loyalty_id
-    return jsonify({
-        "loyaltyID": customer.loyalty_id,
-        "firstName": customer.first_name,
-        "lastName": customer.last_name,
-        "address": {
-            "line1": customer.address1,
-            "line2": customer.address2,
-            "city": customer.city,
-            "state": customer.state,
-            "zip": customer.zip_code
-        },
-        "email": customer.email,
-        "phone": humanized_phone,
-        "phoneURI": uri_phone
-    })
+    return json_response(customer_dict(customer))
 
-@app.route("/customer/by/<field_name>/<field_value>", methods=["GET"])
-@cross_origin()
+@api.route("/customer/by/<field_name>/<field_value>", methods=["GET"])
+@cross_origin(expose_headers=["Link"])
+@use_replica
 def api_customer_lookup_info_by(field_name, field_value):
     # Authenticates the employee to access Database
     employee = User.from_authorization(request_access_token(), Employee)
@@ -160,48 +232,38 @@ def api_customer_lookup_info_by(field_name, field_value):
     # Checks what field_name was passed in, and based on that, queries the database
     # for and returns all results with the matching field_value
     # If the field name does not match an accepted field name, raises 400 error
-    if field_name.lower() == 'firstname':
-        customers = Customer.query.filter(db.func.lower(Customer.first_name) == field_value.lower()).all()
-    elif field_name.lower() == 'lastname':
-        customers = Customer.query.filter(db.func.lower(Customer.last_name) == field_value.lower()).all()
-    elif field_name.lower() == 'email':
-        customers = Customer.query.filter(db.func.lower(Customer.email) == field_value.lower()).all()
-    elif field_name.lower() == 'phone':
-        customers = Customer.query.filter(Customer.phone == normalize_phone_number(field_value)).all()
-    else:
+    criterion = Customer.lookup_criterion(field_name, field_value)
+    if criterion is None:
         raise APIError(400, "INVAILD_FIELD_NAME", "Field name is not in the list of acceptable field names")
 
-    # If field name is correct but no customers with matching field value
-    # is found, returns empty array
-    if customers is None:
-        return jsonify([])
-
-    # Creates list of different customer's information that match the field value
-    cust_infos = []
-    for customer in customers:
-        humanized_phone, uri_phone = format_phone_number(customer.phone)
-
-        # Add the customer's information to the cust_infos list
-        cust_infos.append({
-            "loyaltyID": customer.loyalty_id,
-            "firstName": customer.first_name,
-            "lastName": customer.last_name,
-            "address": {
-                "line1": customer.address1,
-                "line2": customer.address2,
-                "city": customer.city,
-                "state": customer.state,
-                "zip": customer.zip_code
-            },
-            "email": customer.email,
-            "phone": humanized_phone,
-            "phoneURI": uri_phone
-        })
-
-    # Returns all found customer's information
-    return jsonify(cust_infos)
-
-@app.route("/customer/transaction", methods=["POST"])
+    limit, after = request_page()
+    after_user_id = None
+    if after:
+        try:
+            after_user_id = int(after[0])
+        except (TypeError, ValueError, IndexError):
+            raise APIError.bad_cursor()
+
+    customers = customer_lookup_query(criterion, after_user_id, limit).all()
+    headers = {}
+    if len(customers) > limit:
+        customers = customers[:limit]
+        headers["Link"] = next_page_link(limit, encode_cursor(customers[-1].user_id))
+
+    # Returns this page of found customer's information
+    return json_array_response(customers, customer_dict, headers=headers)
+
+# Returns the query for a page of the customers matching `criterion` (see
+# Customer.lookup_criterion) whose user_id is over `after_user_id` (None for
+# the first page). Customers come in user_id order, which the lookup indexes
+# already provide, and one extra row tells whether there is another page.
+def customer_lookup_query(criterion, after_user_id, limit):
+    customers = db.session.query(User.user_id, *CUSTOMER_COLUMNS).filter(criterion)
+    if after_user_id is not None:
+        customers = customers.filter(User.user_id > after_user_id)
+    return customers.order_by(User.user_id).limit(limit + 1)
+
+@api.route("/customer/transaction", methods=["POST"])
 @cross_origin()
 def api_customer_transaction():
     # Authenticates the employee to access Database
@@ -210,68 +272,134 @@ def api_customer_transaction():
     # Grabs information from the JSON POST data that is used to make transaction information.
     loyalty_id, store_id, date_, items = parse_request("loyaltyID", "storeID", "date", "items")
 
-    # Converts date to iso format using datetime library
-    date_of_transaction = date.fromisoformat(date_)
+    # Store, item type and unit type names are checked against the in-memory
+    # reference data, and every line is checked before anything is written so
+    # a bad line can't leave a partial transaction behind
+    transaction = check_transaction(reference_data.current(), loyalty_id, store_id, date_, items)
 
-    # HANDLE ERROR IF ITEMS IS EMPTY
-    if len(items) == 0:
-        raise APIError(400, "EMPTY_SET", "No items in list")
+    # An unknown customer is reported the same way as by the bulk endpoint,
+    # rather than left to the foreign key
+    if transaction[0]["loyalty_id"] not in existing_loyalty_ids([transaction[0]["loyalty_id"]]):
+        raise APIError(404, "NOT_FOUND", "Loyalty ID Not Found")
+
+    # The header and all of its lines are committed together
+    transaction_id, = insert_transactions([transaction])
+    db.session.commit()
 
-    # Create Transaction in order to have a transaction_id to put in each TransactionLine
-    transaction = Transaction(
-        date_of_transaction,
-        loyalty_id,
-        store_id,
-        date_of_transaction.year
-    )
+    # Return transaction id to signal success
+    return json_response({"transactionID": transaction_id})
+
+@api.route("/customer/transaction/bulk", methods=["POST"])
+@cross_origin()
+def api_customer_transaction_bulk():
+    # Authenticates the employee to access Database
+    employee = User.from_authorization(request_access_token(), Employee)
 
-    # Adds and commits the database transaction so that the transaction.transaction_id
-    # field can be populated.
-    db.session.add(transaction)
+    # Stores syncing at closing time may send thousands of transactions, either
+    # as NDJSON (read a line at a time) or as a JSON object
+    if request.mimetype == "application/x-ndjson":
+        records = parse_ndjson(request.stream)
+    else:
+        records = parse_request("transactions")
+        if not isinstance(records, list):
+            raise APIError(400, "BAD_TRANSACTIONS", "Transactions must be a list")
+
+    # Transactions are checked and inserted BULK_BATCH_SIZE at a time as they
+    # are read, so an NDJSON body is never held in memory all at once. A bad
+    # record is reported in its result and skipped, but doesn't stop the rest
+    # of the batch from being inserted.
+    reference = reference_data.current()
+    records = enumerate(records)
+    results = []
+    inserted = 0
+    while True:
+        batch = list(islice(records, BULK_BATCH_SIZE))
+        if not batch:
+            break
+
+        batch_results = {}
+        checked = []
+        for index, record in batch:
+            try:
+                if isinstance(record, APIError):
+                    raise record
+                if not isinstance(record, dict):
+                    raise APIError(400, "BAD_TRANSACTION", "Each transaction must be an object")
+                for field in ("loyaltyID", "storeID", "date", "items"):
+                    if field not in record:
+                        raise APIError(400, "MISSING_FIELD", f"Transaction is missing \"{field}\"")
+
+                checked.append((index, check_transaction(reference, record["loyaltyID"],
+                    record["storeID"], record["date"], record["items"])))
+            except APIError as e:
+                batch_results[index] = {"index": index, "errorCode": e.errorCode, "error": e.error}
+
+        known_loyalty_ids = existing_loyalty_ids(transaction["loyalty_id"]
+            for index, (transaction, lines) in checked)
+        valid = []
+        for index, transaction in checked:
+            if transaction[0]["loyalty_id"] in known_loyalty_ids:
+                valid.append((index, transaction))
+            else:
+                batch_results[index] = {"index": index, "errorCode": "NOT_FOUND", "error": "Loyalty ID Not Found"}
+
+        # Each batch's valid transactions go in with multi-row INSERTs
+        transaction_ids = insert_transactions([transaction for index, transaction in valid])
+        for (index, transaction), transaction_id in zip(valid, transaction_ids):
+            batch_results[index] = {"index": index, "transactionID": transaction_id}
+
+        results.extend(batch_results[index] for index, record in batch)
+        inserted += len(valid)
+
+    # Everything is committed together, once the whole request has been read
     db.session.commit()
 
-    # Create transaction line for every item in the transaction
-    for item in items:
-
-        # If item type is None, delete transaction and commit
-        # the change to cancel the transaction
-        item_type_id = ItemType.query.filter(db.func.lower(ItemType.item_type) == item["itemType"].lower()).first()
-        if item_type_id is None:
-            db.session.delete(transaction)
-            db.session.commit()
-            raise APIError(400, "BAD_ITEM_TYPE", "Item Type does not exist")
-
-        # If unit type is None, delete transaction and commit
-        # the change to cancel the transaction
-        unit_type_id = UnitType.query.filter(db.func.lower(UnitType.unit_type) == item["unit"].lower()).first()
-        if unit_type_id is None:
-            db.session.delete(transaction)
-            db.session.commit()
-            raise APIError(400, "BAD_UNIT_TYPE", "Unit Type does not exist")
-
-        # Create a new TransactionLine item
-        transaction_line = TransactionLine(
-            item_type_id.item_type_id,
-            unit_type_id.unit_type_id,
-            item["quantity"],
-            item["description"],
-            transaction.transaction_id
-        )
-
-        # Add and commit the TransactionLine to the database
-        db.session.add(transaction_line)
-        db.session.commit()
+    return json_response({
+        "inserted": inserted,
+        "failed": len(results) - inserted,
+        "results": results
+    })
+
+@api.route("/transaction/export", methods=["GET"])
+@cross_origin()
+@use_replica
+def api_transaction_export():
+    # Authenticates the employee to access Database
+    employee = User.from_authorization(request_access_token(), Employee)
 
+    tax_year, start, end = check_export_range(request.args.get("taxYear"),
+        request.args.get("from"), request.args.get("to"))
 
-    # Return transaction id to signal success
-    return jsonify({"transactionID": transaction.transaction_id})
+    # Streamed as it is read, so the export's size doesn't affect this
+    # worker's memory use
+    chunks = export_transactions(export_connection(), tax_year, start, end)
+    headers = {"Vary": "Accept-Encoding"}
+    if request.accept_encodings["gzip"]:
+        chunks = gzip_chunks(chunks)
+        headers["Content-Encoding"] = "gzip"
+    return Response(chunks, headers=headers, mimetype="application/x-ndjson")
 
 ## Error handling ##############################################################
 
-@app.errorhandler(APIError)
+@api.app_errorhandler(APIError)
 def api_error_handler(e):
     return e.api_error_response()
 
+## App #########################################################################
+
+# Creates the app with all of the endpoints above.
+#
+# config: optionally, a dict of settings overriding the ones from environment.py
+def create_api_app(config=None):
+    app = create_app(config)
+    app.register_blueprint(api)
+    if app.config["METRICS_ENABLED"]:
+        metrics.init_app(app)
+    return app
+
+# What gunicorn serves (see Procfile)
+app = create_api_app()
+
 # Used if you call ./application.py directly, unused on heroku service
 if __name__ == '__main__':
     app.run(debug=True)
@@ -0,0 +1,93 @@
+import hmac
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import bcrypt
+
+# Checking a password costs about 250 ms of CPU at the default
+# BCRYPT_LOG_ROUNDS. Done inline, a burst of logins ties up every web worker
+# and starves all other endpoints. Instead, login requests hand the check to a
+# small pool of dedicated processes (so it scales across cores) and wait for
+# the answer. With gunicorn's threaded workers (see Procfile), the other
+# requests keep being served in the meantime.
+#
+# At most `processes + queue_depth` checks may be running or waiting at once
+# per web worker. Beyond that, check_password_hash raises BcryptPoolSaturated
+# immediately, and the login is refused with a 503 rather than queued.
+#
+# Keep this module's imports light: every pool process imports it.
+
+class BcryptPoolSaturated(Exception):
+    pass
+
+# Hashes a new password; this is not done in the pool, since it only happens
+# when an account is created.
+#
+# returns: the hash as a string, ready to be stored
+def generate_password_hash(password, rounds):
+    if isinstance(password, str):
+        password = password.encode("utf-8")
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds)).decode("utf-8")
+
+# Runs inside a pool process. Equivalent to flask_bcrypt's check_password_hash.
+def _check_password_hash(pw_hash, password):
+    if isinstance(pw_hash, str):
+        pw_hash = pw_hash.encode("utf-8")
+    if isinstance(password, str):
+        password = password.encode("utf-8")
+    return hmac.compare_digest(bcrypt.hashpw(password, pw_hash), pw_hash)
+
+class BcryptPool:
+    # processes: the number of pool processes. 0 disables the pool, checking
+    #            passwords inline instead (useful for development and tests).
+    # queue_depth: how many more checks may wait for a free process.
+    def __init__(self, processes=0, queue_depth=0):
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self.configure(processes, queue_depth)
+
+    # Changes the pool's size; only takes effect in processes that haven't
+    # started their pool yet.
+    def configure(self, processes, queue_depth):
+        self.processes = processes
+        self._slots = threading.BoundedSemaphore(max(processes, 1) + queue_depth)
+
+    def check_password_hash(self, pw_hash, password):
+        if not self._slots.acquire(blocking=False):
+            raise BcryptPoolSaturated()
+        try:
+            if self.processes == 0:
+                return _check_password_hash(pw_hash, password)
+            executor = self._get_executor()
+            try:
+                return executor.submit(_check_password_hash, pw_hash, password).result()
+            except BrokenProcessPool:
+                # A pool process died (e.g. killed for running out of memory),
+                # which breaks the whole pool for good: start another
+                self._discard_executor(executor)
+                return self._get_executor().submit(_check_password_hash, pw_hash, password).result()
+        finally:
+            self._slots.release()
+
+    # The pool is started lazily, and again in any process forked after it was
+    # started: gunicorn forks its workers after importing the app, and a forked
+    # child can't use its parent's pool.
+    def _get_executor(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                self._executor = ProcessPoolExecutor(self.processes,
+                    mp_context=multiprocessing.get_context("spawn"))
+                self._pid = os.getpid()
+            return self._executor
+
+    # Forgets a broken `executor`, unless another thread already replaced it
+    def _discard_executor(self, executor):
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+                self._pid = None
+        executor.shutdown(wait=False)
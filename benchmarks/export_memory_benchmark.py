@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+
+# PURPOSE
+#
+# Checks that GET /transaction/export streams: exports a year of generated
+# transactions through the full request stack while sampling this process's
+# resident memory, and reports the export rate and how much the memory grew.
+# Exits with status 1 if it grew more than --max-growth-mb.
+#
+# HOW TO USE
+#
+#     python benchmarks/export_memory_benchmark.py --lines 5000000 --gzip
+#
+# By default this runs against a throwaway SQLite file. To measure against a
+# real database (where the export uses a server-side cursor), set DATABASE_URL
+# (or environment.json) to a migrated and seeded Postgres database; note that
+# the benchmark inserts real transactions for the test customer (loyalty ID
+# 67417) in tax year 1999.
+#
+# Linux only (memory is read from /proc).
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+os.environ.setdefault("DATABASE_URL", "sqlite:///" + os.path.join(tempfile.mkdtemp(), "benchmark.db"))
+
+from datetime import datetime
+
+import manage
+from application import app
+from app_init import db
+from models import Transaction, TransactionLine
+
+TAX_YEAR = 1999
+LINES_PER_TRANSACTION = 5
+INSERT_BATCH_SIZE = 10000
+
+def rss_mb():
+    with open("/proc/self/statm") as file:
+        return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+
+def insert_transactions(lines):
+    transactions = lines // LINES_PER_TRANSACTION
+    first_id = (db.session.query(db.func.max(Transaction.transaction_id)).scalar() or 0) + 1
+    for start in range(0, transactions, INSERT_BATCH_SIZE):
+        ids = range(first_id + start, first_id + min(start + INSERT_BATCH_SIZE, transactions))
+        db.session.execute(Transaction.__table__.insert(), [{
+            "transaction_id": id, "date": datetime(TAX_YEAR, 1 + id % 12, 1 + id % 28),
+            "loyalty_id": 67417, "store_id": 1, "tax_year": TAX_YEAR,
+        } for id in ids])
+        db.session.execute(TransactionLine.__table__.insert(), [{
+            "transaction_id": id, "item_type_id": 1 + n % 4, "unit_type_id": 1 + n % 3,
+            "quantity": n + 1, "description": "Benchmark",
+        } for id in ids for n in range(LINES_PER_TRANSACTION)])
+        db.session.commit()
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the memory use of the transaction export.")
+    parser.add_argument("--lines", type=int, default=1000000)
+    parser.add_argument("--gzip", action="store_true")
+    parser.add_argument("--max-growth-mb", type=float, default=50)
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    with app.app_context():
+        if db.engine.dialect.name == "sqlite":
+            db.create_all()
+        manage.seed_db()
+        insert_transactions(args.lines)
+
+    client = app.test_client()
+    login = client.post("/employee/login", json={"employeeID": "67416", "password": "hunter3"})
+    headers = {"Authorization": "Bearer " + login.get_json()["accessToken"]}
+    if args.gzip:
+        headers["Accept-Encoding"] = "gzip"
+
+    started_rss = peak_rss = rss_mb()
+    started = time.perf_counter()
+    response = client.get(f"/transaction/export?taxYear={TAX_YEAR}", headers=headers, buffered=False)
+    if response.status_code != 200:
+        raise RuntimeError(f"Export failed: {response.status_code} {response.get_data()!r}")
+
+    exported_bytes = 0
+    for i, chunk in enumerate(response.response):
+        exported_bytes += len(chunk)
+        if i % 100 == 0:
+            peak_rss = max(peak_rss, rss_mb())
+    response.close()
+    elapsed = time.perf_counter() - started
+    peak_rss = max(peak_rss, rss_mb())
+
+    results = {
+        "lines": args.lines,
+        "gzip": args.gzip,
+        "seconds": elapsed,
+        "linesPerSecond": args.lines / elapsed,
+        "exportedMB": exported_bytes / 2**20,
+        "startRssMB": started_rss,
+        "peakRssMB": peak_rss,
+        "rssGrowthMB": peak_rss - started_rss,
+    }
+    print(f"exported {args.lines} lines ({results['exportedMB']:.1f} MB) in {elapsed:.1f} s "
+        f"({results['linesPerSecond']:.0f} lines/s); RSS {started_rss:.1f} MB -> peak {peak_rss:.1f} MB "
+        f"(+{results['rssGrowthMB']:.1f} MB)")
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+
+    if results["rssGrowthMB"] > args.max_growth_mb:
+        print("Memory grew during the export", file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
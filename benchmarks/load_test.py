@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+
+# PURPOSE
+#
+# Measures throughput and latency of a running API server under a realistic
+# mix of requests: customers logging in and reading their info, tax years and
+# year details, and employees looking customers up and posting transactions.
+# Reports requests per second and p50/p95/p99 latency per route, and can write
+# them to a JSON file to compare against another commit's.
+#
+# HOW TO USE
+#
+# Load a database with production-sized data first, e.g.
+#
+#     python manage.py db upgrade && python manage.py seed_db
+#     python manage.py seed_bulk --customers 100000
+#
+# then either point this at a server that is already running:
+#
+#     python benchmarks/load_test.py --url http://127.0.0.1:8000 --duration 60
+#
+# or have it start gunicorn (as in the Procfile) on the database in
+# DATABASE_URL / environment.json, for the length of the run:
+#
+#     python benchmarks/load_test.py --start-server --workers 4 --output before.json
+#     (check out another commit)
+#     python benchmarks/load_test.py --start-server --workers 4 --output after.json --compare before.json
+#
+# Customers are picked among --loyalty-ids (by default the first ones added by
+# seed_bulk), all sharing --password. Posted transactions are real, so run
+# this against a database that can take them.
+#
+# A server started by --start-server has no login rate limits; start one given
+# with --url with LOGIN_ATTEMPTS_PER_IP=0 and LOGIN_ATTEMPTS_PER_ACCOUNT=0, or
+# its logins will mostly be refused.
+
+import argparse
+import itertools
+import json
+import math
+import os
+import random
+import subprocess
+import threading
+import time
+from base64 import b64encode
+from datetime import date
+
+import requests
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+# The request mix, by weight
+MIX = {
+    "POST /customer/login": 5,
+    "GET /customer/info": 20,
+    "GET /customer/history": 15,
+    "GET /customer/history/year/<year>": 25,
+    "GET /customer/<loyalty_id>/info": 5,
+    "GET /customer/by/<field_name>/<field_value>": 20,
+    "POST /customer/transaction": 10,
+}
+
+# As generated by bulk_seed.py and seed_db
+LAST_NAMES = ["Smith", "Johnson", "Williams", "Brown", "Jones", "Garcia", "Miller", "Davis", "Martinez",
+    "Lee", "Nguyen", "Walker"]
+ITEM_TYPES = ["Clothing", "Furniture", "Wares", "Misc"]
+UNIT_TYPES = ["Box", "Bag", "Each"]
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the API.")
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--start-server", action="store_true",
+        help="start gunicorn on the port of --url for the run")
+    parser.add_argument("--workers", type=int, default=2, help="gunicorn workers, with --start-server")
+    parser.add_argument("--concurrency", type=int, default=16, help="simultaneous clients")
+    parser.add_argument("--duration", type=float, default=30, help="seconds measured")
+    parser.add_argument("--warmup", type=float, default=5, help="seconds run before measuring")
+    parser.add_argument("--loyalty-ids", default="100000-100999", help="range of customers to use")
+    parser.add_argument("--password", default="hunter2", help="of the customers")
+    parser.add_argument("--employee-id", default="67416")
+    parser.add_argument("--employee-password", default="hunter3")
+    parser.add_argument("--sessions", type=int, default=50, help="customers logged in up front")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--compare", help="results JSON of an earlier run to compare with")
+    args = parser.parse_args()
+
+    server = start_server(args.url, args.workers) if args.start_server else None
+    try:
+        first, last = (int(loyalty_id) for loyalty_id in args.loyalty_ids.split("-"))
+        generator = random.Random(args.seed)
+        sessions = log_in_customers(args.url, generator.sample(range(first, last + 1), args.sessions),
+            args.password)
+        employee = log_in(args.url, "employee", "employeeID", args.employee_id, args.employee_password)
+
+        results = run(args, sessions, employee, generator)
+        results["commit"] = current_commit()
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    report(results, args.compare)
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2, sort_keys=True)
+            file.write("\n")
+
+def start_server(url, workers):
+    port = url.rsplit(":", 1)[1].split("/")[0]
+    # Without a JWT_SECRET, each worker would make up its own, and reject the
+    # others' tokens
+    environ = dict(os.environ)
+    environ.setdefault("JWT_SECRET", b64encode(os.urandom(32)).decode())
+    # Every client connects from this machine, so the login rate limits (see
+    # rate_limit.py) would refuse most logins
+    environ.setdefault("LOGIN_ATTEMPTS_PER_IP", "0")
+    environ.setdefault("LOGIN_ATTEMPTS_PER_ACCOUNT", "0")
+    server = subprocess.Popen(["gunicorn", "--config", "gunicorn.conf.py", "--worker-class", "gthread",
+        "--threads", "8", "--workers", str(workers), "--bind", "127.0.0.1:" + port, "application:app"],
+        cwd=ROOT, env=environ)
+    for i in itertools.count():
+        try:
+            time.sleep(0.5)
+            requests.get(url + "/").raise_for_status()
+            return server
+        except requests.ConnectionError:
+            if i >= 20:
+                server.terminate()
+                raise
+
+# The commit of the working tree, to tell result files apart
+def current_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, check=True,
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL).stdout.decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def log_in(url, user_type, id_field, user_id, password):
+    req = requests.post(f"{url}/{user_type}/login", json={id_field: str(user_id), "password": password})
+    req.raise_for_status()
+    return {"Authorization": "Bearer " + req.json()["accessToken"]}
+
+# Logs the customers in and finds out their tax years
+#
+# returns: a list of (loyalty ID, headers, tax years)
+def log_in_customers(url, loyalty_ids, password):
+    sessions = []
+    for loyalty_id in loyalty_ids:
+        headers = log_in(url, "customer", "loyaltyID", loyalty_id, password)
+        req = requests.get(url + "/customer/history", headers=headers)
+        req.raise_for_status()
+        years = req.json()["taxYears"]
+        sessions.append((loyalty_id, headers, years))
+    return sessions
+
+# Returns (method, path, keyword arguments of requests) for a request of `route`
+def make_request(route, args, sessions, employee, generator):
+    loyalty_id, headers, years = generator.choice(sessions)
+    if route == "POST /customer/login":
+        return "POST", "/customer/login", {"json": {"loyaltyID": str(loyalty_id), "password": args.password}}
+    if route == "GET /customer/info":
+        return "GET", "/customer/info", {"headers": headers}
+    if route == "GET /customer/history":
+        return "GET", "/customer/history", {"headers": headers}
+    if route == "GET /customer/history/year/<year>":
+        year = generator.choice(years) if years else date.today().year
+        return "GET", f"/customer/history/year/{year}", {"headers": headers}
+    if route == "GET /customer/<loyalty_id>/info":
+        return "GET", f"/customer/{loyalty_id}/info", {"headers": employee}
+    if route == "GET /customer/by/<field_name>/<field_value>":
+        return "GET", f"/customer/by/lastName/{generator.choice(LAST_NAMES)}", {"headers": employee}
+    if route == "POST /customer/transaction":
+        return "POST", "/customer/transaction", {"headers": employee, "json": {
+            "loyaltyID": loyalty_id, "storeID": 1, "date": date.today().isoformat(),
+            "items": [{
+                "itemType": generator.choice(ITEM_TYPES), "unit": generator.choice(UNIT_TYPES),
+                "quantity": generator.randint(1, 5), "description": "Load test",
+            } for i in range(generator.randint(1, 5))],
+        }}
+    raise ValueError(route)
+
+def run(args, sessions, employee, generator):
+    routes, weights = list(MIX), list(MIX.values())
+    latencies = {route: [] for route in routes}
+    errors = {route: 0 for route in routes}
+    lock = threading.Lock()
+    started = time.monotonic()
+    measure_from = started + args.warmup
+    stop_at = measure_from + args.duration
+
+    def client(seed):
+        local_generator = random.Random(seed)
+        http = requests.Session()
+        while True:
+            route = local_generator.choices(routes, weights)[0]
+            method, path, kwargs = make_request(route, args, sessions, employee, local_generator)
+            request_started = time.monotonic()
+            if request_started >= stop_at:
+                return
+            try:
+                ok = http.request(method, args.url + path, **kwargs).status_code < 400
+            except requests.RequestException:
+                ok = False
+            elapsed = time.monotonic() - request_started
+            if request_started >= measure_from:
+                with lock:
+                    latencies[route].append(elapsed)
+                    errors[route] += not ok
+
+    threads = [threading.Thread(target=client, args=(generator.random(),)) for i in range(args.concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    results = {
+        "settings": {"concurrency": args.concurrency, "duration": args.duration, "sessions": args.sessions},
+        "routes": {},
+    }
+    for route in routes:
+        results["routes"][route] = summarize(latencies[route], errors[route], args.duration)
+    results["total"] = summarize([latency for route in routes for latency in latencies[route]],
+        sum(errors.values()), args.duration)
+    return results
+
+def summarize(latencies, errors, duration):
+    latencies = sorted(latencies)
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": round(len(latencies) / duration, 1),
+        "p50Ms": percentile(latencies, 50),
+        "p95Ms": percentile(latencies, 95),
+        "p99Ms": percentile(latencies, 99),
+    }
+
+# Nearest-rank percentile of sorted latencies in seconds, in milliseconds
+def percentile(latencies, p):
+    if not latencies:
+        return None
+    return round(1000 * latencies[max(0, math.ceil(p / 100 * len(latencies)) - 1)], 1)
+
+def report(results, compare):
+    previous = None
+    if compare:
+        with open(compare) as file:
+            previous = json.load(file)
+
+    print(f"{'route':45} {'rps':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    rows = list(results["routes"].items()) + [("total", results["total"])]
+    for route, stats in rows:
+        print(f"{route:45} {stats['rps']:8.1f} {format_ms(stats['p50Ms'])} {format_ms(stats['p95Ms'])} "
+            f"{format_ms(stats['p99Ms'])} {stats['errors']:7}")
+        if previous is not None:
+            before = previous["total"] if route == "total" else previous["routes"].get(route)
+            if before:
+                print(f"{'  vs ' + compare:45} {change(before['rps'], stats['rps'])} "
+                    f"{change(before['p50Ms'], stats['p50Ms'])} {change(before['p95Ms'], stats['p95Ms'])} "
+                    f"{change(before['p99Ms'], stats['p99Ms'])}")
+
+def format_ms(value):
+    return f"{value:8.1f}" if value is not None else f"{'-':>8}"
+
+def change(before, after):
+    if not before or after is None:
+        return f"{'-':>8}"
+    return f"{100 * (after - before) / before:+7.0f}%"
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+
+# PURPOSE
+#
+# Measures how much recording request metrics (see metrics.py) adds to the
+# time taken by requests, by timing the same requests with METRICS_ENABLED off
+# and on. Each setting runs in its own fresh interpreter, since the database
+# hooks of metrics.py apply process-wide once installed; the runs alternate,
+# and the best of them is kept for each setting.
+#
+# HOW TO USE
+#
+#     python benchmarks/metrics_overhead_benchmark.py --requests 2000 --rounds 5
+#
+# Runs against a throwaway SQLite file; no database needs to be running. With
+# --max-overhead, exits with status 1 if any endpoint is slowed down by more
+# than that percentage.
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+ENDPOINTS = ["/", "/customer/info", "/customer/history", "/customer/history/year/2019"]
+
+def seed(database_url):
+    sys.path.insert(0, ROOT)
+    os.environ["DATABASE_URL"] = database_url
+    from application import create_api_app
+    from app_init import db
+    from models import Customer, Employee, Store, ItemType, UnitType, Transaction, TransactionLine
+
+    app = create_api_app({"BCRYPT_LOG_ROUNDS": 4, "METRICS_ENABLED": False})
+    with app.app_context():
+        db.create_all()
+        customer = Customer(67417, "hunter2", "Benchmark", "Customer")
+        db.session.add(customer)
+        store = Store("Goodwill Omaha Headquarters")
+        item_type = ItemType("Clothing")
+        unit_type = UnitType("Bag")
+        db.session.add_all([store, item_type, unit_type])
+        db.session.flush()
+        for day in range(1, 29):
+            transaction = Transaction(datetime(2019, 2, day), customer.loyalty_id, store.store_id, 2019)
+            transaction.lines.append(
+                TransactionLine(item_type.item_type_id, unit_type.unit_type_id, 1, "Shirts", None))
+            db.session.add(transaction)
+        db.session.commit()
+
+# Run in a child interpreter: times `requests` requests of each endpoint and
+# prints the microseconds per request as JSON
+def measure(requests):
+    sys.path.insert(0, ROOT)
+    from application import create_api_app
+
+    app = create_api_app({"BCRYPT_LOG_ROUNDS": 4, "BCRYPT_POOL_SIZE": 0})
+    client = app.test_client()
+    login = client.post("/customer/login", json={"loyaltyID": "67417", "password": "hunter2"})
+    headers = {"Authorization": "Bearer " + login.get_json()["accessToken"]}
+
+    results = {}
+    for endpoint in ENDPOINTS:
+        for i in range(requests // 10):
+            client.get(endpoint, headers=headers)
+        started = time.perf_counter()
+        for i in range(requests):
+            client.get(endpoint, headers=headers)
+        results[endpoint] = 1e6 * (time.perf_counter() - started) / requests
+    print(json.dumps(results))
+
+def run(database_url, enabled, requests):
+    environ = dict(os.environ, DATABASE_URL=database_url, METRICS_ENABLED="true" if enabled else "false")
+    environ.pop("PROMETHEUS_MULTIPROC_DIR", None)
+    environ.pop("prometheus_multiproc_dir", None)
+    output = subprocess.run([sys.executable, __file__, "--measure", "--requests", str(requests)],
+        env=environ, check=True, stdout=subprocess.PIPE).stdout
+    return json.loads(output)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the overhead of request metrics.")
+    parser.add_argument("--requests", type=int, default=2000, help="requests per endpoint and round")
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--max-overhead", type=float, help="percentage to fail above")
+    parser.add_argument("--measure", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        measure(args.requests)
+        return
+
+    database_url = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "benchmark.db")
+    seed(database_url)
+
+    best = {False: {}, True: {}}
+    for i in range(args.rounds):
+        for enabled in (False, True):
+            for endpoint, microseconds in run(database_url, enabled, args.requests).items():
+                best[enabled][endpoint] = min(best[enabled].get(endpoint, microseconds), microseconds)
+
+    over_budget = False
+    print(f"{'endpoint':32} {'off (us)':>10} {'on (us)':>10} {'overhead':>9}")
+    for endpoint in ENDPOINTS:
+        off, on = best[False][endpoint], best[True][endpoint]
+        overhead = 100 * (on - off) / off
+        over_budget |= args.max_overhead is not None and overhead > args.max_overhead
+        print(f"{endpoint:32} {off:10.1f} {on:10.1f} {overhead:8.1f}%")
+    sys.exit(1 if over_budget else 0)
+
+if __name__ == "__main__":
+    main()
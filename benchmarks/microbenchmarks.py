@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+
+# PURPOSE
+#
+# Times the small helpers that run on every request, each in isolation, and
+# compares them against stored baselines, so that optimizing (or slowing down)
+# one of them shows up as a number:
+#  - utility.parse_request and utility.request_access_token,
+#  - utility.format_phone_number (memoized and not) and
+#    utility.normalize_phone_number,
+#  - User.generate_access_token, the JWT decode of
+#    User._verify_access_token, and User.from_authorization for a token it
+#    has already verified.
+#
+# Each case is run in ROUNDS rounds of enough calls to take about 40 ms; the
+# fastest round, per call, is its result. A case fails when it is slower than
+# its baseline by more than --threshold percent.
+#
+# HOW TO USE
+#
+#     python benchmarks/microbenchmarks.py                 # compare with the baselines
+#     python benchmarks/microbenchmarks.py --save          # store new baselines
+#     python benchmarks/microbenchmarks.py -k phone        # only cases with "phone" in the name
+#
+# Baselines (in microbenchmark_baselines.json next to this file) depend on the
+# machine they were taken on; take them again before comparing on another.
+# Since a busy machine can slow down any single measurement, a case over the
+# threshold is measured up to RETRIES more times and only fails if it stays
+# over, and baselines are the best of RETRIES + 1 measurements.
+# Exits with status 1 if any case regressed.
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "benchmark.db")
+
+import jwt
+from flask import request
+
+from application import create_api_app
+from models import User, Customer, verified_tokens
+from utility import parse_request, request_access_token, format_phone_number, normalize_phone_number
+
+BASELINES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "microbenchmark_baselines.json")
+ROUNDS = 25
+ROUND_SECONDS = 0.04
+RETRIES = 2
+
+LOGIN = {"loyaltyID": "67417", "password": "hunter2"}
+TRANSACTION = {"loyaltyID": 67417, "storeID": 1, "date": "2020-03-04",
+    "items": [{"itemType": "Clothing", "unit": "Bag", "quantity": 2, "description": "Shirts"}]}
+
+# Returns a list of (name, request the case runs in or None, function to time)
+def cases(app):
+    customer = Customer(67417, "hunter2", "Test", "Customer")
+    customer.user_id = 1
+    token = customer.generate_access_token()
+    payload = jwt.decode(token, app.config["JWT_SECRET"])
+    verified_tokens.set(token, customer, payload["exp"])
+
+    # The body is read once per request; forgetting the decoded JSON makes
+    # every call decode it again, as every request does
+    def parse(*params):
+        request._cached_json = (Ellipsis, Ellipsis)
+        return parse_request(*params)
+
+    return [
+        ("parse_request[login]", {"method": "POST", "json": LOGIN},
+            lambda: parse("loyaltyID", "password")),
+        ("parse_request[transaction]", {"method": "POST", "json": TRANSACTION},
+            lambda: parse("loyaltyID", "storeID", "date", "items")),
+        ("request_access_token", {"headers": {"Authorization": "Bearer " + token}}, request_access_token),
+        ("format_phone_number[memoized]", None, lambda: format_phone_number("+14025550123")),
+        ("format_phone_number[uncached]", None, lambda: format_phone_number.__wrapped__("+14025550123")),
+        ("normalize_phone_number", None, lambda: normalize_phone_number("(402) 555-0123")),
+        ("User.generate_access_token", None, customer.generate_access_token),
+        ("jwt.decode[access token]", None, lambda: jwt.decode(token, app.config["JWT_SECRET"])),
+        ("User.from_authorization[verified]", None, lambda: User.from_authorization(token, Customer)),
+    ]
+
+# Returns the fastest time per call of `function`, in microseconds
+def measure(function):
+    timer = timeit.Timer(function)
+    calls, elapsed = timer.autorange()
+    calls = max(1, int(calls * ROUND_SECONDS / max(elapsed, 1e-9)))
+    return 1e6 * min(timer.repeat(ROUNDS, calls)) / calls
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark per-request helpers against baselines.")
+    parser.add_argument("--save", action="store_true", help="store the results as the new baselines")
+    parser.add_argument("--threshold", type=float, default=25,
+        help="percentage over its baseline at which a case fails")
+    parser.add_argument("-k", dest="keyword", default="", help="only run cases whose name contains this")
+    args = parser.parse_args()
+
+    app = create_api_app({"BCRYPT_LOG_ROUNDS": 4, "BCRYPT_POOL_SIZE": 0, "METRICS_ENABLED": False})
+    baselines = {}
+    if os.path.exists(BASELINES):
+        with open(BASELINES) as file:
+            baselines = json.load(file)
+
+    results = {}
+    regressed = []
+    print(f"{'case':36} {'us/call':>10} {'baseline':>10} {'change':>8}")
+    with app.app_context():
+        for name, request_options, function in cases(app):
+            if args.keyword not in name:
+                continue
+            baseline = baselines.get(name)
+            with app.test_request_context("/", **(request_options or {})):
+                function()
+                results[name] = round(measure(function), 3)
+                # Baselines are the best of all attempts
+                for attempt in range(RETRIES):
+                    if not args.save and (not baseline
+                            or results[name] <= baseline * (1 + args.threshold / 100)):
+                        break
+                    results[name] = min(results[name], round(measure(function), 3))
+
+            if baseline:
+                change = 100 * (results[name] - baseline) / baseline
+                flag = "  REGRESSED" if change > args.threshold else ""
+                if flag:
+                    regressed.append(name)
+                print(f"{name:36} {results[name]:10.2f} {baseline:10.2f} {change:+7.1f}%{flag}")
+            else:
+                print(f"{name:36} {results[name]:10.2f} {'-':>10} {'-':>8}")
+
+    if args.save:
+        baselines.update(results)
+        with open(BASELINES, "w") as file:
+            json.dump(baselines, file, indent=2, sort_keys=True)
+            file.write("\n")
+        print(f"Saved baselines to {BASELINES}")
+    elif regressed:
+        print(f"{len(regressed)} case(s) slower than their baseline by over {args.threshold:g}%")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
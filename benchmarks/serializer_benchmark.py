@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+
+# PURPOSE
+#
+# Measures the cost per customer of producing a customer list response (as in
+# GET /customer/by/<field_name>/<field_value>), comparing:
+#  - loading Customer objects versus loading only CUSTOMER_COLUMNS as rows, and
+#  - each JSON backend available (see serializers.py).
+# Times are reported both for serializing alone and for loading plus
+# serializing, in microseconds per customer.
+#
+# HOW TO USE
+#
+#     python benchmarks/serializer_benchmark.py --customers 1000 --repeat 20
+#
+# Runs against a throwaway SQLite file; no database needs to be running.
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "benchmark.db")
+
+from application import app
+from app_init import db
+from models import User, Customer
+import serializers
+from serializers import CUSTOMER_COLUMNS, customer_dict
+
+def insert_customers(count):
+    # Inserted in SQL rather than through the models, which would hash a
+    # password per customer
+    db.session.execute(User.__table__.insert(), [{
+        "user_id": i, "user_type": "CUST", "password": "not a bcrypt hash",
+        "first_name": "First", "last_name": "Benchmark", "address1": f"{i} Anywhere St",
+        "address2": "", "city": "Omaha", "state": "NE", "zip_code": "68102",
+        "email": f"customer{i}@example.com", "phone": "+14025550100",
+        "phone_display": "(402) 555-0100", "phone_uri": "tel:+1-402-555-0100",
+    } for i in range(1, count + 1)])
+    db.session.execute(Customer.__table__.insert(), [
+        {"user_id": i, "loyalty_id": 100000 + i} for i in range(1, count + 1)])
+    db.session.commit()
+
+def load_objects():
+    return Customer.query.filter(Customer.lookup_criterion("lastName", "benchmark")).all()
+
+def load_rows():
+    return db.session.query(*CUSTOMER_COLUMNS) \
+        .filter(Customer.lookup_criterion("lastName", "benchmark")).all()
+
+def serialize(customers):
+    return serializers.json_array_response(customers, customer_dict).get_data()
+
+# Returns the best time of `repeat` runs of `function`, in microseconds per
+# customer
+def best_time(function, repeat, count):
+    best = None
+    for i in range(repeat):
+        db.session.expunge_all()
+        started = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return 1e6 * best / count
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark customer list serialization.")
+    parser.add_argument("--customers", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    results = {"customers": args.customers}
+    with app.app_context():
+        db.create_all()
+        insert_customers(args.customers)
+
+        # The result must not depend on the backend or on how customers are loaded
+        expected = json.loads(serialize(load_objects()))
+
+        for backend in serializers.JSON_BACKENDS:
+            serializers.use_json_backend(backend)
+            for loader in (load_objects, load_rows):
+                assert json.loads(serialize(loader())) == expected
+                customers = loader()
+                name = f"{loader.__name__[len('load_'):]}+{backend}"
+                results[name] = {
+                    "serializeUs": best_time(lambda: serialize(customers), args.repeat, args.customers),
+                    "loadAndSerializeUs": best_time(lambda: serialize(loader()), args.repeat, args.customers),
+                }
+                print(f"{name:>14}: serialize {results[name]['serializeUs']:6.2f} us/customer, "
+                    f"load and serialize {results[name]['loadAndSerializeUs']:6.2f} us/customer")
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+
+if __name__ == '__main__':
+    main()
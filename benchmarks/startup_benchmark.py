@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+
+# PURPOSE
+#
+# Measures how long a fresh process takes to become useful: the time to import
+# the app (what every gunicorn worker and `manage.py` command pays before doing
+# anything), and the time from there to the first response from GET /. Fails
+# with exit status 1 if either median goes over its budget, so that a slow
+# module-level import (such as phonenumbers' geocoder, see utility.py) can't
+# quietly creep back in.
+#
+# HOW TO USE
+#
+#     python benchmarks/startup_benchmark.py --runs 10
+#     python benchmarks/startup_benchmark.py --import-budget-ms 600 --output startup.json
+#     python benchmarks/startup_benchmark.py --importtime   # show the slowest imports
+#
+# Each run is a new interpreter, so nothing is cached between them other than
+# the OS's file cache and Python's bytecode cache. GET / doesn't touch the
+# database, so no database needs to be running.
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+# Budgets for the median, in milliseconds. Set with some headroom over the
+# measurements at the time they were set (about 350 ms and 5 ms).
+IMPORT_BUDGET_MS = 600
+FIRST_RESPONSE_BUDGET_MS = 100
+
+# Runs in the fresh interpreter; prints its measurements as JSON
+CHILD = """
+import json, os, time
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+started = time.perf_counter()
+import application
+imported = time.perf_counter()
+response = application.app.test_client().get("/")
+responded = time.perf_counter()
+assert response.status_code == 200, response.status_code
+print(json.dumps({
+    "importMs": 1000 * (imported - started),
+    "firstResponseMs": 1000 * (responded - imported),
+}))
+"""
+
+def measure_once():
+    output = subprocess.run([sys.executable, "-c", CHILD], cwd=ROOT, check=True,
+        stdout=subprocess.PIPE, universal_newlines=True).stdout
+    return json.loads(output.splitlines()[-1])
+
+# Prints the `count` imports with the largest cumulative time, as reported by
+# `python -X importtime`
+def print_slowest_imports(count):
+    environ = dict(os.environ)
+    environ.setdefault("DATABASE_URL", "sqlite://")
+    stderr = subprocess.run([sys.executable, "-X", "importtime", "-c", "import application"],
+        cwd=ROOT, env=environ, check=True, stderr=subprocess.PIPE, universal_newlines=True).stderr
+
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        imports.append((int(cumulative_us), name.rstrip()))
+
+    imports.sort(reverse=True)
+    for cumulative_us, name in imports[:count]:
+        print(f"{cumulative_us / 1000:9.1f} ms  {name}")
+
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the app's cold start time.")
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--import-budget-ms", type=float, default=IMPORT_BUDGET_MS)
+    parser.add_argument("--first-response-budget-ms", type=float, default=FIRST_RESPONSE_BUDGET_MS)
+    parser.add_argument("--importtime", action="store_true", help="also list the slowest imports")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    # The first run fills the bytecode cache; it isn't counted
+    measure_once()
+    runs = [measure_once() for i in range(args.runs)]
+
+    results = {
+        "runs": args.runs,
+        "importMs": median([run["importMs"] for run in runs]),
+        "firstResponseMs": median([run["firstResponseMs"] for run in runs]),
+        "importBudgetMs": args.import_budget_ms,
+        "firstResponseBudgetMs": args.first_response_budget_ms,
+    }
+
+    print(f"import:         median {results['importMs']:7.1f} ms (budget {args.import_budget_ms:g} ms)")
+    print(f"first response: median {results['firstResponseMs']:7.1f} ms (budget {args.first_response_budget_ms:g} ms)")
+
+    if args.importtime:
+        print()
+        print_slowest_imports(15)
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+
+    over_budget = results["importMs"] > args.import_budget_ms \
+        or results["firstResponseMs"] > args.first_response_budget_ms
+    if over_budget:
+        print("Cold start is over budget", file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
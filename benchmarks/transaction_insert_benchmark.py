@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+
+# PURPOSE
+#
+# Compares the write path of POST /customer/transaction against the one it
+# replaced, which committed the transaction header, then committed every line
+# separately. For each variant it reports the number of commits per request and
+# the request latency distribution.
+#
+# HOW TO USE
+#
+#     python benchmarks/transaction_insert_benchmark.py --requests 200 --lines 30
+#
+# By default this runs against a throwaway SQLite file. To measure against a
+# real database, set DATABASE_URL (or environment.json) to a migrated and seeded
+# Postgres database; note that the benchmark inserts real transactions for the
+# test customer (loyalty ID 67417).
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+os.environ.setdefault("DATABASE_URL", "sqlite:///" + os.path.join(tempfile.mkdtemp(), "benchmark.db"))
+
+from datetime import date
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+import manage
+from application import app
+from app_init import db
+from models import User, Employee, Transaction, TransactionLine
+from reference_data import reference_data
+from utility import APIError, parse_request, request_access_token
+
+# The endpoint as it was before the single-commit rewrite, kept here only so
+# the two can be measured side by side through the same request stack.
+def legacy_customer_transaction():
+    employee = User.from_authorization(request_access_token(), Employee)
+    loyalty_id, store_id, date_, items = parse_request("loyaltyID", "storeID", "date", "items")
+    date_of_transaction = date.fromisoformat(date_)
+    reference = reference_data.current()
+
+    transaction = Transaction(date_of_transaction, loyalty_id, store_id, date_of_transaction.year)
+    db.session.add(transaction)
+    db.session.commit()
+
+    for item in items:
+        item_type_id = reference.item_type_id(item["itemType"])
+        unit_type_id = reference.unit_type_id(item["unit"])
+        if item_type_id is None or unit_type_id is None:
+            db.session.delete(transaction)
+            db.session.commit()
+            raise APIError(400, "BAD_ITEM_TYPE", "Item Type does not exist")
+
+        db.session.add(TransactionLine(item_type_id, unit_type_id, item["quantity"],
+            item["description"], transaction.transaction_id))
+        db.session.commit()
+
+    return {"transactionID": transaction.transaction_id}
+
+def percentile(sorted_values, fraction):
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+def run(client, path, authorization, body, requests):
+    commits = []
+    def count_commit(session):
+        commits.append(session)
+
+    event.listen(Session, "after_commit", count_commit)
+    try:
+        latencies = []
+        for i in range(requests):
+            started = time.perf_counter()
+            response = client.post(path, json=body, headers={"Authorization": authorization})
+            latencies.append(time.perf_counter() - started)
+            if response.status_code != 200:
+                raise RuntimeError(f"{path} failed: {response.status_code} {response.data!r}")
+    finally:
+        event.remove(Session, "after_commit", count_commit)
+
+    latencies.sort()
+    return {
+        "requests": requests,
+        "commitsPerRequest": len(commits) / requests,
+        "meanMs": 1000 * sum(latencies) / requests,
+        "p50Ms": 1000 * percentile(latencies, 0.50),
+        "p99Ms": 1000 * percentile(latencies, 0.99),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark POST /customer/transaction commits and latency.")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--lines", type=int, default=30)
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    app.add_url_rule("/benchmark/legacy-transaction", "legacy_customer_transaction",
+        legacy_customer_transaction, methods=["POST"])
+
+    with app.app_context():
+        if db.engine.dialect.name == "sqlite":
+            db.create_all()
+        manage.seed_db()
+
+    client = app.test_client()
+    login = client.post("/employee/login", json={"employeeID": "67416", "password": "hunter3"})
+    authorization = "Bearer " + login.get_json()["accessToken"]
+
+    body = {
+        "loyaltyID": 67417,
+        "storeID": 1,
+        "date": "2019-12-31",
+        "items": [{"itemType": "Clothing", "unit": "Bag", "quantity": 1, "description": "Benchmark"}] * args.lines
+    }
+
+    # Warm up caches and connections so neither variant pays for them
+    run(client, "/customer/transaction", authorization, body, 5)
+
+    results = {
+        "lines": args.lines,
+        "before": run(client, "/benchmark/legacy-transaction", authorization, body, args.requests),
+        "after": run(client, "/customer/transaction", authorization, body, args.requests),
+    }
+
+    for name in ("before", "after"):
+        result = results[name]
+        print(f"{name:>6}: {result['commitsPerRequest']:6.1f} commits/request, "
+            f"mean {result['meanMs']:7.2f} ms, p50 {result['p50Ms']:7.2f} ms, p99 {result['p99Ms']:7.2f} ms")
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,197 @@
+import csv
+import datetime
+import io
+import math
+import random
+
+from flask import current_app
+
+from app_init import db
+from bcrypt_pool import generate_password_hash
+from models import User, Customer, Store, ItemType, UnitType, Transaction, TransactionLine
+
+# Generates a production-sized database of made-up customers, with
+# transactions and their lines, for load tests and query plans that look like
+# the real thing (`manage.py seed_bulk`).
+#
+# Rows are generated and loaded SEED_BATCH_SIZE customers at a time, with COPY
+# on Postgres and batched INSERTs elsewhere, and committed per batch. All the
+# customers share one password, hashed once. Stores, item types and unit types
+# are the existing ones (see `manage.py seed_db`).
+#
+# How many transactions each customer has, and how many lines each transaction
+# has, follow one of DISTRIBUTIONS around the given means:
+#  - "geometric": most customers donate once or twice, and a few very often,
+#    as with real donors;
+#  - "uniform": anywhere between none (one line) and twice the mean;
+#  - "constant": exactly the mean, e.g. to compare query plans across sizes.
+
+SEED_BATCH_SIZE = 1000
+DISTRIBUTIONS = ("geometric", "uniform", "constant")
+
+FIRST_NAMES = ["James", "Mary", "Robert", "Patricia", "John", "Jennifer", "Michael", "Linda", "David",
+    "Elizabeth", "William", "Barbara", "Richard", "Susan", "Joseph", "Jessica", "Thomas", "Sarah",
+    "Charles", "Karen", "Maria", "Nancy", "Daniel", "Lisa", "Matthew", "Betty", "Anthony", "Sandra"]
+LAST_NAMES = ["Smith", "Johnson", "Williams", "Brown", "Jones", "Garcia", "Miller", "Davis", "Rodriguez",
+    "Martinez", "Hernandez", "Lopez", "Wilson", "Anderson", "Thomas", "Taylor", "Moore", "Jackson",
+    "Martin", "Lee", "Nguyen", "Thompson", "White", "Harris", "Clark", "Lewis", "Walker", "Hall"]
+STREETS = ["Dodge St", "Farnam St", "Maple St", "Pacific St", "Center St", "Blondo St", "Leavenworth St",
+    "Ames Ave", "Military Ave", "Saddle Creek Rd", "Cass St", "Q St", "L St", "Harrison St"]
+CITIES = [("Omaha", "NE", "681"), ("Council Bluffs", "IA", "515"), ("Bellevue", "NE", "680"),
+    ("Papillion", "NE", "680"), ("Lincoln", "NE", "685"), ("Fremont", "NE", "680")]
+DESCRIPTIONS = ["Shirts", "Pants", "Shoes", "Coats", "Books", "Toys", "Dishes", "Lamp", "Chair", "Table",
+    "Linens", "Kitchenware", "Electronics", "Decor", "Sporting goods"]
+
+# Generates and loads the customers, their transactions and lines.
+#
+# customers: how many customers to add
+# mean_transactions: per customer; mean_lines: per transaction (at least one)
+# first_year, last_year: the years the transactions' dates are spread over
+# distribution: one of DISTRIBUTIONS
+# password: every customer's password
+# seed: for the random generator, so that runs can be repeated
+# progress: if given, called after each batch is committed with the numbers
+#   added so far (a dict like the one returned)
+# returns: the numbers of customers, transactions and lines added
+def seed_bulk(customers, mean_transactions, mean_lines, first_year, last_year,
+        distribution="geometric", password="hunter2", seed=None, progress=None):
+    if distribution not in DISTRIBUTIONS:
+        raise ValueError(f"Unknown distribution \"{distribution}\", expected one of {DISTRIBUTIONS}")
+    if mean_lines < 1:
+        raise ValueError("Transactions have at least one line")
+    first_day = datetime.date(first_year, 1, 1).toordinal()
+    last_day = min(datetime.date(last_year, 12, 31), datetime.date.today()).toordinal()
+    if first_day > last_day:
+        raise ValueError("The years must be in order, and not all in the future")
+
+    store_ids = [store_id for store_id, in db.session.query(Store.store_id)]
+    item_type_ids = [item_type_id for item_type_id, in db.session.query(ItemType.item_type_id)]
+    unit_type_ids = [unit_type_id for unit_type_id, in db.session.query(UnitType.unit_type_id)]
+    if not store_ids or not item_type_ids or not unit_type_ids:
+        raise ValueError("Stores, item types and unit types are needed first; run `manage.py seed_db`")
+
+    generator = random.Random(seed)
+    password_hash = generate_password_hash(password, current_app.config["BCRYPT_LOG_ROUNDS"])
+
+    next_user_id = _next_id(User.user_id)
+    next_loyalty_id = max(_next_id(Customer.loyalty_id), 100000)
+    next_transaction_id = _next_id(Transaction.transaction_id)
+    next_line_id = _next_id(TransactionLine.transaction_line_id)
+    added = {"customers": 0, "transactions": 0, "lines": 0}
+
+    try:
+        for batch_start in range(0, customers, SEED_BATCH_SIZE):
+            users, customer_rows, transactions, lines = [], [], [], []
+            for i in range(min(SEED_BATCH_SIZE, customers - batch_start)):
+                user_id, loyalty_id = next_user_id, next_loyalty_id
+                next_user_id += 1
+                next_loyalty_id += 1
+                users.append(_user_row(generator, user_id, password_hash))
+                customer_rows.append({"user_id": user_id, "loyalty_id": loyalty_id})
+
+                for j in range(_sample(generator, distribution, mean_transactions)):
+                    date = datetime.date.fromordinal(generator.randint(first_day, last_day))
+                    transactions.append({
+                        "transaction_id": next_transaction_id,
+                        "loyalty_id": loyalty_id,
+                        "store_id": generator.choice(store_ids),
+                        "date": datetime.datetime.combine(date, datetime.time(generator.randint(9, 19),
+                            generator.randint(0, 59))),
+                        "tax_year": date.year,
+                    })
+                    for k in range(1 + _sample(generator, distribution, mean_lines - 1)):
+                        lines.append({
+                            "transaction_line_id": next_line_id,
+                            "transaction_id": next_transaction_id,
+                            "item_type_id": generator.choice(item_type_ids),
+                            "unit_type_id": generator.choice(unit_type_ids),
+                            "quantity": generator.randint(1, 5),
+                            "description": generator.choice(DESCRIPTIONS),
+                        })
+                        next_line_id += 1
+                    next_transaction_id += 1
+
+            _load(User.__table__, users)
+            _load(Customer.__table__, customer_rows)
+            _load(Transaction.__table__, transactions)
+            _load(TransactionLine.__table__, lines)
+            db.session.commit()
+
+            added["customers"] += len(customer_rows)
+            added["transactions"] += len(transactions)
+            added["lines"] += len(lines)
+            if progress is not None:
+                progress(dict(added))
+
+        if db.engine.dialect.name == "postgresql":
+            _after_postgres_load()
+        return added
+    except:
+        db.session.rollback()
+        raise
+
+# Returns the id after the largest one in `column`
+def _next_id(column):
+    return (db.session.query(db.func.max(column)).scalar() or 0) + 1
+
+def _user_row(generator, user_id, password_hash):
+    first_name, last_name = generator.choice(FIRST_NAMES), generator.choice(LAST_NAMES)
+    city, state, zip_prefix = generator.choice(CITIES)
+    area_code, line = generator.choice(["402", "531", "712"]), generator.randint(0, 9999)
+    return {
+        "user_id": user_id,
+        "user_type": "CUST",
+        "password": password_hash,
+        "first_name": first_name,
+        "last_name": last_name,
+        "address1": f"{generator.randint(100, 19999)} {generator.choice(STREETS)}",
+        "address2": None,
+        "city": city,
+        "state": state,
+        "zip_code": f"{zip_prefix}{generator.randint(0, 99):02}",
+        "email": f"{first_name}.{last_name}{user_id}@example.com".lower(),
+        # What utility.format_phone_number gives for these numbers, without
+        # parsing a million of them
+        "phone": f"+1{area_code}555{line:04}",
+        "phone_display": f"({area_code}) 555-{line:04}",
+        "phone_uri": f"tel:+1-{area_code}-555-{line:04}",
+    }
+
+# Returns a random count with the given mean
+def _sample(generator, distribution, mean):
+    if mean <= 0:
+        return 0
+    if distribution == "constant":
+        return round(mean)
+    if distribution == "uniform":
+        return generator.randint(0, round(2 * mean))
+    # Geometric over 0, 1, 2, ...
+    return int(math.log(1.0 - generator.random()) / math.log(mean / (mean + 1.0)))
+
+def _load(table, rows):
+    if not rows:
+        return
+    columns = list(rows[0])
+    if db.engine.dialect.name == "postgresql":
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for row in rows:
+            writer.writerow([row[column] for column in columns])
+        buffer.seek(0)
+        cursor = db.session.connection().connection.cursor()
+        cursor.copy_expert("COPY \"{}\" ({}) FROM STDIN WITH (FORMAT csv)".format(
+            table.name, ", ".join(columns)), buffer)
+    else:
+        db.session.execute(table.insert(), rows)
+
+# Moves the id sequences past the ids given explicitly above, and updates the
+# planner's statistics for the new rows
+def _after_postgres_load():
+    for table, column in [("user", "user_id"), ("transaction", "transaction_id"),
+            ("transaction_line", "transaction_line_id")]:
+        db.session.execute(db.text(f"SELECT setval(pg_get_serial_sequence('\"{table}\"', '{column}'), "
+            f"(SELECT max({column}) FROM \"{table}\"))"))
+    db.session.commit()
+    for table in ["user", "customer", "transaction", "transaction_line"]:
+        db.session.execute(db.text(f"ANALYZE \"{table}\""))
+    db.session.commit()
@@ -0,0 +1,92 @@
+import threading
+import time
+
+from sqlalchemy import exc
+from sqlalchemy.pool import QueuePool
+
+# Database connection pool settings and statistics.
+#
+# Every web worker has its own pool of DB_POOL_SIZE connections, plus up to
+# DB_MAX_OVERFLOW temporary ones (see environment.py), so the database must
+# accept (gunicorn workers) x (DB_POOL_SIZE + DB_MAX_OVERFLOW) connections, on
+# top of those of `manage.py` commands. The statistics below show whether a
+# worker's requests wait for a connection, to size both numbers against the
+# number of workers and threads.
+
+# Returns the SQLALCHEMY_ENGINE_OPTIONS for the app's config
+def engine_options(config):
+    if config["SQLALCHEMY_DATABASE_URI"].startswith("sqlite"):
+        # SQLite has no server to connect to; its default pools are fine
+        return {}
+
+    options = {
+        "poolclass": InstrumentedQueuePool,
+        "pool_size": config["DB_POOL_SIZE"],
+        "max_overflow": config["DB_MAX_OVERFLOW"],
+        "pool_timeout": config["DB_POOL_TIMEOUT"],
+        "pool_recycle": config["DB_POOL_RECYCLE"],
+        "pool_pre_ping": config["DB_POOL_PRE_PING"],
+    }
+    if config["DB_STATEMENT_TIMEOUT"] and config["SQLALCHEMY_DATABASE_URI"].startswith("postgres"):
+        # Postgres cancels any statement that runs for longer (in milliseconds)
+        options["connect_args"] = {"options": "-c statement_timeout={}".format(config["DB_STATEMENT_TIMEOUT"])}
+    return options
+
+# Counts how long getting a connection from the pool takes, including waiting
+# for one to be returned and opening new ones. Process-wide, so the numbers
+# survive the pool being recreated (e.g. after the database restarts).
+class CheckoutStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def record(self, wait_seconds, timed_out):
+        with self._lock:
+            self.checkouts += 1
+            self.timeouts += timed_out
+            self.wait_seconds += wait_seconds
+            self.max_wait_seconds = max(self.max_wait_seconds, wait_seconds)
+
+checkout_stats = CheckoutStats()
+
+class InstrumentedQueuePool(QueuePool):
+    def connect(self):
+        return self._timed_checkout(super().connect)
+
+    # What Engine.connect() actually uses
+    def unique_connection(self):
+        return self._timed_checkout(super().unique_connection)
+
+    def _timed_checkout(self, checkout):
+        started = time.perf_counter()
+        timed_out = False
+        try:
+            return checkout()
+        except exc.TimeoutError:
+            timed_out = True
+            raise
+        finally:
+            checkout_stats.record(time.perf_counter() - started, timed_out)
+
+# Returns this process's pool statistics for `engine`, as a dict for JSON
+def pool_stats(engine):
+    pool = engine.pool
+    stats = {"pool": type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        stats.update({
+            "size": pool.size(),
+            "checkedOut": pool.checkedout(),
+            "checkedIn": pool.checkedin(),
+            "overflow": pool.overflow(),
+        })
+    if isinstance(pool, InstrumentedQueuePool):
+        stats.update({
+            "checkouts": checkout_stats.checkouts,
+            "checkoutTimeouts": checkout_stats.timeouts,
+            "checkoutWaitSeconds": checkout_stats.wait_seconds,
+            "maxCheckoutWaitSeconds": checkout_stats.max_wait_seconds,
+        })
+    return stats
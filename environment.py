@@ -1,6 +1,7 @@
 import json
 from os import path, environ, urandom
 from base64 import b64decode, b64encode
+from tempfile import gettempdir
 
 # TO SET ENVIRONMENT VARIABLES
 # ----------------------------
@@ -9,15 +10,48 @@ from base64 import b64decode, b64encode
 # file at the project root with the following structure:
 #
 #    {
-#        "DATABASE_URL": string,      # required
-#        "ENVIRONMENT": string,       # defaults to "unknown"
-#        "JWT_SECRET": string,        # defaults to a random value
-#        "BCRYPT_LOG_ROUNDS": integer # defaults to 12
+#        "DATABASE_URL": string,                  # required
+#        "DATABASE_REPLICA_URL": string,          # optional
+#        "REPLICA_RETRY_INTERVAL": integer,       # defaults to 30
+#        "ENVIRONMENT": string,                   # defaults to "unknown"
+#        "JWT_SECRET": string,                    # defaults to a random value
+#        "BCRYPT_LOG_ROUNDS": integer,            # defaults to 12
+#        "REFERENCE_DATA_TTL": integer,           # defaults to 300
+#        "TOKEN_CACHE_SIZE": integer,             # defaults to 10000
+#        "TOKEN_CACHE_TTL": integer,              # defaults to 60
+#        "REVOCATION_REFRESH_INTERVAL": integer,  # defaults to 5
+#        "JWT_BLACKLIST_PURGE_INTERVAL": integer, # defaults to 3600
+#        "BCRYPT_POOL_SIZE": integer,             # defaults to 2
+#        "BCRYPT_QUEUE_DEPTH": integer,           # defaults to 4
+#        "BCRYPT_RETRY_AFTER": integer,           # defaults to 1
+#        "HTTP_CACHE_MAX_AGE": integer,           # defaults to 30
+#        "CORS_MAX_AGE": integer,                 # defaults to 86400
+#        "DB_POOL_SIZE": integer,                 # defaults to 5
+#        "DB_MAX_OVERFLOW": integer,              # defaults to 10
+#        "DB_POOL_TIMEOUT": integer,              # defaults to 30
+#        "DB_POOL_RECYCLE": integer,              # defaults to 1800
+#        "DB_POOL_PRE_PING": boolean,             # defaults to true
+#        "DB_STATEMENT_TIMEOUT": integer,         # defaults to 30000
+#        "METRICS_ENABLED": boolean,              # defaults to true
+#        "LOGIN_ATTEMPTS_PER_ACCOUNT": integer,   # defaults to 10
+#        "LOGIN_ATTEMPTS_PER_IP": integer,        # defaults to 60
+#        "LOGIN_RATE_LIMIT_PATH": string,         # defaults to a file in the temporary directory
+#        "PROXY_COUNT": integer,                  # defaults to 1
+#        "REFRESH_TOKEN_TTL": integer             # defaults to 604800
 #    }
 #
 # DATABASE_URL:
 # A URL such as "postgres://localhost/db_name" or similar
 #
+# DATABASE_REPLICA_URL:
+# The URLs of read replicas of DATABASE_URL, separated by commas. Read-only
+# endpoints query one of them instead of the primary (see replicas.py).
+#
+# REPLICA_RETRY_INTERVAL:
+# How many seconds a replica that couldn't be connected to is left alone
+# before being tried again. Meanwhile its reads go to the other replicas, or
+# to the primary.
+#
 # ENVIRONMENT:
 # a descriptive string that is currently only printed verbatim in the "GET /"
 # endpoint for informational purposes.
@@ -38,6 +72,88 @@ from base64 import b64decode, b64encode
 # a larger value => more security, but more wait time; and a lower value is less
 # of both. This value is logarithmic, an increment or a decrement corresponds to
 # a doubling or halving of the time cost, respectively.
+#
+# BCRYPT_POOL_SIZE, BCRYPT_QUEUE_DEPTH, BCRYPT_RETRY_AFTER:
+# Each web worker checks passwords in its own pool of BCRYPT_POOL_SIZE processes
+# (see bcrypt_pool.py), so size it together with the number of gunicorn
+# workers and CPU cores; 0 checks passwords inline instead. Up to
+# BCRYPT_QUEUE_DEPTH more logins may wait for a free process; any beyond that
+# get HTTP 503 with a Retry-After of BCRYPT_RETRY_AFTER seconds.
+#
+# REFERENCE_DATA_TTL:
+# How many seconds each worker may keep its in-memory copy of the item type,
+# unit type and store tables (see reference_data.py) before reloading them.
+# Changes made by another process become visible after at most this long.
+#
+# TOKEN_CACHE_SIZE, TOKEN_CACHE_TTL:
+# Each worker remembers up to TOKEN_CACHE_SIZE verified access tokens (see
+# User.from_authorization), each for at most TOKEN_CACHE_TTL seconds. Logouts
+# and changes to a user made by another process can go unnoticed by this worker
+# for up to TOKEN_CACHE_TTL seconds.
+#
+# REVOCATION_REFRESH_INTERVAL:
+# How many seconds apart each worker checks the JWT blacklist for tokens
+# revoked by other processes (see RevocationList in models.py).
+#
+# JWT_BLACKLIST_PURGE_INTERVAL:
+# How many seconds apart each worker deletes expired tokens from the JWT
+# blacklist.
+#
+# HTTP_CACHE_MAX_AGE:
+# How many seconds a client may reuse its copy of a customer's info or history
+# without asking again. After that it revalidates with If-None-Match, which is
+# answered with a 304 if nothing changed. A customer may see a new transaction
+# up to this long after it was added.
+#
+# CORS_MAX_AGE:
+# How many seconds browsers may remember the answer to a CORS preflight
+# (OPTIONS) request.
+#
+# DB_POOL_SIZE, DB_MAX_OVERFLOW:
+# Each worker keeps up to DB_POOL_SIZE database connections open, and opens up
+# to DB_MAX_OVERFLOW more while all of those are in use. The database must
+# accept (number of workers) x (DB_POOL_SIZE + DB_MAX_OVERFLOW) connections;
+# see db_pool.py.
+#
+# DB_POOL_TIMEOUT:
+# How many seconds a request waits for a free connection before failing.
+#
+# DB_POOL_RECYCLE:
+# Connections older than this many seconds are replaced rather than reused.
+#
+# DB_POOL_PRE_PING:
+# Whether to check that each connection still works before using it, so that
+# connections dropped by the server (e.g. on a restart) are replaced instead of
+# failing a request.
+#
+# DB_STATEMENT_TIMEOUT:
+# Postgres cancels any query that runs for longer than this many milliseconds;
+# 0 disables the limit. `manage.py` commands are not limited.
+#
+# METRICS_ENABLED:
+# Whether to record request metrics and serve them at GET /metrics (see
+# metrics.py). Under gunicorn, set PROMETHEUS_MULTIPROC_DIR to an empty
+# directory to have them cover all workers; gunicorn.conf.py does so.
+#
+# LOGIN_ATTEMPTS_PER_ACCOUNT, LOGIN_ATTEMPTS_PER_IP:
+# How many logins may be attempted per minute for each loyalty or employee ID,
+# and from each client address (see rate_limit.py); 0 removes the limit. Short
+# bursts of up to this many are allowed. Attempts beyond that get HTTP 429 with
+# a Retry-After header, without checking the password.
+#
+# LOGIN_RATE_LIMIT_PATH:
+# The SQLite file in which workers count login attempts. All the workers on a
+# machine must use the same file for the limits to cover them together.
+#
+# PROXY_COUNT:
+# How many proxies stand between clients and this server, each adding to the
+# X-Forwarded-For header; 1 for Heroku's router. Client addresses are taken
+# from that header accordingly, so set it to 0 when clients connect directly.
+#
+# REFRESH_TOKEN_TTL:
+# How many seconds each refresh token stays valid (see RefreshToken in
+# models.py). Every refresh issues a new one, so this is how long a session can
+# go unused before its user has to log in again.
 
 
 ENVIRONMENT_JSON_FILENAME = "environment.json"
@@ -60,9 +176,35 @@ def variable(varname, default=None):
         return default
 
 DATABASE_URL = variable("DATABASE_URL")
+DATABASE_REPLICA_URLS = [url.strip() for url in variable("DATABASE_REPLICA_URL", default="").split(",")
+    if url.strip()]
+REPLICA_RETRY_INTERVAL = int(variable("REPLICA_RETRY_INTERVAL", default=30))
 ENVIRONMENT = variable("ENVIRONMENT", default="unknown")
 JWT_SECRET = b64decode(variable("JWT_SECRET", default=b64encode(urandom(32))))
-BCRYPT_LOG_ROUNDS = variable("BCRYPT_LOG_ROUNDS", default=12)
+BCRYPT_LOG_ROUNDS = int(variable("BCRYPT_LOG_ROUNDS", default=12))
+BCRYPT_POOL_SIZE = int(variable("BCRYPT_POOL_SIZE", default=2))
+BCRYPT_QUEUE_DEPTH = int(variable("BCRYPT_QUEUE_DEPTH", default=4))
+BCRYPT_RETRY_AFTER = int(variable("BCRYPT_RETRY_AFTER", default=1))
+REFERENCE_DATA_TTL = int(variable("REFERENCE_DATA_TTL", default=300))
+TOKEN_CACHE_SIZE = int(variable("TOKEN_CACHE_SIZE", default=10000))
+TOKEN_CACHE_TTL = int(variable("TOKEN_CACHE_TTL", default=60))
+REVOCATION_REFRESH_INTERVAL = int(variable("REVOCATION_REFRESH_INTERVAL", default=5))
+JWT_BLACKLIST_PURGE_INTERVAL = int(variable("JWT_BLACKLIST_PURGE_INTERVAL", default=3600))
+HTTP_CACHE_MAX_AGE = int(variable("HTTP_CACHE_MAX_AGE", default=30))
+CORS_MAX_AGE = int(variable("CORS_MAX_AGE", default=86400))
+DB_POOL_SIZE = int(variable("DB_POOL_SIZE", default=5))
+DB_MAX_OVERFLOW = int(variable("DB_MAX_OVERFLOW", default=10))
+DB_POOL_TIMEOUT = int(variable("DB_POOL_TIMEOUT", default=30))
+DB_POOL_RECYCLE = int(variable("DB_POOL_RECYCLE", default=1800))
+DB_POOL_PRE_PING = str(variable("DB_POOL_PRE_PING", default=True)).lower() in ("true", "1", "yes")
+DB_STATEMENT_TIMEOUT = int(variable("DB_STATEMENT_TIMEOUT", default=30000))
+METRICS_ENABLED = str(variable("METRICS_ENABLED", default=True)).lower() in ("true", "1", "yes")
+LOGIN_ATTEMPTS_PER_ACCOUNT = int(variable("LOGIN_ATTEMPTS_PER_ACCOUNT", default=10))
+LOGIN_ATTEMPTS_PER_IP = int(variable("LOGIN_ATTEMPTS_PER_IP", default=60))
+LOGIN_RATE_LIMIT_PATH = variable("LOGIN_RATE_LIMIT_PATH",
+    default=path.join(gettempdir(), "goodwill-login-attempts.db"))
+PROXY_COUNT = int(variable("PROXY_COUNT", default=1))
+REFRESH_TOKEN_TTL = int(variable("REFRESH_TOKEN_TTL", default=604800))
 
 if not DATABASE_URL:
     raise KeyError("DATABASE_URL not found! Please create an environment.json " +
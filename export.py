@@ -0,0 +1,119 @@
+import zlib
+from datetime import date, datetime, timedelta
+from itertools import groupby
+
+from sqlalchemy import select
+
+from app_init import db
+from models import Transaction, TransactionLine, ItemType, UnitType
+from replicas import read_engine
+from serializers import dumps
+from utility import APIError
+
+# Exports transactions with all of their lines as NDJSON, one transaction per
+# line, in the format accepted by POST /customer/transaction/bulk plus the
+# transactionID and taxYear. Used by GET /transaction/export and
+# `manage.py export_transactions`.
+#
+# An export can be millions of rows, so nothing is collected in memory: rows
+# are read through a server-side cursor (on Postgres) EXPORT_BATCH_SIZE at a
+# time, and each batch is encoded and handed on before the next is read. Item
+# and unit type names are joined in SQL.
+
+EXPORT_BATCH_SIZE = 1000
+
+# Checks the range of an export.
+#
+# tax_year, start, end: as given by the user, any of them may be None. `start`
+# and `end` are YYYY-MM-DD dates, both inclusive.
+# returns: a tuple of (tax year, first date, last date) with the types
+#          export_transactions expects
+# raises APIError: with HTTP 400 if the range is missing or malformed
+def check_export_range(tax_year, start, end):
+    if tax_year is None and start is None and end is None:
+        raise APIError(400, "MISSING_RANGE", "A tax year or a date range is required")
+    try:
+        return (
+            int(tax_year) if tax_year is not None else None,
+            date.fromisoformat(start) if start is not None else None,
+            date.fromisoformat(end) if end is not None else None,
+        )
+    except (TypeError, ValueError):
+        raise APIError(400, "BAD_RANGE", "Tax year must be an integer, and dates formatted as YYYY-MM-DD")
+
+# Opens a connection for export_transactions, to a replica if the view uses one
+# (see replicas.py). Call this while the app context is still available, since
+# a streamed response outlives it.
+def export_connection():
+    return read_engine(db).connect().execution_options(stream_results=True)
+
+# Yields the NDJSON encoded transactions in the range, in transactionID order,
+# as chunks of bytes. Closes `connection` when done.
+#
+# connection: from export_connection()
+# tax_year, start, end: as returned by check_export_range
+def export_transactions(connection, tax_year, start, end):
+    transaction = Transaction.__table__
+    line = TransactionLine.__table__
+    query = select([
+            transaction.c.transaction_id, transaction.c.loyalty_id, transaction.c.store_id,
+            transaction.c.date, transaction.c.tax_year,
+            ItemType.__table__.c.item_type, UnitType.__table__.c.unit_type,
+            line.c.quantity, line.c.description,
+        ]) \
+        .select_from(transaction
+            .outerjoin(line)
+            .outerjoin(ItemType.__table__)
+            .outerjoin(UnitType.__table__)) \
+        .order_by(transaction.c.transaction_id, line.c.transaction_line_id)
+    if tax_year is not None:
+        query = query.where(transaction.c.tax_year == tax_year)
+    if start is not None:
+        query = query.where(transaction.c.date >= datetime.combine(start, datetime.min.time()))
+    if end is not None:
+        query = query.where(transaction.c.date < datetime.combine(end + timedelta(days=1), datetime.min.time()))
+
+    try:
+        result = connection.execute(query)
+        # A transaction's lines may span two batches; its record is held back
+        # until the next batch shows it's complete
+        pending = []
+        while True:
+            rows = result.fetchmany(EXPORT_BATCH_SIZE)
+            if not rows:
+                break
+
+            groups = [list(group) for key, group in groupby(pending + rows, lambda row: row.transaction_id)]
+            pending = groups.pop()
+            if groups:
+                yield b"".join(dumps(_transaction_record(group)) + b"\n" for group in groups)
+
+        if pending:
+            yield dumps(_transaction_record(pending)) + b"\n"
+    finally:
+        connection.close()
+
+def _transaction_record(rows):
+    first = rows[0]
+    return {
+        "transactionID": first.transaction_id,
+        "loyaltyID": first.loyalty_id,
+        "storeID": first.store_id,
+        "date": first.date.date().isoformat(),
+        "taxYear": first.tax_year,
+        "items": [{
+            "itemType": row.item_type,
+            "unit": row.unit_type,
+            "quantity": row.quantity,
+            "description": row.description
+        } for row in rows if row.quantity is not None]
+    }
+
+# Gzips a stream of chunks of bytes as it goes
+def gzip_chunks(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
@@ -0,0 +1,27 @@
+import os
+import shutil
+import tempfile
+
+# Gunicorn settings, passed to gunicorn by the Procfile.
+#
+# Every worker keeps its own request metrics (see metrics.py); they are written
+# to files in PROMETHEUS_MULTIPROC_DIR so that GET /metrics on any worker
+# reports the sum over all of them. The directory must be set before the
+# workers import prometheus_client, and emptied whenever the server starts, or
+# it would carry over the numbers of a previous run.
+
+if not os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+    os.environ["PROMETHEUS_MULTIPROC_DIR"] = tempfile.mkdtemp(prefix="prometheus-")
+# The name older versions of prometheus_client look for
+os.environ["prometheus_multiproc_dir"] = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+
+def on_starting(server):
+    directory = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(directory)
+
+# Drops the gauges of workers that exited, so they don't count towards live
+# values such as connections in use
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
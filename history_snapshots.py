@@ -0,0 +1,126 @@
+import datetime
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from itertools import groupby
+
+from sqlalchemy.orm import joinedload
+
+from app_init import create_app, db
+from models import HistorySnapshot, Transaction
+from reference_data import reference_data
+from serializers import dumps, transaction_dict
+
+# Once a tax year is over, customers' histories for it practically never
+# change, yet at tax time every customer asks for last year at once. Building
+# each history ahead of time into a HistorySnapshot turns those requests into
+# one primary key lookup, with a body that is sent as stored.
+#
+# Snapshots are deleted when a transaction is added to their year (see
+# transactions.insert_transactions). In case one is missed anyway, e.g. for a
+# transaction added in SQL, a snapshot is also only served while the year's
+# newest transaction id, number of transactions, and reference data names are
+# the ones it was built from.
+
+# How many customers each pool process builds snapshots for at a time
+BUILD_CHUNK_SIZE = 500
+
+# Returns the stored payload (the serialized "history" list) for the
+# customer's year, or None if there is no snapshot or it is out of date.
+#
+# newest_transaction_id, transaction_count: of the year, as they are now
+# reference: the current ReferenceSnapshot
+def find_snapshot(loyalty_id, tax_year, newest_transaction_id, transaction_count, reference):
+    snapshot = db.session.query(HistorySnapshot.newest_transaction_id,
+            HistorySnapshot.transaction_count, HistorySnapshot.reference_version,
+            HistorySnapshot.payload) \
+        .filter_by(loyalty_id=loyalty_id, tax_year=tax_year) \
+        .first()
+
+    if snapshot is None or snapshot.newest_transaction_id != newest_transaction_id \
+            or snapshot.transaction_count != transaction_count \
+            or snapshot.reference_version != reference.version:
+        return None
+    return snapshot.payload
+
+# Deletes the snapshots of the given years. Does not commit.
+#
+# years: an iterable of (loyalty_id, tax_year)
+def invalidate_snapshots(years):
+    loyalty_ids_by_year = {}
+    for loyalty_id, tax_year in years:
+        loyalty_ids_by_year.setdefault(tax_year, set()).add(loyalty_id)
+
+    for tax_year, loyalty_ids in loyalty_ids_by_year.items():
+        db.session.query(HistorySnapshot) \
+            .filter(HistorySnapshot.tax_year == tax_year,
+                HistorySnapshot.loyalty_id.in_(sorted(loyalty_ids))) \
+            .delete(synchronize_session=False)
+
+# Builds (or rebuilds) the snapshots of `tax_year` for the given customers and
+# commits them. Must be called within an app context.
+#
+# returns: the number of snapshots written
+def build_snapshots(tax_year, loyalty_ids):
+    transactions = Transaction.query \
+        .filter(Transaction.tax_year == tax_year, Transaction.loyalty_id.in_(loyalty_ids)) \
+        .options(joinedload(Transaction.lines)) \
+        .order_by(Transaction.loyalty_id, Transaction.date, Transaction.transaction_id) \
+        .all()
+    reference = reference_data.covering(reference_data.current(), (line for transaction in transactions
+        for line in transaction.lines))
+
+    built_on = datetime.datetime.utcnow()
+    rows = []
+    for loyalty_id, customer_transactions in groupby(transactions, lambda t: t.loyalty_id):
+        customer_transactions = list(customer_transactions)
+        rows.append({
+            "loyalty_id": loyalty_id,
+            "tax_year": tax_year,
+            "newest_transaction_id": max(t.transaction_id for t in customer_transactions),
+            "transaction_count": len(customer_transactions),
+            "reference_version": reference.version,
+            "built_on": built_on,
+            "payload": dumps([transaction_dict(t, reference) for t in customer_transactions]),
+        })
+
+    try:
+        invalidate_snapshots((loyalty_id, tax_year) for loyalty_id in loyalty_ids)
+        if rows:
+            db.session.execute(HistorySnapshot.__table__.insert(), rows)
+        db.session.commit()
+    except:
+        db.session.rollback()
+        raise
+    return len(rows)
+
+# Builds every customer's snapshot of `tax_year`, spread over a pool of
+# `processes` processes, each building BUILD_CHUNK_SIZE customers at a time.
+#
+# returns: the number of snapshots written
+def build_all_snapshots(tax_year, processes):
+    loyalty_ids = [loyalty_id for loyalty_id, in db.session.query(Transaction.loyalty_id)
+        .filter(Transaction.tax_year == tax_year)
+        .distinct()
+        .order_by(Transaction.loyalty_id)]
+    chunks = [loyalty_ids[start:start + BUILD_CHUNK_SIZE]
+        for start in range(0, len(loyalty_ids), BUILD_CHUNK_SIZE)]
+
+    if processes <= 1:
+        return sum(build_snapshots(tax_year, chunk) for chunk in chunks)
+
+    # Spawned rather than forked, so no process shares the parent's database
+    # connections
+    with ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context("spawn")) as pool:
+        return sum(pool.map(_build_chunk, [tax_year] * len(chunks), chunks))
+
+# Each pool process's own app, created on its first chunk
+_app = None
+
+# Runs inside a pool process. Like manage.py's app, it has no statement
+# timeout: a chunk may legitimately run for longer than any request should.
+def _build_chunk(tax_year, loyalty_ids):
+    global _app
+    if _app is None:
+        _app = create_app({"DB_STATEMENT_TIMEOUT": 0})
+    with _app.app_context():
+        return build_snapshots(tax_year, loyalty_ids)
@@ -8,6 +8,24 @@
 #        python manage.py db upgrade
 #  - Seed the database:
 #        python manage.py seed_db
+#  - Add made-up customers with transactions at production scale (see
+#    bulk_seed.py), after seed_db:
+#        python manage.py seed_bulk --customers 200000 --mean-transactions 10 --mean-lines 3
+#  - Fill in the stored display forms of phone numbers saved before they
+#    existed (safe to run repeatedly):
+#        python manage.py backfill_phone_formats
+#  - Delete expired tokens from the JWT blacklist and expired refresh tokens
+#    (workers also do this on their own, see RevocationList in models.py):
+#        python manage.py purge_jwt_blacklist
+#  - Log a customer or employee out of all their sessions, so that their
+#    refresh tokens no longer work (access tokens expire within the hour):
+#        python manage.py revoke_sessions --loyalty-id 67417
+#  - Build every customer's history snapshot for a closed tax year (by default
+#    last year), e.g. once the year is over and again before tax time:
+#        python manage.py build_history_snapshots --tax-year 2019 --processes 4
+#  - Export transactions for a tax year and/or date range as NDJSON (see
+#    export.py), optionally gzipped:
+#        python manage.py export_transactions --tax-year 2019 --output 2019.ndjson.gz --gzip
 #
 # HOW TO USE
 #
@@ -19,14 +37,23 @@
 # then the "seed_db" command above. These two commands are automatically called
 # in the heroku deploy because they are referenced in ./Procfile
 
+import datetime
 import os
+import sys
 
 from flask_script import Manager
 from flask_migrate import Migrate, MigrateCommand
 
-from app_init import app, db
-from models import User, Customer, Employee, Store, UnitType, ItemType
+from app_init import create_app, db
+from models import User, Customer, Employee, Store, UnitType, ItemType, JWTBlacklist, RefreshToken
+import export
+from bulk_seed import DISTRIBUTIONS, seed_bulk as generate_bulk
+from history_snapshots import build_all_snapshots
+from utility import format_phone_number
 
+# Migrations, backfills and exports may legitimately run for longer than any
+# request should
+app = create_app({"DB_STATEMENT_TIMEOUT": 0})
 migrate = Migrate(app, db)
 manager = Manager(app)
 
@@ -73,5 +100,128 @@ def seed_db():
         raise
 
 
+@manager.option("--customers", dest="customers", type=int, default=100000)
+@manager.option("--mean-transactions", dest="mean_transactions", type=float, default=8,
+    help="per customer")
+@manager.option("--mean-lines", dest="mean_lines", type=float, default=3, help="per transaction")
+@manager.option("--first-year", dest="first_year", type=int, default=datetime.date.today().year - 4)
+@manager.option("--last-year", dest="last_year", type=int, default=datetime.date.today().year)
+@manager.option("--distribution", dest="distribution", choices=DISTRIBUTIONS, default="geometric")
+@manager.option("--password", dest="password", default="hunter2", help="of every customer")
+@manager.option("--seed", dest="seed", type=int, default=None, help="to generate the same data again")
+def seed_bulk(customers, mean_transactions, mean_lines, first_year, last_year, distribution,
+        password, seed):
+    def progress(added):
+        print(f"{added['customers']}/{customers} customers, {added['transactions']} transactions, "
+            f"{added['lines']} lines", flush=True)
+
+    added = generate_bulk(customers, mean_transactions, mean_lines, first_year, last_year,
+        distribution, password, seed, progress)
+    print("Added {customers} customers, {transactions} transactions and {lines} lines".format(**added))
+
+
+@manager.option("--batch-size", dest="batch_size", type=int, default=1000)
+def backfill_phone_formats(batch_size):
+    try:
+        last_user_id = 0
+        backfilled = 0
+        while True:
+            batch = db.session.query(User.user_id, User.phone) \
+                .filter(User.phone != None, User.phone_display == None, User.user_id > last_user_id) \
+                .order_by(User.user_id) \
+                .limit(batch_size) \
+                .all()
+            if not batch:
+                break
+
+            updates = []
+            for user_id, phone in batch:
+                phone_display, phone_uri = format_phone_number(phone)
+                updates.append({"id": user_id, "display": phone_display, "uri": phone_uri})
+            # A plain UPDATE rather than through the ORM, which would bump each
+            # user's version_id (and with it their info's ETag) even though
+            # their info looks the same
+            db.session.execute(User.__table__.update()
+                .where(User.__table__.c.user_id == db.bindparam("id"))
+                .values(phone_display=db.bindparam("display"), phone_uri=db.bindparam("uri")),
+                updates)
+            db.session.commit()
+
+            last_user_id = batch[-1].user_id
+            backfilled += len(batch)
+
+        print(f"Backfilled phone formats for {backfilled} user(s)")
+    except:
+        db.session.rollback()
+        raise
+
+
+@manager.command
+def purge_jwt_blacklist():
+    try:
+        purged = JWTBlacklist.purge_expired()
+        purged_refresh_tokens = RefreshToken.purge_expired()
+        db.session.commit()
+        print(f"Purged {purged} expired token(s) from the JWT blacklist")
+        print(f"Purged {purged_refresh_tokens} expired refresh token(s)")
+    except:
+        db.session.rollback()
+        raise
+
+
+@manager.option("--loyalty-id", dest="loyalty_id", type=int, default=None)
+@manager.option("--employee-id", dest="employee_id", type=int, default=None)
+def revoke_sessions(loyalty_id, employee_id):
+    if (loyalty_id is None) == (employee_id is None):
+        raise ValueError("Give either --loyalty-id or --employee-id")
+    if loyalty_id is not None:
+        user = Customer.query.filter_by(loyalty_id=loyalty_id).first()
+    else:
+        user = Employee.query.filter_by(employee_id=employee_id).first()
+    if user is None:
+        raise ValueError("No such customer or employee")
+
+    try:
+        revoked = RefreshToken.revoke_user(user.user_id)
+        db.session.commit()
+        print(f"Revoked {revoked} refresh token(s)")
+    except:
+        db.session.rollback()
+        raise
+
+
+@manager.option("--tax-year", dest="tax_year", type=int, default=None)
+@manager.option("--processes", dest="processes", type=int, default=os.cpu_count())
+def build_history_snapshots(tax_year, processes):
+    current_year = datetime.date.today().year
+    if tax_year is None:
+        tax_year = current_year - 1
+    if tax_year >= current_year:
+        raise ValueError(f"Tax year {tax_year} isn't over yet; only closed years are snapshotted")
+
+    built = build_all_snapshots(tax_year, processes)
+    print(f"Built {built} history snapshot(s) for {tax_year}")
+
+
+@manager.option("--tax-year", dest="tax_year", default=None)
+@manager.option("--from", dest="start", default=None, help="first date, as YYYY-MM-DD")
+@manager.option("--to", dest="end", default=None, help="last date, as YYYY-MM-DD")
+@manager.option("--output", dest="output", default=None, help="file to write to, instead of stdout")
+@manager.option("--gzip", dest="gzip", action="store_true", default=False)
+def export_transactions(tax_year, start, end, output, gzip):
+    tax_year, start, end = export.check_export_range(tax_year, start, end)
+    chunks = export.export_transactions(export.export_connection(), tax_year, start, end)
+    if gzip:
+        chunks = export.gzip_chunks(chunks)
+
+    file = open(output, "wb") if output else sys.stdout.buffer
+    try:
+        for chunk in chunks:
+            file.write(chunk)
+    finally:
+        if output:
+            file.close()
+
+
 if __name__ == '__main__':
     manager.run()
@@ -0,0 +1,174 @@
+import os
+import threading
+import time
+
+from flask import Response, request
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, \
+    REGISTRY, generate_latest
+from prometheus_client import multiprocess
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import Pool
+
+# Per-route request metrics, served at GET /metrics in the Prometheus text
+# format.
+#
+# Under gunicorn every worker records its own metrics into files in
+# PROMETHEUS_MULTIPROC_DIR (set up by gunicorn.conf.py), and /metrics adds up
+# those of all workers, whichever worker answers the scrape. Without that
+# variable (e.g. `python application.py`), /metrics shows this process only.
+#
+# Routes are labeled by their URL rule (e.g. "/customer/history/year/<year>"),
+# so the number of series stays fixed. Requests matching no route are labeled
+# "unmatched".
+#
+# In-process caches registered with watch_cache() (e.g. the verified access
+# tokens of models.py) report their hits, misses and size too, at most every
+# CACHE_REPORT_INTERVAL seconds per worker, at the end of a request.
+#
+# Recording costs about 20 microseconds per request, plus next to nothing per
+# query: a few percent of the cheapest endpoints' time, and less for those
+# that query the database. benchmarks/metrics_overhead_benchmark.py measures
+# it per endpoint.
+
+LATENCY_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 1000)
+SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000)
+
+REQUEST_DURATION = Histogram("http_request_duration_seconds", "Time spent handling requests",
+    ["route", "method", "status"], buckets=LATENCY_BUCKETS)
+RESPONSE_SIZE = Histogram("http_response_size_bytes", "Size of response bodies (streamed ones excluded)",
+    ["route"], buckets=SIZE_BUCKETS)
+REQUEST_QUERIES = Histogram("db_queries_per_request", "Number of SQL statements run per request",
+    ["route"], buckets=QUERY_COUNT_BUCKETS)
+REQUEST_QUERY_DURATION = Histogram("db_query_duration_seconds_per_request",
+    "Time spent running SQL statements per request", ["route"], buckets=LATENCY_BUCKETS)
+BCRYPT_DURATION = Histogram("bcrypt_check_duration_seconds",
+    "Time spent checking passwords, including waiting for the bcrypt pool", buckets=LATENCY_BUCKETS)
+POOL_CHECKED_OUT = Gauge("db_pool_checked_out_connections",
+    "Database connections checked out of the connection pools", multiprocess_mode="livesum")
+CACHE_HITS = Counter("cache_hits", "Lookups answered by an in-process cache", ["cache"])
+CACHE_MISSES = Counter("cache_misses", "Lookups an in-process cache couldn't answer", ["cache"])
+CACHE_ENTRIES = Gauge("cache_entries", "Entries held by an in-process cache", ["cache"],
+    multiprocess_mode="livesum")
+
+CACHE_REPORT_INTERVAL = 1
+
+# What the current thread's request has done so far
+_current = threading.local()
+
+# The labeled metrics of each (route, method, status), as looking them up by
+# their labels on every request takes longer than observing them
+_labeled = {}
+
+# name => [cache, hits reported so far, misses reported so far]
+_caches = {}
+_caches_lock = threading.Lock()
+_caches_reported_at = 0.0
+
+# Reports the hits, misses and size of `cache` (a utility.LRUCache) under the
+# label cache=`name`
+def watch_cache(name, cache):
+    _caches[name] = [cache, 0, 0]
+
+# Starts recording metrics for `app`'s requests and adds GET /metrics. Called
+# by application.create_api_app() when METRICS_ENABLED is set.
+def init_app(app):
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    app.teardown_request(_abort_request)
+    app.add_url_rule("/metrics", "metrics", _metrics_view, methods=["GET"])
+
+    # Process-wide, so replicas and engines created later are covered too
+    if not event.contains(Engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+        event.listen(Pool, "checkout", _checkout)
+        event.listen(Pool, "checkin", _checkin)
+
+def _start_request():
+    _current.started = time.perf_counter()
+    _current.queries = 0
+    _current.query_seconds = 0.0
+
+def _finish_request(response):
+    if getattr(_current, "started", None) is not None:
+        size = response.content_length if not response.is_streamed else None
+        _record_request(response.status_code, size)
+    return response
+
+# Unhandled exceptions skip after_request; they become 500s
+def _abort_request(error):
+    if getattr(_current, "started", None) is not None:
+        _record_request(500, None)
+
+def _record_request(status, size):
+    elapsed = time.perf_counter() - _current.started
+    _current.started = None
+
+    url_rule = request.url_rule
+    route = url_rule.rule if url_rule is not None else "unmatched"
+    key = (route, request.method, status)
+    labeled = _labeled.get(key)
+    if labeled is None:
+        labeled = _labeled[key] = (
+            REQUEST_DURATION.labels(*key),
+            REQUEST_QUERIES.labels(route),
+            REQUEST_QUERY_DURATION.labels(route),
+            RESPONSE_SIZE.labels(route),
+        )
+    duration, queries, query_duration, response_size = labeled
+
+    duration.observe(elapsed)
+    queries.observe(_current.queries)
+    query_duration.observe(_current.query_seconds)
+    if size is not None:
+        response_size.observe(size)
+
+    if _caches and time.monotonic() - _caches_reported_at >= CACHE_REPORT_INTERVAL:
+        _report_caches()
+
+# The caches count their own hits and misses; the counters are advanced by as
+# many as happened since the previous report
+def _report_caches():
+    global _caches_reported_at
+    # Another thread reporting at the same time would count them twice
+    if not _caches_lock.acquire(blocking=False):
+        return
+    try:
+        _caches_reported_at = time.monotonic()
+        for name, watched in _caches.items():
+            cache, hits, misses = watched
+            stats = cache.stats()
+            CACHE_HITS.labels(name).inc(stats["hits"] - hits)
+            CACHE_MISSES.labels(name).inc(stats["misses"] - misses)
+            CACHE_ENTRIES.labels(name).set(stats["size"])
+            watched[1:] = [stats["hits"], stats["misses"]]
+    finally:
+        _caches_lock.release()
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info["query_started"] = time.perf_counter()
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_started"]
+    if getattr(_current, "started", None) is not None:
+        _current.queries += 1
+        _current.query_seconds += elapsed
+
+def _checkout(dbapi_connection, connection_record, connection_proxy):
+    POOL_CHECKED_OUT.inc()
+
+def _checkin(dbapi_connection, connection_record):
+    POOL_CHECKED_OUT.dec()
+
+# GET /metrics, not in specification: meant to be scraped by Prometheus, not
+# used by the frontends
+def _metrics_view():
+    _report_caches()
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ or "prometheus_multiproc_dir" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return Response(generate_latest(registry), mimetype=CONTENT_TYPE_LATEST)
@@ -0,0 +1,30 @@
+"""add jti and expiry to jwt blacklist
+
+Revision ID: 3f1c9a7d2e48
+Revises: b5daf435b735
+Create Date: 2026-10-18 13:47:05.902117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1c9a7d2e48'
+down_revision = 'b5daf435b735'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('jwt_blacklist', sa.Column('jti', sa.String(length=36), nullable=True))
+    op.add_column('jwt_blacklist', sa.Column('expires_on', sa.DateTime(), nullable=True))
+    op.create_unique_constraint(None, 'jwt_blacklist', ['jti'])
+    op.create_index(op.f('ix_jwt_blacklist_expires_on'), 'jwt_blacklist', ['expires_on'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_jwt_blacklist_expires_on'), table_name='jwt_blacklist')
+    op.drop_constraint('jwt_blacklist_jti_key', 'jwt_blacklist', type_='unique')
+    op.drop_column('jwt_blacklist', 'expires_on')
+    op.drop_column('jwt_blacklist', 'jti')
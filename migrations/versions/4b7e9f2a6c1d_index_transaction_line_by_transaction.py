@@ -0,0 +1,25 @@
+"""index transaction line by transaction
+
+Revision ID: 4b7e9f2a6c1d
+Revises: d6b0f3a8c2e1
+Create Date: 2026-10-19 09:21:05.641872
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4b7e9f2a6c1d'
+down_revision = 'd6b0f3a8c2e1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index(op.f('ix_transaction_line_transaction_id'), 'transaction_line', ['transaction_id'],
+        unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_transaction_line_transaction_id'), table_name='transaction_line')
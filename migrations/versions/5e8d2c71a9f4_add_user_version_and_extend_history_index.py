@@ -0,0 +1,30 @@
+"""add user version and extend history index
+
+Revision ID: 5e8d2c71a9f4
+Revises: 700025eefef3
+Create Date: 2026-10-18 19:02:13.514277
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5e8d2c71a9f4'
+down_revision = '700025eefef3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('user', sa.Column('version_id', sa.Integer(), server_default='1', nullable=False))
+    op.create_index('ix_transaction_loyalty_id_tax_year_date_id', 'transaction',
+        ['loyalty_id', 'tax_year', 'date', 'transaction_id'], unique=False)
+    op.drop_index('ix_transaction_loyalty_id_tax_year_date', table_name='transaction')
+
+
+def downgrade():
+    op.create_index('ix_transaction_loyalty_id_tax_year_date', 'transaction',
+        ['loyalty_id', 'tax_year', 'date'], unique=False)
+    op.drop_index('ix_transaction_loyalty_id_tax_year_date_id', table_name='transaction')
+    op.drop_column('user', 'version_id')
@@ -0,0 +1,27 @@
+"""store phone display forms
+
+Revision ID: 700025eefef3
+Revises: bf9139be0512
+Create Date: 2026-10-18 17:55:48.120934
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '700025eefef3'
+down_revision = 'bf9139be0512'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Existing rows are filled in by `python manage.py backfill_phone_formats`
+    op.add_column('user', sa.Column('phone_display', sa.String(length=255), nullable=True))
+    op.add_column('user', sa.Column('phone_uri', sa.String(length=255), nullable=True))
+
+
+def downgrade():
+    op.drop_column('user', 'phone_uri')
+    op.drop_column('user', 'phone_display')
@@ -0,0 +1,35 @@
+"""add history snapshot
+
+Revision ID: 9a41c6e2d7b3
+Revises: 5e8d2c71a9f4
+Create Date: 2026-10-18 19:48:36.902145
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9a41c6e2d7b3'
+down_revision = '5e8d2c71a9f4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Filled in by `python manage.py build_history_snapshots`
+    op.create_table('history_snapshot',
+    sa.Column('loyalty_id', sa.Integer(), nullable=False),
+    sa.Column('tax_year', sa.Integer(), nullable=False),
+    sa.Column('newest_transaction_id', sa.Integer(), nullable=False),
+    sa.Column('transaction_count', sa.Integer(), nullable=False),
+    sa.Column('reference_version', sa.String(length=8), nullable=False),
+    sa.Column('built_on', sa.DateTime(), nullable=False),
+    sa.Column('payload', sa.LargeBinary(), nullable=False),
+    sa.ForeignKeyConstraint(['loyalty_id'], ['customer.loyalty_id'], ),
+    sa.PrimaryKeyConstraint('loyalty_id', 'tax_year')
+    )
+
+
+def downgrade():
+    op.drop_table('history_snapshot')
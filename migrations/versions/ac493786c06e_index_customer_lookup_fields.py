@@ -0,0 +1,32 @@
+"""index customer lookup fields
+
+Revision ID: ac493786c06e
+Revises: 3f1c9a7d2e48
+Create Date: 2026-10-18 15:20:33.518260
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'ac493786c06e'
+down_revision = '3f1c9a7d2e48'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Expression indexes matching the case-insensitive lookups in
+    # Customer.lookup_criterion, e.g. `lower(first_name) = 'value'`
+    op.create_index('ix_user_lower_first_name', 'user', [sa.text('lower(first_name)')], unique=False)
+    op.create_index('ix_user_lower_last_name', 'user', [sa.text('lower(last_name)')], unique=False)
+    op.create_index('ix_user_lower_email', 'user', [sa.text('lower(email)')], unique=False)
+    op.create_index('ix_user_phone', 'user', ['phone'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_user_phone', table_name='user')
+    op.drop_index('ix_user_lower_email', table_name='user')
+    op.drop_index('ix_user_lower_last_name', table_name='user')
+    op.drop_index('ix_user_lower_first_name', table_name='user')
@@ -0,0 +1,25 @@
+"""index transaction by customer and year
+
+Revision ID: b5daf435b735
+Revises: 0c3120dddaa3
+Create Date: 2026-10-18 10:12:41.218374
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b5daf435b735'
+down_revision = '0c3120dddaa3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_transaction_loyalty_id_tax_year_date', 'transaction',
+        ['loyalty_id', 'tax_year', 'date'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_transaction_loyalty_id_tax_year_date', table_name='transaction')
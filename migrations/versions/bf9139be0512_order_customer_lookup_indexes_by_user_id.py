@@ -0,0 +1,38 @@
+"""order customer lookup indexes by user_id
+
+Revision ID: bf9139be0512
+Revises: ac493786c06e
+Create Date: 2026-10-18 16:41:09.774501
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'bf9139be0512'
+down_revision = 'ac493786c06e'
+branch_labels = None
+depends_on = None
+
+
+# Lookups are paginated in user_id order, so user_id is appended to each lookup
+# index; a page of matches is then a single ordered index range scan.
+LOOKUP_INDEXES = [
+    ('ix_user_lower_first_name', 'lower(first_name)'),
+    ('ix_user_lower_last_name', 'lower(last_name)'),
+    ('ix_user_lower_email', 'lower(email)'),
+    ('ix_user_phone', 'phone'),
+]
+
+
+def upgrade():
+    for name, expression in LOOKUP_INDEXES:
+        op.drop_index(name, table_name='user')
+        op.create_index(name, 'user', [sa.text(expression), 'user_id'], unique=False)
+
+
+def downgrade():
+    for name, expression in LOOKUP_INDEXES:
+        op.drop_index(name, table_name='user')
+        op.create_index(name, 'user', [sa.text(expression)], unique=False)
@@ -0,0 +1,41 @@
+"""add refresh token
+
+Revision ID: d6b0f3a8c2e1
+Revises: 9a41c6e2d7b3
+Create Date: 2026-10-18 23:12:47.315208
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd6b0f3a8c2e1'
+down_revision = '9a41c6e2d7b3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('refresh_token',
+    sa.Column('refresh_token_id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('jti', sa.String(length=36), nullable=False),
+    sa.Column('family_id', sa.String(length=36), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('issued_on', sa.DateTime(), nullable=False),
+    sa.Column('expires_on', sa.DateTime(), nullable=False),
+    sa.Column('used_on', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['user_id'], ['user.user_id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('refresh_token_id'),
+    sa.UniqueConstraint('jti')
+    )
+    op.create_index(op.f('ix_refresh_token_expires_on'), 'refresh_token', ['expires_on'], unique=False)
+    op.create_index(op.f('ix_refresh_token_family_id'), 'refresh_token', ['family_id'], unique=False)
+    op.create_index(op.f('ix_refresh_token_user_id'), 'refresh_token', ['user_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_refresh_token_user_id'), table_name='refresh_token')
+    op.drop_index(op.f('ix_refresh_token_family_id'), table_name='refresh_token')
+    op.drop_index(op.f('ix_refresh_token_expires_on'), table_name='refresh_token')
+    op.drop_table('refresh_token')
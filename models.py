@@ -1,9 +1,19 @@
 import jwt
 import jwt.exceptions
 import datetime
+import os
+import threading
+import time
+import uuid
 
-from app_init import app, db, bcrypt
-from utility import APIError
+from flask import current_app
+from sqlalchemy import event
+
+from app_init import db
+from bcrypt_pool import BcryptPool, BcryptPoolSaturated, generate_password_hash
+import metrics
+from metrics import BCRYPT_DURATION
+from utility import APIError, LRUCache, format_phone_number, normalize_phone_number
 
 # See also: "/docs/ER Diagram.svg"
 # All tables besides JWTBlacklist appear on the diagram, JWTBlacklist
@@ -13,8 +23,12 @@ class User(db.Model):
     __tablename__ = "user"
     user_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     user_type = db.Column(db.String(4), nullable=False)
+    # Incremented by the ORM on every update of a user, so it can serve as the
+    # ETag of their info (see GET /customer/info)
+    version_id = db.Column(db.Integer, nullable=False, server_default="1")
     __mapper_args__ = {
-        "polymorphic_on": user_type
+        "polymorphic_on": user_type,
+        "version_id_col": version_id
     }
 
     password = db.Column(db.String(255), nullable=False)
@@ -28,25 +42,65 @@ class User(db.Model):
     zip_code = db.Column(db.String(5), nullable=True)
     email = db.Column(db.String(255), nullable=True)
     phone = db.Column(db.String(255), nullable=True)
+    # Display forms of `phone`, kept up to date whenever it is set (see
+    # `_format_phone` below); backfill with `manage.py backfill_phone_formats`
+    phone_display = db.Column(db.String(255), nullable=True)
+    phone_uri = db.Column(db.String(255), nullable=True)
+
+    # Used by the employee customer lookups (see Customer.lookup_criterion),
+    # which compare names and emails case-insensitively. The trailing user_id
+    # lets a page of matches be read in order straight from the index.
+    __table_args__ = (
+        db.Index('ix_user_lower_first_name', db.func.lower(first_name), user_id),
+        db.Index('ix_user_lower_last_name', db.func.lower(last_name), user_id),
+        db.Index('ix_user_lower_email', db.func.lower(email), user_id),
+        db.Index('ix_user_phone', phone, user_id),
+    )
 
     def __init__(self, user_type, password, first_name, last_name):
         self.user_type = user_type
-        self.password = bcrypt.generate_password_hash(password,
-            app.config["BCRYPT_LOG_ROUNDS"]).decode()
+        self.password = generate_password_hash(password, current_app.config["BCRYPT_LOG_ROUNDS"])
         self.first_name = first_name
         self.last_name = last_name
 
+    # Returns the user the access token was issued to, if it is of
+    # `expected_type`.
+    #
+    # Verified tokens are remembered (see `verified_tokens` below), so a repeat
+    # request from an active session resolves its user without touching the
+    # database. The returned user is therefore detached from the session and
+    # shared between requests: treat it as read-only, and `db.session.merge()`
+    # it first if it ever needs to be modified.
     @staticmethod
     def from_authorization(access_token, expected_type):
+        user = verified_tokens.get(access_token)
+        if user is None:
+            user = User._verify_access_token(access_token)
+
+        if not isinstance(user, expected_type):
+            raise APIError.forbidden()
+
+        return user
+
+    @staticmethod
+    def _verify_access_token(access_token):
         try:
-            payload = jwt.decode(access_token, app.config["JWT_SECRET"])
-            if JWTBlacklist.token_blacklisted(access_token):
+            payload = jwt.decode(access_token, current_app.config["JWT_SECRET"])
+            if JWTBlacklist.token_blacklisted(access_token, payload.get('jti')):
                 raise APIError.bad_access_token("Session expired (logout).")
 
-            user = User.query.filter_by(user_id=payload['sub']).first()
-            if not isinstance(user, expected_type):
-                raise APIError.forbidden()
-
+            # Load the subclass columns in the same query, so everything the
+            # endpoints read is already there once the user is detached
+            user = User.query.with_polymorphic("*").filter_by(user_id=payload['sub']).first()
+            if user is None:
+                raise APIError.bad_access_token("Invalid session.")
+            db.session.expunge(user)
+
+            # Entries live until the token expires, but no longer than
+            # TOKEN_CACHE_TTL, which bounds how long another worker's logout or
+            # change to the user can go unnoticed here
+            verified_tokens.set(access_token, user,
+                min(payload['exp'], time.time() + current_app.config["TOKEN_CACHE_TTL"]))
             return user
 
         except jwt.ExpiredSignatureError:
@@ -56,27 +110,48 @@ class User(db.Model):
         except jwt.exceptions.InvalidKeyError: #Happens if alg="none" in received header
             raise APIError.bad_access_token("Invalid session.")
 
+    # The check runs in the bcrypt pool (see bcrypt_pool.py); if that is
+    # saturated, the login is refused with a 503 instead of waiting.
     def is_authentic(self, candidate_password):
-        return bcrypt.check_password_hash(self.password, candidate_password)
+        try:
+            with BCRYPT_DURATION.time():
+                return bcrypt_workers.check_password_hash(self.password, candidate_password)
+        except BcryptPoolSaturated:
+            raise APIError.service_unavailable(current_app.config["BCRYPT_RETRY_AFTER"])
 
     def generate_access_token(self, timeout=datetime.timedelta(hours=1)):
+        return User.access_token_for(self.user_id, timeout)
+
+    # Returns a new access token for the user with `user_id`; also used to
+    # refresh a session without loading its user (see RefreshToken.rotate)
+    @staticmethod
+    def access_token_for(user_id, timeout=datetime.timedelta(hours=1)):
         # SECURITY: This payload is only signed, not encrypted, so do not put
         # sensitive information inside. Sending a autoincremented user-id may be
         # a business intelligence security flaw. See for more info:
         # https://medium.com/lightrail/prevent-business-intelligence-leaks-by-using-uuids-instead-of-database-ids-on-urls-and-in-apis-17f15669fd2e
 
-        # Another minor security note: we could use a 'jti' to prevent jwt
-        # replay. But doing so would be overkill: we allow unlimited logins and
-        # have no need for / implementation of a "logout of all devices" feature
+        # The 'jti' uniquely identifies this token, so that it can be revoked
+        # (see JWTBlacklist) without keeping or comparing whole tokens
         payload = {
             'exp': datetime.datetime.utcnow() + timeout,
             'iat': datetime.datetime.utcnow(),
-            'sub': self.user_id
+            'sub': user_id,
+            'jti': str(uuid.uuid4())
         }
 
         # Are you wondering why encode then decode?, the encode returns a byte-string
         # the decode at the end converts it into a JSON serializable string
-        return jwt.encode(payload, app.config["JWT_SECRET"], algorithm="HS256").decode()
+        return jwt.encode(payload, current_app.config["JWT_SECRET"], algorithm="HS256").decode()
+
+    # Starts a new session for the user, returning its first refresh token
+    # (see RefreshToken). Does not commit.
+    def generate_refresh_token(self):
+        return RefreshToken.issue(self.user_id, str(uuid.uuid4()))
+
+@event.listens_for(User.phone, "set", propagate=True)
+def _format_phone(target, value, oldvalue, initiator):
+    target.phone_display, target.phone_uri = format_phone_number(value)
 
 class Customer(User):
     __tablename__ = "customer"
@@ -92,6 +167,26 @@ class Customer(User):
         self.loyalty_id = loyalty_id
 
 
+    # Returns the filter criterion for looking up customers by `field_name`
+    # (case-insensitive: "firstName", "lastName", "email" or "phone"), or None
+    # if customers can't be looked up by that field.
+    #
+    # Each criterion has exactly the shape of one of the indexes on User, e.g.
+    # `lower(first_name) = 'value'`, so that lookups don't scan the table.
+    @staticmethod
+    def lookup_criterion(field_name, field_value):
+        field_name = field_name.lower()
+        if field_name == 'firstname':
+            return db.func.lower(Customer.first_name) == field_value.lower()
+        elif field_name == 'lastname':
+            return db.func.lower(Customer.last_name) == field_value.lower()
+        elif field_name == 'email':
+            return db.func.lower(Customer.email) == field_value.lower()
+        elif field_name == 'phone':
+            return Customer.phone == normalize_phone_number(field_value)
+        else:
+            return None
+
     @staticmethod
     def find_and_authenticate(loyalty_id, password):
         user = Customer.query.filter_by(loyalty_id=loyalty_id).first()
@@ -131,25 +226,301 @@ class JWTBlacklistedError(Exception):
 # This table stores logged out JWT tokens; currently however, there is no implemented
 # way to log out a token, so this table will always be empty.
 #
+# Rows are only needed until their token expires; after that the token is
+# rejected on its own. Expired rows are deleted by `manage.py purge_jwt_blacklist`
+# and periodically by every worker (see RevocationList), so the table stays small.
+#
 # TODO: implement a way to log out tokens if this is a desired feature
-# TODO: enable some way to clean up this table of expired tokens
 class JWTBlacklist(db.Model):
     __tablename__ = 'jwt_blacklist'
 
     id = db.Column('jwt_blacklist_id', db.Integer, primary_key=True, autoincrement=True)
     token = db.Column('token', db.String(500), unique=True, nullable=False)
     blacklistedOn = db.Column('blacklisted_on', db.DateTime, nullable=False)
+    # Both are read from the token itself. Tokens issued before 'jti' claims were
+    # added have no jti; those are matched by the whole token instead.
+    jti = db.Column('jti', db.String(36), unique=True, nullable=True)
+    expiresOn = db.Column('expires_on', db.DateTime, nullable=True, index=True)
 
     def __init__(self, token):
         self.token = token
         self.blacklistedOn = datetime.datetime.now()
 
+        # The token was already verified when it was used; here we only need to
+        # read its claims, even if it has expired in the meantime
+        payload = jwt.decode(token, verify=False)
+        self.jti = payload.get('jti')
+        if 'exp' in payload:
+            self.expiresOn = datetime.datetime.utcfromtimestamp(payload['exp'])
+
     def __repr__(self):
         return '<id: token: {}>'.format(self.token)
 
+    # Answered from this worker's in-memory RevocationList, without querying the
+    # database.
     @staticmethod
-    def token_blacklisted(access_token):
-        return JWTBlacklist.query.filter_by(token=str(access_token)).count() != 0
+    def token_blacklisted(access_token, jti=None):
+        return revoked_tokens.is_revoked(jti or str(access_token))
+
+    # Deletes blacklisted tokens that have expired, and returns how many were
+    # deleted. Does not commit.
+    @staticmethod
+    def purge_expired():
+        return JWTBlacklist.query \
+            .filter(JWTBlacklist.expiresOn < datetime.datetime.utcnow()) \
+            .delete(synchronize_session=False)
+
+# Refresh tokens let a client get a new access token when its current one
+# expires, without logging in (and checking a password) again.
+#
+# A refresh token is a JWT like an access token, but with the audience "refresh",
+# so neither can be used as the other. Each can be used once: exchanging it
+# (`rotate`) marks its row used and issues the next token of the same session,
+# or "family". Its signature and expiry are checked first, so only genuine,
+# unexpired tokens reach the database, and using one then takes a single
+# UPDATE by its unique jti. A token that is used a second time was either
+# replayed or stolen, and revokes its whole family, logging the session out.
+#
+# Each token of a family expires REFRESH_TOKEN_TTL seconds after it was issued,
+# so a session lasts for as long as it keeps being used within that time. Rows
+# of expired tokens are deleted along with those of the JWT blacklist (see
+# RevocationList and `manage.py purge_jwt_blacklist`).
+class RefreshToken(db.Model):
+    __tablename__ = 'refresh_token'
+
+    refresh_token_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    jti = db.Column(db.String(36), unique=True, nullable=False)
+    family_id = db.Column(db.String(36), nullable=False, index=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.user_id', ondelete='CASCADE'), nullable=False,
+        index=True)
+    issued_on = db.Column(db.DateTime, nullable=False)
+    expires_on = db.Column(db.DateTime, nullable=False, index=True)
+    # Set once the token has been exchanged for the next one, or revoked
+    used_on = db.Column(db.DateTime, nullable=True)
+
+    AUDIENCE = "refresh"
+
+    # Adds the row of a new token of the family `family_id` and returns the
+    # token. Does not commit.
+    @staticmethod
+    def issue(user_id, family_id):
+        now = datetime.datetime.utcnow()
+        row = RefreshToken(jti=str(uuid.uuid4()), family_id=family_id, user_id=user_id, issued_on=now,
+            expires_on=now + datetime.timedelta(seconds=current_app.config["REFRESH_TOKEN_TTL"]))
+        db.session.add(row)
+
+        payload = {
+            'exp': row.expires_on,
+            'iat': now,
+            'sub': user_id,
+            'jti': row.jti,
+            'fam': family_id,
+            'aud': RefreshToken.AUDIENCE
+        }
+        return jwt.encode(payload, current_app.config["JWT_SECRET"], algorithm="HS256").decode()
+
+    # Exchanges a refresh token for a new access token and the next refresh
+    # token of its session, and commits.
+    #
+    # returns: (access token, refresh token)
+    @staticmethod
+    def rotate(refresh_token):
+        payload = RefreshToken._verify(refresh_token)
+        used = RefreshToken.query \
+            .filter(RefreshToken.jti == payload['jti'], RefreshToken.used_on.is_(None)) \
+            .update({RefreshToken.used_on: datetime.datetime.utcnow()}, synchronize_session=False)
+        if not used:
+            RefreshToken.revoke_family(payload['fam'])
+            db.session.commit()
+            raise APIError.bad_refresh_token()
+
+        next_token = RefreshToken.issue(payload['sub'], payload['fam'])
+        db.session.commit()
+        return User.access_token_for(payload['sub']), next_token
+
+    # Logs out the session of a refresh token, and commits. Access tokens
+    # already issued to it stay valid until they expire.
+    @staticmethod
+    def revoke(refresh_token):
+        RefreshToken.revoke_family(RefreshToken._verify(refresh_token)['fam'])
+        db.session.commit()
+
+    # Revokes every token of a family, and returns how many were still usable.
+    # Does not commit.
+    @staticmethod
+    def revoke_family(family_id):
+        return RefreshToken.query \
+            .filter(RefreshToken.family_id == family_id, RefreshToken.used_on.is_(None)) \
+            .update({RefreshToken.used_on: datetime.datetime.utcnow()}, synchronize_session=False)
+
+    # Logs a user out of all their sessions, e.g. after their password was
+    # compromised, and returns how many were still usable. Does not commit.
+    @staticmethod
+    def revoke_user(user_id):
+        return RefreshToken.query \
+            .filter(RefreshToken.user_id == user_id, RefreshToken.used_on.is_(None)) \
+            .update({RefreshToken.used_on: datetime.datetime.utcnow()}, synchronize_session=False)
+
+    # Deletes the rows of expired tokens, and returns how many were deleted.
+    # Does not commit.
+    @staticmethod
+    def purge_expired():
+        return RefreshToken.query \
+            .filter(RefreshToken.expires_on < datetime.datetime.utcnow()) \
+            .delete(synchronize_session=False)
+
+    # Checks the token's signature, expiry and audience, and returns its claims
+    @staticmethod
+    def _verify(refresh_token):
+        try:
+            return jwt.decode(refresh_token, current_app.config["JWT_SECRET"], algorithms=["HS256"],
+                audience=RefreshToken.AUDIENCE)
+        except (jwt.InvalidTokenError, jwt.exceptions.InvalidKeyError):
+            raise APIError.bad_refresh_token()
+
+# Every worker keeps the set of revoked tokens (by jti, or the whole token for
+# old tokens) in memory, so checking a token never queries the database.
+#
+# A background thread keeps it current: every `refresh_interval` seconds it
+# reads only the JWTBlacklist rows added since the previous refresh, and every
+# `purge_interval` seconds it deletes expired rows (and those of RefreshToken).
+#
+# Rows are read by id, but ids aren't committed in order: a row can become
+# visible after rows with higher ids were already read. So the ids skipped over
+# by a refresh are read again by the next ones, until they show up or
+# GAP_TIMEOUT seconds have passed (their insert was rolled back). Only the last
+# GAP_WINDOW ids are tracked, which also keeps ids of purged rows out of it. The first lookup in a
+# process loads the set synchronously and starts the thread. That happens per
+# process, because gunicorn forks workers after import and threads don't
+# survive a fork.
+class RevocationList:
+    GAP_TIMEOUT = 600
+    GAP_WINDOW = 100
+
+    def __init__(self, refresh_interval=5, purge_interval=3600):
+        self.refresh_interval = refresh_interval
+        self.purge_interval = purge_interval
+        self._revoked = {} # jti or token => expiry in seconds since the epoch
+        self._last_id = 0
+        self._gaps = {} # ids below _last_id not read yet => time.monotonic() when skipped
+        self._lock = threading.Lock()
+        self._pid = None
+        self._app = None
+
+    def is_revoked(self, key):
+        if self._pid != os.getpid():
+            self._start()
+        return key in self._revoked
+
+    # Marks a token revoked in this process right away, rather than at the next
+    # refresh
+    def add(self, key, expires_at):
+        self._revoked[key] = expires_at
+
+    def refresh(self):
+        with self._lock:
+            self._refresh()
+
+    # Must be called with the lock held
+    def _refresh(self):
+        criterion = JWTBlacklist.id > self._last_id
+        if self._gaps:
+            criterion = db.or_(criterion, JWTBlacklist.id.in_(sorted(self._gaps)))
+        rows = db.session.query(JWTBlacklist.id, JWTBlacklist.jti, JWTBlacklist.token,
+                JWTBlacklist.expiresOn) \
+            .filter(criterion) \
+            .order_by(JWTBlacklist.id) \
+            .all()
+
+        started = time.monotonic()
+        gaps = {id: skipped_at for id, skipped_at in self._gaps.items()
+            if started - skipped_at < self.GAP_TIMEOUT}
+        revoked = dict(self._revoked)
+        for id, jti, token, expires_on in rows:
+            revoked[jti or token] = _epoch_seconds(expires_on)
+            verified_tokens.discard(token)
+            if id > self._last_id:
+                gaps.update((skipped, started)
+                    for skipped in range(max(self._last_id + 1, id - self.GAP_WINDOW), id))
+                self._last_id = id
+            else:
+                gaps.pop(id, None)
+        self._gaps = {id: skipped_at for id, skipped_at in gaps.items()
+            if id > self._last_id - self.GAP_WINDOW}
+
+        now = time.time()
+        self._revoked = {key: expires_at for key, expires_at in revoked.items()
+            if expires_at is None or expires_at > now}
+
+    # Loads the set for this process before anyone can check against it: until
+    # _pid is set, every other thread waits here for the lock
+    def _start(self):
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._revoked = {}
+            self._last_id = 0
+            self._gaps = {}
+            # The thread needs its own app context, for the app in use now
+            self._app = current_app._get_current_object()
+            self._refresh()
+            self._pid = os.getpid()
+
+        threading.Thread(target=self._run, name="revocation-list", daemon=True).start()
+
+    def _run(self):
+        last_purge = time.monotonic()
+        while True:
+            time.sleep(self.refresh_interval)
+            with self._app.app_context():
+                try:
+                    if time.monotonic() - last_purge >= self.purge_interval:
+                        JWTBlacklist.purge_expired()
+                        RefreshToken.purge_expired()
+                        db.session.commit()
+                        last_purge = time.monotonic()
+                    self.refresh()
+                except Exception:
+                    # Try again next time; a failed refresh only means this
+                    # worker learns about new revocations a little later
+                    db.session.rollback()
+                    self._app.logger.exception("Refreshing the JWT revocation list failed")
+                finally:
+                    db.session.remove()
+
+def _epoch_seconds(utc_datetime):
+    if utc_datetime is None:
+        return None
+    return utc_datetime.replace(tzinfo=datetime.timezone.utc).timestamp()
+
+# The three below are sized from the app's config by init_app()
+revoked_tokens = RevocationList()
+
+bcrypt_workers = BcryptPool()
+
+# Access tokens that passed User.from_authorization, mapped to their (detached)
+# user. Within this process, entries are dropped as soon as their token is
+# blacklisted or their user is changed.
+verified_tokens = LRUCache(10000)
+metrics.watch_cache("verified_tokens", verified_tokens)
+
+# Applies the app's config to this module's process-wide state. Called by
+# app_init.create_app().
+def init_app(app):
+    revoked_tokens.refresh_interval = app.config["REVOCATION_REFRESH_INTERVAL"]
+    revoked_tokens.purge_interval = app.config["JWT_BLACKLIST_PURGE_INTERVAL"]
+    bcrypt_workers.configure(app.config["BCRYPT_POOL_SIZE"], app.config["BCRYPT_QUEUE_DEPTH"])
+    verified_tokens.maxsize = app.config["TOKEN_CACHE_SIZE"]
+
+@event.listens_for(User, "after_update", propagate=True)
+@event.listens_for(User, "after_delete", propagate=True)
+def _forget_verified_user(mapper, connection, target):
+    verified_tokens.discard_if(lambda user: user.user_id == target.user_id)
+
+@event.listens_for(JWTBlacklist, "after_insert")
+def _forget_verified_token(mapper, connection, target):
+    verified_tokens.discard(target.token)
+    revoked_tokens.add(target.jti or target.token, _epoch_seconds(target.expiresOn))
 
 
 class Store(db.Model):
@@ -164,6 +535,13 @@ class Store(db.Model):
 
 class Transaction(db.Model):
     __tablename__ = 'transaction'
+    # Covers the customer history endpoints: the list of tax years and the
+    # ETags (which use the highest transaction_id) are index-only scans, and a
+    # year's transactions come back already in (date, transaction_id) order
+    __table_args__ = (
+        db.Index('ix_transaction_loyalty_id_tax_year_date_id',
+            'loyalty_id', 'tax_year', 'date', 'transaction_id'),
+    )
 
     transaction_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     date = db.Column(db.DateTime)
@@ -171,6 +549,9 @@ class Transaction(db.Model):
     store_id = db.Column(db.Integer, db.ForeignKey('store.store_id'))
     tax_year = db.Column(db.Integer, nullable=False)
 
+    lines = db.relationship("TransactionLine", backref="transaction",
+        order_by="TransactionLine.transaction_line_id")
+
     def __init__(self, date, loyalty_id, store_id, tax_year):
         self.date = date
         self.loyalty_id = loyalty_id
@@ -186,7 +567,9 @@ class TransactionLine(db.Model):
     unit_type_id = db.Column(db.Integer, db.ForeignKey('unit_type.unit_type_id'))
     quantity = db.Column(db.Integer, nullable=False)
     description = db.Column(db.String(500))
-    transaction_id = db.Column(db.Integer, db.ForeignKey('transaction.transaction_id'))
+    # Indexed, since Postgres doesn't index foreign keys by itself: transactions'
+    # lines are looked up by it whenever their history is read or exported
+    transaction_id = db.Column(db.Integer, db.ForeignKey('transaction.transaction_id'), index=True)
 
     def __init__(self, item_type_id, unit_type_id, quantity, description, transaction_id):
         self.item_type_id = item_type_id
@@ -196,6 +579,25 @@ class TransactionLine(db.Model):
         self.transaction_id = transaction_id
 
 
+# A customer's history for one (closed) tax year, already serialized as the
+# JSON array of GET /customer/history/year/<year>'s "history". Built by
+# `manage.py build_history_snapshots` (see history_snapshots.py) and deleted
+# when a transaction is added to that year.
+#
+# The other columns record what the payload was built from; a snapshot is only
+# served while they still match.
+class HistorySnapshot(db.Model):
+    __tablename__ = 'history_snapshot'
+
+    loyalty_id = db.Column(db.Integer, db.ForeignKey('customer.loyalty_id'), primary_key=True)
+    tax_year = db.Column(db.Integer, primary_key=True)
+    newest_transaction_id = db.Column(db.Integer, nullable=False)
+    transaction_count = db.Column(db.Integer, nullable=False)
+    reference_version = db.Column(db.String(8), nullable=False)
+    built_on = db.Column(db.DateTime, nullable=False)
+    payload = db.Column(db.LargeBinary, nullable=False)
+
+
 class ItemType(db.Model):
     __tablename__ = 'item_type'
 
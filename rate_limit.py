@@ -0,0 +1,113 @@
+import math
+import sqlite3
+import threading
+import time
+
+from flask import current_app, request
+
+from utility import APIError
+
+# Limits how often logins may be attempted, per client address and per
+# account, so that guessing passwords (or a misconfigured client retrying in a
+# loop) can't keep the bcrypt pool (see bcrypt_pool.py) busy for everyone else.
+# Attempts are counted before the account is looked up, so a refused one costs
+# neither a query nor a password check.
+#
+# Each address and each account has a token bucket holding up to N attempts,
+# which refills at N attempts a minute: N is LOGIN_ATTEMPTS_PER_IP or
+# LOGIN_ATTEMPTS_PER_ACCOUNT (see environment.py). An attempt takes one from
+# both of its buckets, and is refused with a 429 while either is empty.
+#
+# The buckets are kept in a SQLite file (LOGIN_RATE_LIMIT_PATH), which every
+# worker on the machine opens, so they are shared by all of its gunicorn
+# workers. Nothing in it needs to survive a crash or restart: deleting the file
+# resets every bucket. Separate machines (dynos) each keep their own.
+
+# How many seconds apart each worker deletes buckets that have refilled
+PURGE_INTERVAL = 60
+
+class LoginRateLimiter:
+    def __init__(self):
+        # SQLite connections can't be shared between threads
+        self._local = threading.local()
+        self._purged_at = 0
+
+    def _connection(self, path):
+        if getattr(self._local, "path", None) != path:
+            connection = sqlite3.connect(path, timeout=5, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=OFF")
+            connection.execute("CREATE TABLE IF NOT EXISTS login_bucket ("
+                "key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL)")
+            self._local.connection, self._local.path = connection, path
+        return self._local.connection
+
+    # Takes an attempt from each of `buckets`, or raises a 429 APIError if any
+    # of them is empty, in which case none of them is touched.
+    #
+    # buckets: a list of (key, attempts per minute); a rate of 0 is unlimited
+    def take(self, buckets):
+        buckets = [(key, rate) for key, rate in buckets if rate > 0]
+        if not buckets:
+            return
+
+        connection = self._connection(current_app.config["LOGIN_RATE_LIMIT_PATH"])
+        now = time.time()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            stored = {key: (tokens, updated_at) for key, tokens, updated_at in connection.execute(
+                "SELECT key, tokens, updated_at FROM login_bucket WHERE key IN ({})".format(
+                    ", ".join("?" * len(buckets))), [key for key, rate in buckets])}
+
+            remaining, wait = [], 0
+            for key, rate in buckets:
+                tokens, updated_at = stored.get(key, (rate, now))
+                tokens = min(rate, tokens + (now - updated_at) * rate / 60)
+                if tokens < 1:
+                    wait = max(wait, (1 - tokens) * 60 / rate)
+                remaining.append((key, tokens - 1, now))
+
+            if wait:
+                connection.execute("ROLLBACK")
+                raise APIError.too_many_requests(math.ceil(wait))
+
+            connection.executemany("INSERT OR REPLACE INTO login_bucket VALUES (?, ?, ?)", remaining)
+            # A bucket left alone for a minute is full again, the same as one
+            # that was never stored
+            if now - self._purged_at >= PURGE_INTERVAL:
+                self._purged_at = now
+                connection.execute("DELETE FROM login_bucket WHERE updated_at < ?", (now - 60,))
+            connection.execute("COMMIT")
+        except sqlite3.Error:
+            if connection.in_transaction:
+                connection.execute("ROLLBACK")
+            raise
+
+login_attempts = LoginRateLimiter()
+
+# Returns the address of the client making the current request. Behind
+# PROXY_COUNT proxies (Heroku's router is one), each of which appends the
+# address it was connected from to X-Forwarded-For, that is the last
+# PROXY_COUNT-th entry; the entries before it are up to the client.
+def client_address():
+    proxies = current_app.config["PROXY_COUNT"]
+    forwarded = request.access_route
+    if proxies and "X-Forwarded-For" in request.headers:
+        return forwarded[-min(proxies, len(forwarded))]
+    return request.remote_addr
+
+# Counts a login attempt for the current request's client and for the account
+# `user_id` (a loyalty or employee ID, as sent), raising a 429 APIError if
+# either has made too many lately.
+#
+# user_type: "customer" or "employee", since their IDs overlap
+def limit_login_attempts(user_type, user_id):
+    # "067417" and " 67417" log in to the same account as "67417"
+    account = str(user_id).strip()
+    if account.isdigit():
+        account = str(int(account))
+
+    login_attempts.take([
+        ("ip:" + str(client_address()), current_app.config["LOGIN_ATTEMPTS_PER_IP"]),
+        (f"{user_type}:{account}", current_app.config["LOGIN_ATTEMPTS_PER_ACCOUNT"]),
+    ])
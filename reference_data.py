@@ -0,0 +1,118 @@
+import threading
+import time
+import zlib
+
+from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app_init import db
+from models import ItemType, UnitType, Store
+
+# ItemType, UnitType and Store are tiny tables that almost never change, but
+# they are consulted for every line of every transaction we read or write. This
+# module keeps a copy of them in process memory so that resolving names and ids
+# costs no database round trips on the hot path.
+#
+# The copy is thrown away (and lazily reloaded on next use) when:
+#  - it is older than REFERENCE_DATA_TTL seconds (see environment.py), which is
+#    how other processes' writes eventually become visible,
+#  - transactions being read use an item or unit type it doesn't have yet (see
+#    `covering`), or
+#  - this process commits a write to one of the three tables, e.g. from
+#    `manage.py seed_db` or an admin change made through the ORM.
+#
+# Note that `seed_db` runs in Heroku's release phase, before any web worker of
+# the new release boots, so freshly started workers always load the seeded data.
+
+# An immutable, point-in-time view of the reference tables. Names are matched
+# case-insensitively, the same way the API always has.
+class ReferenceSnapshot:
+    def __init__(self, item_types, unit_types, stores):
+        self.item_type_names = dict(item_types)
+        self.item_type_ids = {name.lower(): id for id, name in item_types}
+        self.unit_type_names = dict(unit_types)
+        self.unit_type_ids = {name.lower(): id for id, name in unit_types}
+        self.store_names = dict(stores)
+        # Changes whenever any name does; part of the ETags of responses that
+        # include item or unit type names
+        self.version = "%08x" % zlib.crc32(repr((sorted(item_types), sorted(unit_types),
+            sorted(stores))).encode("utf-8"))
+
+    # Returns the item_type_id for the given name, or None if it doesn't exist
+    def item_type_id(self, item_type):
+        return self.item_type_ids.get(str(item_type).lower())
+
+    # Returns the unit_type_id for the given name, or None if it doesn't exist
+    def unit_type_id(self, unit_type):
+        return self.unit_type_ids.get(str(unit_type).lower())
+
+    def store_exists(self, store_id):
+        try:
+            return int(store_id) in self.store_names
+        except (TypeError, ValueError):
+            return False
+
+class ReferenceData:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._loaded_at = 0.0
+
+    # Returns the current ReferenceSnapshot, loading it from the database first
+    # if there is none or it has expired. Must be called within an app context.
+    def current(self):
+        ttl = current_app.config["REFERENCE_DATA_TTL"]
+        snapshot = self._snapshot
+        if snapshot is not None and time.monotonic() - self._loaded_at < ttl:
+            return snapshot
+
+        with self._lock:
+            # Another thread may have reloaded while we waited for the lock
+            if self._snapshot is not None and time.monotonic() - self._loaded_at < ttl:
+                return self._snapshot
+
+            self._snapshot = ReferenceSnapshot(
+                db.session.query(ItemType.item_type_id, ItemType.item_type).all(),
+                db.session.query(UnitType.unit_type_id, UnitType.unit_type).all(),
+                db.session.query(Store.store_id, Store.store_name).all())
+            self._loaded_at = time.monotonic()
+            return self._snapshot
+
+    # Returns `snapshot` if it has the item and unit type of every one of
+    # `lines` (TransactionLines), or else a reloaded one: the missing types
+    # were added by another process since this one loaded its copy.
+    def covering(self, snapshot, lines):
+        for line in lines:
+            if line.item_type_id not in snapshot.item_type_names \
+                    or line.unit_type_id not in snapshot.unit_type_names:
+                self.invalidate()
+                return self.current()
+        return snapshot
+
+    def invalidate(self):
+        with self._lock:
+            self._snapshot = None
+
+reference_data = ReferenceData()
+
+# Writes are noted on the session as they are flushed, but the cache is only
+# dropped once they are committed. Dropping it at flush time would let another
+# thread reload the old rows (and keep them for a full TTL) before the commit.
+def _note_reference_write(mapper, connection, target):
+    session = Session.object_session(target)
+    if session is not None:
+        session.info["reference_data_changed"] = True
+
+for model in (ItemType, UnitType, Store):
+    for event_name in ("after_insert", "after_update", "after_delete"):
+        event.listen(model, event_name, _note_reference_write)
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_after_commit(session):
+    if session.info.pop("reference_data_changed", False):
+        reference_data.invalidate()
+
+@event.listens_for(Session, "after_rollback")
+def _forget_reference_write(session):
+    session.info.pop("reference_data_changed", None)
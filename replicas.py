@@ -0,0 +1,120 @@
+import functools
+import random
+import threading
+import time
+
+from flask import current_app, g, has_app_context
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import event, exc, orm
+
+# Routes the reads of read-only endpoints to read replicas of the database
+# (DATABASE_REPLICA_URL in environment.py), so that they don't compete with
+# writes on the primary.
+#
+# Views decorated with @use_replica run their queries against a replica, with
+# some exceptions that keep the primary authoritative:
+#  - once the session has written anything in a request, everything else in
+#    that request goes to the primary, so that a request reads its own writes;
+#  - flushes (writes) always go to the primary;
+#  - anything outside a decorated view (other endpoints, manage.py commands,
+#    background threads) uses the primary.
+#
+# A replica is only found to be down when a query to it fails to connect or
+# loses its connection, rather than by checking it before every request. The
+# view is then run again against the primary, and the replica is skipped for
+# REPLICA_RETRY_INTERVAL seconds; while none are available, the primary is used
+# instead. (Responses streamed from a replica, such as exports, can't be run
+# again once they have started, and fail instead.)
+#
+# Replicas are Flask-SQLAlchemy binds named "replica0", "replica1", ..., so
+# they share the primary's engine options (see db_pool.py).
+
+# Returns the SQLALCHEMY_BINDS for the replica URLs
+def replica_binds(replica_urls):
+    return {f"replica{i}": url for i, url in enumerate(replica_urls)}
+
+class RoutingSession(SignallingSession):
+    def get_bind(self, mapper=None, clause=None):
+        replica = g.get("replica_engine") if has_app_context() else None
+        if replica is not None and not self._flushing and not self.info.get("wrote"):
+            return replica
+        return super().get_bind(mapper, clause)
+
+@event.listens_for(RoutingSession, "after_flush")
+def _note_write(session, flush_context):
+    session.info["wrote"] = True
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+# Keeps track of which of the app's replicas are up
+class ReplicaSet:
+    def __init__(self, db, bind_keys, retry_interval):
+        self.db = db
+        self.bind_keys = bind_keys
+        self.retry_interval = retry_interval
+        self._down_until = {}
+        self._keys = {} # engine => bind key, for the engines being watched
+        self._lock = threading.Lock()
+
+    # Returns the engine of a replica not known to be down, picked at random to
+    # spread the load, or None if there is none. Doesn't connect to it.
+    def choose(self, app):
+        now = time.monotonic()
+        with self._lock:
+            candidates = [key for key in self.bind_keys if self._down_until.get(key, 0) <= now]
+        if not candidates:
+            return None
+
+        key = random.choice(candidates)
+        engine = self.db.get_engine(app, bind=key)
+        with self._lock:
+            if engine not in self._keys:
+                self._keys[engine] = key
+                event.listen(engine, "handle_error", self._handle_error)
+        return engine
+
+    # Marks a replica down when connecting to it fails or its connection is
+    # lost, and tells the view's wrapper (use_replica) to run it again
+    def _handle_error(self, context):
+        if context.connection is not None and not context.is_disconnect:
+            return
+        key = self._keys[context.engine]
+        with self._lock:
+            self._down_until[key] = time.monotonic() + self.retry_interval
+        if has_app_context():
+            g.replica_failed = True
+            current_app.logger.warning("Read replica %s is unavailable; retrying in %s s",
+                key, self.retry_interval)
+
+# Sets up replica routing for `app`. Called by app_init.create_app().
+def init_app(app, db):
+    bind_keys = sorted(replica_binds(app.config["DATABASE_REPLICA_URLS"]))
+    app.extensions["replicas"] = ReplicaSet(db, bind_keys, app.config["REPLICA_RETRY_INTERVAL"])
+
+# Decorates a view whose reads may be served by a replica
+def use_replica(view):
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        replicas = current_app.extensions["replicas"]
+        g.replica_engine = replicas.choose(current_app)
+        if g.replica_engine is None:
+            return view(*args, **kwargs)
+
+        try:
+            return view(*args, **kwargs)
+        except exc.DBAPIError:
+            if not g.pop("replica_failed", False):
+                raise
+            # The replica went away: read everything from the primary instead
+            replicas.db.session.rollback()
+            g.replica_engine = None
+            return view(*args, **kwargs)
+    return wrapper
+
+# Returns the engine reads should use outside of the session: within a view
+# decorated with @use_replica, a replica if one is available, otherwise the
+# primary.
+def read_engine(db):
+    return g.get("replica_engine") or db.engine
@@ -0,0 +1,124 @@
+import json
+
+from flask import Response
+
+from models import Customer
+from utility import format_phone_number
+
+# Turns rows into the JSON bodies sent by the endpoints (see "specification.md"
+# for the formats). Serializers read attributes by name, so they accept ORM
+# objects and row tuples from column queries alike; the list endpoints use the
+# latter, so that no ORM objects are built just to be serialized.
+#
+# Bodies are encoded with orjson when it is installed (it is several times
+# faster than the standard library) and with the standard library otherwise.
+
+## JSON backends ###############################################################
+
+def _stdlib_dumps(value):
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+JSON_BACKENDS = {"stdlib": _stdlib_dumps}
+
+try:
+    import orjson
+    JSON_BACKENDS["orjson"] = orjson.dumps
+except ImportError:
+    pass
+
+_dumps = JSON_BACKENDS.get("orjson", _stdlib_dumps)
+
+# Selects the JSON backend by name (one of JSON_BACKENDS), e.g. to compare them
+def use_json_backend(name):
+    global _dumps
+    _dumps = JSON_BACKENDS[name]
+
+# Encodes `value` (made of dicts, lists, strings, numbers, booleans and None)
+# as compact UTF-8 JSON bytes
+def dumps(value):
+    return _dumps(value)
+
+## Responses ###################################################################
+
+# How many list items go into each chunk of a streamed response
+STREAM_CHUNK_SIZE = 100
+
+# Returns a JSON response with `value` as its body
+def json_response(value, status=200, headers=None):
+    return Response(dumps(value), status=status, headers=headers, mimetype="application/json")
+
+# Returns a JSON array response with one element per row, which is encoded and
+# sent a chunk of STREAM_CHUNK_SIZE rows at a time rather than built up in
+# memory as one body.
+#
+# rows: any iterable; it is consumed while the response is being sent, so if
+#       it reads from the database, wrap the response in
+#       flask.stream_with_context
+# serialize: a function turning one row into a JSON-serializable value
+def json_array_response(rows, serialize, status=200, headers=None):
+    return Response(_json_array_chunks(rows, serialize), status=status, headers=headers,
+        mimetype="application/json")
+
+def _json_array_chunks(rows, serialize):
+    yield b"["
+    chunk = []
+    separator = b""
+    for row in rows:
+        chunk.append(dumps(serialize(row)))
+        if len(chunk) == STREAM_CHUNK_SIZE:
+            yield separator + b",".join(chunk)
+            separator = b","
+            chunk = []
+    if chunk:
+        yield separator + b",".join(chunk)
+    yield b"]"
+
+## Customers ###################################################################
+
+# The columns customer_dict reads, for queries that skip the ORM objects:
+#     db.session.query(*CUSTOMER_COLUMNS).filter(...)
+CUSTOMER_COLUMNS = (
+    Customer.loyalty_id, Customer.first_name, Customer.last_name,
+    Customer.address1, Customer.address2, Customer.city, Customer.state, Customer.zip_code,
+    Customer.email, Customer.phone, Customer.phone_display, Customer.phone_uri,
+)
+
+# customer: a Customer, or a row with (at least) the CUSTOMER_COLUMNS
+def customer_dict(customer):
+    phone_display, phone_uri = customer.phone_display, customer.phone_uri
+    if phone_display is None and customer.phone is not None:
+        # Not backfilled yet, see `manage.py backfill_phone_formats`
+        phone_display, phone_uri = format_phone_number(customer.phone)
+
+    return {
+        "loyaltyID": customer.loyalty_id,
+        "firstName": customer.first_name,
+        "lastName": customer.last_name,
+        "address": {
+            "line1": customer.address1,
+            "line2": customer.address2,
+            "city": customer.city,
+            "state": customer.state,
+            "zip": customer.zip_code
+        },
+        "email": customer.email,
+        "phone": phone_display,
+        "phoneURI": phone_uri
+    }
+
+## Transactions ################################################################
+
+# transaction: a Transaction with its lines loaded
+# reference: a ReferenceSnapshot, used for the item and unit type names
+def transaction_dict(transaction, reference):
+    return {
+        "transactionID": transaction.transaction_id,
+        "date": transaction.date.date().isoformat(),
+        "taxYear": str(transaction.tax_year),
+        "items": [{
+            "itemType": reference.item_type_names[line.item_type_id],
+            "unit": reference.unit_type_names[line.unit_type_id],
+            "quantity": line.quantity,
+            "description": line.description
+        } for line in transaction.lines]
+    }
@@ -0,0 +1,27 @@
+import os
+import signal
+
+from bcrypt_pool import BcryptPool, generate_password_hash
+
+# Checks the pool of password checking processes of bcrypt_pool.py.
+
+def setup_module(mod):
+    mod.pool = BcryptPool(processes=1)
+    mod.pw_hash = generate_password_hash("hunter2", 4)
+
+def teardown_module(mod):
+    if pool._executor is not None:
+        pool._executor.shutdown()
+
+def test_check():
+    assert pool.check_password_hash(pw_hash, "hunter2")
+    assert not pool.check_password_hash(pw_hash, "hunter3")
+
+def test_pool_process_dies():
+    assert pool.check_password_hash(pw_hash, "hunter2")
+    for pid in list(pool._executor._processes):
+        os.kill(pid, signal.SIGKILL)
+
+    # The broken pool is replaced, rather than failing every check from now on
+    assert pool.check_password_hash(pw_hash, "hunter2")
+    assert pool.check_password_hash(pw_hash, "hunter2")
@@ -0,0 +1,57 @@
+import os
+import shutil
+import tempfile
+
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+from application import create_api_app
+from app_init import db
+from bulk_seed import seed_bulk
+from models import Customer, Store, ItemType, UnitType, Transaction, TransactionLine
+
+# Checks the data generated by bulk_seed.py (`manage.py seed_bulk`), on a
+# throwaway SQLite file.
+
+def setup_module(mod):
+    mod.directory = tempfile.mkdtemp()
+    mod.app = create_api_app({
+        "SQLALCHEMY_DATABASE_URI": "sqlite:///" + os.path.join(mod.directory, "seed.db"),
+        "BCRYPT_LOG_ROUNDS": 4,
+        "BCRYPT_POOL_SIZE": 0,
+        "LOGIN_RATE_LIMIT_PATH": os.path.join(mod.directory, "login-attempts.db"),
+    })
+    with mod.app.app_context():
+        db.create_all()
+        db.session.add(Store("Goodwill Omaha Headquarters"))
+        db.session.add(ItemType("Clothing"))
+        db.session.add(UnitType("Bag"))
+        db.session.commit()
+
+def teardown_module(mod):
+    shutil.rmtree(mod.directory)
+
+def test_constant_distribution(capsys):
+    reports = []
+    with app.app_context():
+        added = seed_bulk(50, 4, 3, 2018, 2019, "constant", "hunter2", seed=1, progress=reports.append)
+        assert added == {"customers": 50, "transactions": 200, "lines": 600}
+        assert Transaction.query.filter(Transaction.tax_year.in_([2018, 2019])).count() == 200
+        assert TransactionLine.query.count() == 600
+
+    # Progress goes to the caller, not to stdout
+    assert reports == [added]
+    assert capsys.readouterr().out == ""
+
+def test_seeded_customers_work():
+    with app.app_context():
+        seed_bulk(20, 8, 2, 2019, 2019, seed=2)
+        loyalty_id = Customer.query.order_by(Customer.loyalty_id.desc()).first().loyalty_id
+
+    # Every customer logs in with the shared password, and the ORM's own
+    # inserts continue after the generated ids
+    client = app.test_client()
+    login = client.post("/customer/login", json={"loyaltyID": str(loyalty_id), "password": "hunter2"})
+    assert login.status_code == 200
+    with app.app_context():
+        db.session.add(Customer(loyalty_id + 1, "hunter3", "Another", "Customer"))
+        db.session.commit()
@@ -0,0 +1,90 @@
+import json
+import pytest
+
+from sqlalchemy.dialects import postgresql
+
+from app_init import create_app, db
+from application import customer_lookup_query
+from models import Customer
+from utility import DEFAULT_PAGE_SIZE
+
+# Checks that the employee customer lookups, first and later pages alike, are
+# answered from the indexes on the user table in the order they are paged in,
+# instead of with a sequential scan or a sort, with the table filled to a
+# realistic size.
+#
+# Assumes a Postgres DB migrated with `python ./manage.py db upgrade`. One
+# million customers are inserted inside a transaction that is rolled back at
+# the end, so the DB is left as it was.
+
+CUSTOMER_COUNT = 1000000
+
+def setup_module(mod):
+    mod.app_context = create_app().app_context()
+    mod.app_context.push()
+    if db.engine.dialect.name != "postgresql":
+        mod.app_context.pop()
+        pytest.skip("EXPLAIN tests need a Postgres database", allow_module_level=True)
+
+    mod.connection = db.engine.connect()
+    mod.transaction = mod.connection.begin()
+
+    # Generated in SQL rather than through the models, which would hash a
+    # password per customer
+    mod.connection.execute(db.text("""
+        INSERT INTO "user" (user_id, user_type, password, first_name, last_name, email, phone)
+        SELECT base.max_id + g, 'CUST', 'not a bcrypt hash',
+            'First' || (g % 50000), 'Last' || (g % 20000),
+            'customer' || g || '@example.com', '+1402' || lpad(g::text, 7, '0')
+        FROM generate_series(1, :count) AS g,
+            (SELECT coalesce(max(user_id), 0) AS max_id FROM "user") AS base
+    """), count=CUSTOMER_COUNT)
+    mod.connection.execute(db.text("""
+        INSERT INTO customer (user_id, loyalty_id)
+        SELECT user_id, user_id + 100000000 FROM "user" WHERE password = 'not a bcrypt hash'
+    """))
+    mod.connection.execute(db.text('ANALYZE "user"'))
+    mod.connection.execute(db.text('ANALYZE customer'))
+
+def teardown_module(mod):
+    mod.transaction.rollback()
+    mod.connection.close()
+    mod.app_context.pop()
+
+# Returns every node of the plan for `query`
+def plan_nodes(query):
+    sql = str(query.statement.compile(dialect=postgresql.dialect(),
+        compile_kwargs={"literal_binds": True}))
+    plan = connection.execute(db.text("EXPLAIN (FORMAT JSON) " + sql)).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+
+    found = []
+    nodes = [plan[0]["Plan"]]
+    while nodes:
+        node = nodes.pop()
+        found.append(node)
+        nodes.extend(node.get("Plans", []))
+    return found
+
+# Checks the plan of the endpoint's query for the first page, and for a page
+# further on
+def assert_lookup_uses_index(field_name, field_value, index_name):
+    criterion = Customer.lookup_criterion(field_name, field_value)
+    for after_user_id in (None, 1000):
+        nodes = plan_nodes(customer_lookup_query(criterion, after_user_id, DEFAULT_PAGE_SIZE))
+        node_types = [node["Node Type"] for node in nodes]
+        assert index_name in [node.get("Index Name") for node in nodes], node_types
+        assert "Seq Scan" not in node_types and "Sort" not in node_types, node_types
+
+def test_lookup_by_first_name():
+    assert_lookup_uses_index("firstName", "FIRST123", "ix_user_lower_first_name")
+
+def test_lookup_by_last_name():
+    assert_lookup_uses_index("lastName", "last123", "ix_user_lower_last_name")
+
+def test_lookup_by_email():
+    assert_lookup_uses_index("email", "Customer123@Example.com", "ix_user_lower_email")
+
+def test_lookup_by_phone():
+    assert_lookup_uses_index("phone", "(402) 000-0123", "ix_user_phone")
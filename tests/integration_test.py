@@ -1,8 +1,11 @@
 import itertools
+import os
 import pytest
 import re
 import requests
+import shutil
 import subprocess
+import tempfile
 import time
 
 PORT = 8001
@@ -13,7 +16,12 @@ API_ROOT = "http://localhost:" + str(PORT)
 # on a fresh postgres DB to get this data.
 
 def setup_module(mod):
-    mod.gunicorn = subprocess.Popen(["gunicorn", "--bind", "127.0.0.1:" + str(PORT), "application:app"])
+    # Login attempts are counted afresh, so that earlier runs don't use up the
+    # test accounts' limits
+    mod.directory = tempfile.mkdtemp()
+    environ = dict(os.environ, LOGIN_RATE_LIMIT_PATH=os.path.join(mod.directory, "login-attempts.db"))
+    mod.gunicorn = subprocess.Popen(["gunicorn", "--bind", "127.0.0.1:" + str(PORT), "application:app"],
+        env=environ)
     for i in itertools.count():
         try:
             time.sleep(0.5) # Give gunicorn time to start
@@ -27,6 +35,7 @@ def setup_module(mod):
 def teardown_module(mod):
     mod.gunicorn.terminate()
     mod.gunicorn.wait()
+    shutil.rmtree(mod.directory)
 
 @pytest.fixture
 def customer_authorization():
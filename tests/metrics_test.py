@@ -0,0 +1,51 @@
+import os
+import re
+import shutil
+import tempfile
+
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+from application import create_api_app
+from app_init import db
+from models import Customer
+
+# Checks what GET /metrics (see metrics.py) reports, on a throwaway SQLite file.
+
+def setup_module(mod):
+    mod.directory = tempfile.mkdtemp()
+    mod.app = create_api_app({
+        "SQLALCHEMY_DATABASE_URI": "sqlite:///" + os.path.join(mod.directory, "metrics.db"),
+        "BCRYPT_LOG_ROUNDS": 4,
+        "BCRYPT_POOL_SIZE": 0,
+        "METRICS_ENABLED": True,
+        "LOGIN_RATE_LIMIT_PATH": os.path.join(mod.directory, "login-attempts.db"),
+    })
+    with mod.app.app_context():
+        db.create_all()
+        db.session.add(Customer(67417, "hunter2", "Test", "Customer"))
+        db.session.commit()
+    mod.client = mod.app.test_client()
+
+def teardown_module(mod):
+    shutil.rmtree(mod.directory)
+
+# Returns the value of the sample `name` (including its labels) in /metrics
+def sample(name):
+    text = client.get("/metrics").get_data(as_text=True)
+    match = re.search("^" + re.escape(name) + r" (\S+)$", text, re.MULTILINE)
+    assert match, f"{name} not in /metrics"
+    return float(match.group(1))
+
+def test_verified_token_cache():
+    hits = sample('cache_hits_total{cache="verified_tokens"}')
+    misses = sample('cache_misses_total{cache="verified_tokens"}')
+
+    login = client.post("/customer/login", json={"loyaltyID": "67417", "password": "hunter2"})
+    headers = {"Authorization": "Bearer " + login.get_json()["accessToken"]}
+    for i in range(3):
+        assert client.get("/customer/info", headers=headers).status_code == 200
+
+    # The first use of the token verifies it, the others find it cached
+    assert sample('cache_misses_total{cache="verified_tokens"}') == misses + 1
+    assert sample('cache_hits_total{cache="verified_tokens"}') == hits + 2
+    assert sample('cache_entries{cache="verified_tokens"}') >= 1
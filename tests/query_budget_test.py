@@ -0,0 +1,265 @@
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+from collections import Counter
+from datetime import datetime
+
+import pytest
+
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from application import create_api_app
+from app_init import db
+from utility import MAX_PAGE_SIZE
+from models import User, Customer, Employee, Store, ItemType, UnitType, Transaction, TransactionLine
+
+# Checks how many SQL statements each endpoint runs, through the Flask test
+# client against a throwaway SQLite file.
+#
+# Every endpoint has a budget in QUERY_BUDGETS, which must hold whether the
+# request involves one row or LARGE rows: one transaction line or a thousand,
+# one matching customer or a thousand. A request also fails if it runs the same
+# statement (up to its parameters and the number of rows in a multi-row INSERT
+# or IN list) REPEAT_LIMIT times or more, which is what a query in a loop looks
+# like.
+#
+# Caches are turned off, so budgets are for a worker whose caches are cold.
+# When an endpoint legitimately needs another query, raise its budget here in
+# the same change.
+
+QUERY_BUDGETS = {
+    "POST /customer/login": 2,
+    "POST /employee/login": 2,
+    "POST /token/refresh": 2,
+    "GET /customer/info": 1,
+    "GET /customer/history": 2,
+    "GET /customer/history/year/<year>": 7,
+    "GET /customer/<loyalty_id>/info": 2,
+    "GET /customer/by/<field_name>/<field_value>": 2,
+    "POST /customer/transaction": 8,
+    "POST /customer/transaction/bulk": 8,
+    "GET /transaction/export": 2,
+}
+
+REPEAT_LIMIT = 3
+LARGE = 1000
+
+TEST_CONFIG = {
+    "BCRYPT_LOG_ROUNDS": 4,
+    "BCRYPT_POOL_SIZE": 0,
+    "REFERENCE_DATA_TTL": 0,
+    "TOKEN_CACHE_TTL": 0,
+    "METRICS_ENABLED": False,
+}
+
+# One customer per size of history: a single one-line transaction in 2018,
+# LARGE one-line transactions in 2019, and a single LARGE-line transaction in
+# 2019
+SMALL_ID, MANY_ID, WIDE_ID = 67417, 67418, 67419
+
+ITEM = {"itemType": "Clothing", "unit": "Bag", "quantity": 1, "description": "Shirts"}
+
+# The statements run by the current thread, while a request is recorded
+_recording = threading.local()
+
+def _record_statement(conn, cursor, statement, parameters, context, executemany):
+    statements = getattr(_recording, "statements", None)
+    if statements is not None:
+        statements.append(statement)
+
+def setup_module(mod):
+    mod.directory = tempfile.mkdtemp()
+    mod.app = create_api_app(dict(TEST_CONFIG,
+        SQLALCHEMY_DATABASE_URI="sqlite:///" + os.path.join(mod.directory, "budget.db"),
+        LOGIN_RATE_LIMIT_PATH=os.path.join(mod.directory, "login-attempts.db")))
+
+    with mod.app.app_context():
+        db.create_all()
+        db.session.add(Customer(SMALL_ID, "hunter2", "Small", "Customer"))
+        db.session.add(Customer(MANY_ID, "hunter2", "Many", "Customer"))
+        db.session.add(Customer(WIDE_ID, "hunter2", "Wide", "Customer"))
+        db.session.add(Employee(67416, "hunter3", "Test", "User"))
+        db.session.add(Store("Goodwill Omaha Headquarters"))
+        db.session.add(ItemType("Clothing"))
+        db.session.add(UnitType("Bag"))
+        db.session.flush()
+
+        # Generated in SQL rather than through the models, which would hash a
+        # password per customer
+        db.session.execute(User.__table__.insert(), [{
+            "user_id": 1000 + i, "user_type": "CUST", "password": "not a bcrypt hash",
+            "first_name": "First", "last_name": "Crowd",
+        } for i in range(LARGE)])
+        db.session.execute(Customer.__table__.insert(), [
+            {"user_id": 1000 + i, "loyalty_id": 100000 + i} for i in range(LARGE)])
+
+        transactions = [(SMALL_ID, datetime(2018, 6, 1), 2018), (WIDE_ID, datetime(2019, 6, 1), 2019)] \
+            + [(MANY_ID, datetime(2019, 1, 1 + i % 28), 2019) for i in range(LARGE)]
+        db.session.execute(Transaction.__table__.insert(), [{
+            "transaction_id": transaction_id, "loyalty_id": loyalty_id, "store_id": 1,
+            "date": date, "tax_year": tax_year,
+        } for transaction_id, (loyalty_id, date, tax_year) in enumerate(transactions, 1)])
+        db.session.execute(TransactionLine.__table__.insert(), [{
+            "transaction_id": transaction_id, "item_type_id": 1, "unit_type_id": 1,
+            "quantity": 1, "description": "Shirts",
+        } for transaction_id in [1] + [2] * LARGE + list(range(3, LARGE + 3))])
+        db.session.commit()
+
+    mod.client = mod.app.test_client()
+    mod.employee = login("employee", "employeeID", 67416, "hunter3")
+    mod.customers = {loyalty_id: login("customer", "loyaltyID", loyalty_id, "hunter2")
+        for loyalty_id in (SMALL_ID, MANY_ID, WIDE_ID)}
+
+    # Loads the revocation list (see models.RevocationList), which happens
+    # once per worker rather than per request
+    client.get("/customer/info", headers=customers[SMALL_ID])
+
+    event.listen(Engine, "before_cursor_execute", _record_statement)
+
+def teardown_module(mod):
+    event.remove(Engine, "before_cursor_execute", _record_statement)
+    shutil.rmtree(mod.directory)
+
+def login(user_type, id_field, user_id, password):
+    req = client.post(f"/{user_type}/login", json={id_field: str(user_id), "password": password})
+    return {"Authorization": "Bearer " + req.get_json()["accessToken"]}
+
+# Makes a request with the test client, reads all of the response (streamed
+# ones run their queries as they are read), and checks its statements against
+# the route's budget
+#
+# route: the key of QUERY_BUDGETS to check against
+# returns: the response
+def request_within_budget(route, method, url, **kwargs):
+    _recording.statements = []
+    try:
+        response = client.open(url, method=method, **kwargs)
+        response.get_data()
+        statements = _recording.statements
+    finally:
+        _recording.statements = None
+
+    assert response.status_code == 200, response.get_data(as_text=True)
+    check_statements(route, statements)
+    return response
+
+def check_statements(route, statements):
+    budget = QUERY_BUDGETS[route]
+    listing = "\n".join(" ".join(statement.split()) for statement in statements)
+    assert len(statements) <= budget, \
+        f"{route} ran {len(statements)} statements, over its budget of {budget}:\n{listing}"
+
+    if statements:
+        template, count = Counter(map(statement_template, statements)).most_common(1)[0]
+        assert count < REPEAT_LIMIT, f"{route} ran this statement {count} times:\n{template}"
+
+# Returns `statement` with its bound parameters and lists of them (rows of a
+# multi-row INSERT, IN lists) collapsed, so that the same query run with
+# different values or numbers of rows gives the same template
+def statement_template(statement):
+    parameter = r"(?:\?|%\(\w+\)s|%s)"
+    statement = " ".join(statement.split())
+    statement = re.sub(rf"\({parameter}(?:, {parameter})*\)", "(...)", statement)
+    return re.sub(r"\(\.\.\.\)(?:, \(\.\.\.\))+", "(...)", statement)
+
+def test_logins():
+    request_within_budget("POST /customer/login", "POST", "/customer/login",
+        json={"loyaltyID": str(SMALL_ID), "password": "hunter2"})
+    req = request_within_budget("POST /employee/login", "POST", "/employee/login",
+        json={"employeeID": "67416", "password": "hunter3"})
+    request_within_budget("POST /token/refresh", "POST", "/token/refresh",
+        json={"refreshToken": req.get_json()["refreshToken"]})
+
+@pytest.mark.parametrize("loyalty_id, year", [(SMALL_ID, 2018), (MANY_ID, 2019), (WIDE_ID, 2019)])
+def test_customer_endpoints(loyalty_id, year):
+    headers = customers[loyalty_id]
+    request_within_budget("GET /customer/info", "GET", "/customer/info", headers=headers)
+    request_within_budget("GET /customer/history", "GET", "/customer/history", headers=headers)
+    request_within_budget("GET /customer/history/year/<year>", "GET",
+        f"/customer/history/year/{year}", headers=headers)
+
+def test_current_year_has_no_snapshot_lookup():
+    _recording.statements = []
+    try:
+        req = client.get(f"/customer/history/year/{datetime.today().year}", headers=customers[SMALL_ID])
+        statements = _recording.statements
+    finally:
+        _recording.statements = None
+    assert req.status_code == 200
+    assert not [statement for statement in statements if "history_snapshot" in statement]
+
+@pytest.mark.parametrize("loyalty_id", [SMALL_ID, MANY_ID, WIDE_ID])
+def test_customer_info_for_employee(loyalty_id):
+    request_within_budget("GET /customer/<loyalty_id>/info", "GET", f"/customer/{loyalty_id}/info",
+        headers=employee)
+
+@pytest.mark.parametrize("last_name, matches", [("customer", 3), ("crowd", LARGE)])
+def test_customer_lookup(last_name, matches):
+    req = request_within_budget("GET /customer/by/<field_name>/<field_value>", "GET",
+        f"/customer/by/lastName/{last_name}?limit={MAX_PAGE_SIZE}", headers=employee)
+    assert len(req.get_json()) == min(matches, MAX_PAGE_SIZE)
+
+@pytest.mark.parametrize("lines", [1, LARGE])
+def test_transaction(lines):
+    request_within_budget("POST /customer/transaction", "POST", "/customer/transaction", headers=employee,
+        json={"loyaltyID": SMALL_ID, "storeID": 1, "date": "2020-03-04", "items": [ITEM] * lines})
+
+def test_transaction_of_unknown_customer():
+    req = client.post("/customer/transaction", headers=employee,
+        json={"loyaltyID": 99999, "storeID": 1, "date": "2020-03-04", "items": [ITEM]})
+    assert req.status_code == 404
+    assert req.get_json()["errorCode"] == "NOT_FOUND"
+    with app.app_context():
+        assert Transaction.query.filter_by(loyalty_id=99999).count() == 0
+
+@pytest.mark.parametrize("count", [1, LARGE])
+def test_transaction_bulk(count):
+    records = [{"loyaltyID": loyalty_id, "storeID": 1, "date": "2020-03-05", "items": [ITEM]}
+        for loyalty_id in [SMALL_ID, MANY_ID, WIDE_ID] * count][:count]
+    req = request_within_budget("POST /customer/transaction/bulk", "POST", "/customer/transaction/bulk",
+        headers=dict(employee, **{"Content-Type": "application/x-ndjson"}),
+        data="".join(json.dumps(record) + "\n" for record in records))
+
+    # The ids reported are those the transactions were stored under
+    results = req.get_json()["results"]
+    with app.app_context():
+        for record, result in zip(records, results):
+            assert Transaction.query.get(result["transactionID"]).loyalty_id == record["loyaltyID"]
+
+def test_transaction_bulk_in_batches(monkeypatch):
+    monkeypatch.setattr("application.BULK_BATCH_SIZE", 2)
+    good = {"loyaltyID": SMALL_ID, "storeID": 1, "date": "2020-03-06", "items": [ITEM]}
+    lines = [json.dumps(good), "not json", json.dumps(dict(good, loyaltyID=99999)),
+        json.dumps(good), json.dumps(dict(good, storeID=99)), json.dumps(good)]
+    req = client.post("/customer/transaction/bulk",
+        headers=dict(employee, **{"Content-Type": "application/x-ndjson"}), data="\n".join(lines))
+
+    # Results are in input order across batches
+    body = req.get_json()
+    assert (body["inserted"], body["failed"]) == (3, 3)
+    assert [result["index"] for result in body["results"]] == list(range(6))
+    assert [result.get("errorCode") for result in body["results"]] == \
+        [None, "BAD_JSON", "NOT_FOUND", None, "BAD_STORE", None]
+    with app.app_context():
+        for result in body["results"][0::3] + body["results"][5:]:
+            assert Transaction.query.get(result["transactionID"]).date == datetime(2020, 3, 6)
+
+@pytest.mark.parametrize("year", [2018, 2019])
+def test_export(year):
+    request_within_budget("GET /transaction/export", "GET", f"/transaction/export?taxYear={year}",
+        headers=employee)
+
+def test_statements_in_a_loop_fail():
+    statements = ["SELECT item_type.item_type FROM item_type WHERE item_type.item_type_id = ?"] * REPEAT_LIMIT
+    with pytest.raises(AssertionError, match="ran this statement"):
+        check_statements("GET /customer/history/year/<year>", statements)
+
+    # Multi-row INSERTs of any size are the same statement
+    assert statement_template("INSERT INTO t (a, b) VALUES (?, ?)") == \
+        statement_template("INSERT INTO t (a, b) VALUES (?, ?), (?, ?), (?, ?)")
@@ -0,0 +1,84 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+
+import pytest
+
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+from application import create_api_app
+from app_init import db
+from models import Customer, Employee, User
+
+# Checks the login rate limits of rate_limit.py through the Flask test client,
+# on a throwaway SQLite file, with small limits.
+
+PER_ACCOUNT = 3
+PER_IP = 5
+
+def setup_module(mod):
+    mod.directory = tempfile.mkdtemp()
+    mod.app = create_api_app({
+        "SQLALCHEMY_DATABASE_URI": "sqlite:///" + os.path.join(mod.directory, "limits.db"),
+        "BCRYPT_LOG_ROUNDS": 4,
+        "BCRYPT_POOL_SIZE": 0,
+        "METRICS_ENABLED": False,
+        "LOGIN_ATTEMPTS_PER_ACCOUNT": PER_ACCOUNT,
+        "LOGIN_ATTEMPTS_PER_IP": PER_IP,
+        "LOGIN_RATE_LIMIT_PATH": os.path.join(mod.directory, "login-attempts.db"),
+        "PROXY_COUNT": 1,
+    })
+    with mod.app.app_context():
+        db.create_all()
+        db.session.add(Customer(67417, "hunter2", "Test", "Customer"))
+        db.session.add(Customer(67418, "hunter2", "Other", "Customer"))
+        db.session.add(Employee(67417, "hunter3", "Test", "User"))
+        db.session.commit()
+    mod.client = mod.app.test_client()
+
+def teardown_module(mod):
+    shutil.rmtree(mod.directory)
+
+def login(user_type, id_field, user_id, password, address):
+    return client.post(f"/{user_type}/login", json={id_field: user_id, "password": password},
+        headers={"X-Forwarded-For": address})
+
+def test_account_limit(monkeypatch):
+    for i in range(PER_ACCOUNT):
+        assert login("customer", "loyaltyID", "67417", "wrong", "10.0.0.1").status_code == 403
+
+    # Refused whatever the address, the password or how the ID is written, and
+    # without checking the password
+    with monkeypatch.context() as patch:
+        patch.setattr(User, "is_authentic", lambda *args: pytest.fail("password checked"))
+        req = login("customer", "loyaltyID", "067417", "hunter2", "10.0.0.2")
+    assert req.status_code == 429
+    assert req.get_json()["errorCode"] == "TOO_MANY_REQUESTS"
+    assert 1 <= int(req.headers["Retry-After"]) <= 60 / PER_ACCOUNT
+
+    # Other accounts, including the employee with the same ID, are unaffected
+    assert login("customer", "loyaltyID", "67418", "hunter2", "10.0.0.2").status_code == 200
+    assert login("employee", "employeeID", "67417", "hunter3", "10.0.0.2").status_code == 200
+
+def test_address_limit():
+    # Only the last X-Forwarded-For entry, added by the proxy, counts
+    statuses = [login("customer", "loyaltyID", str(70000 + i), "hunter2", f"{i}.0.0.0, 10.0.0.3").status_code
+        for i in range(PER_IP + 1)]
+    assert statuses == [403] * PER_IP + [429]
+    assert login("customer", "loyaltyID", "67418", "hunter2", "10.0.0.4").status_code == 200
+
+def test_refill():
+    for i in range(PER_ACCOUNT):
+        login("employee", "employeeID", "1234", "wrong", f"10.0.1.{i}")
+    req = login("employee", "employeeID", "1234", "wrong", "10.0.1.9")
+    assert req.status_code == 429
+
+    # One attempt becomes available again every 60 / PER_ACCOUNT seconds;
+    # rather than waiting, the bucket is made to look that much older
+    with sqlite3.connect(app.config["LOGIN_RATE_LIMIT_PATH"]) as connection:
+        connection.execute("UPDATE login_bucket SET updated_at = updated_at - ? WHERE key = ?",
+            (60 / PER_ACCOUNT, "employee:1234"))
+    connection.close()
+    assert login("employee", "employeeID", "1234", "wrong", "10.0.1.9").status_code == 403
+    assert login("employee", "employeeID", "1234", "wrong", "10.0.1.9").status_code == 429
@@ -0,0 +1,77 @@
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+from application import create_api_app
+from app_init import db
+from history_snapshots import build_snapshots
+from models import Customer, Store, ItemType, UnitType, HistorySnapshot
+
+# Checks that item and unit types added by another process, after this one
+# loaded its reference data (see reference_data.py), are found when
+# transactions using them are read, on a throwaway SQLite file.
+
+def setup_module(mod):
+    mod.directory = tempfile.mkdtemp()
+    mod.database = os.path.join(mod.directory, "reference.db")
+    mod.app = create_api_app({
+        "SQLALCHEMY_DATABASE_URI": "sqlite:///" + mod.database,
+        "BCRYPT_LOG_ROUNDS": 4,
+        "BCRYPT_POOL_SIZE": 0,
+        "METRICS_ENABLED": False,
+        "REFERENCE_DATA_TTL": 300,
+        "LOGIN_RATE_LIMIT_PATH": os.path.join(mod.directory, "login-attempts.db"),
+    })
+    with mod.app.app_context():
+        db.create_all()
+        db.session.add(Customer(67417, "hunter2", "Test", "Customer"))
+        db.session.add(Store("Goodwill Omaha Headquarters"))
+        db.session.add(ItemType("Clothing"))
+        db.session.add(UnitType("Bag"))
+        db.session.commit()
+
+    mod.client = mod.app.test_client()
+    login = client.post("/customer/login", json={"loyaltyID": "67417", "password": "hunter2"})
+    mod.customer = {"Authorization": "Bearer " + login.get_json()["accessToken"]}
+
+def teardown_module(mod):
+    shutil.rmtree(mod.directory)
+
+# Adds a transaction of `year` with a line of a new item type and a new unit
+# type, as another process would: through its own connection, unseen by this
+# one's reference data
+def add_transaction_of_new_types(year, item_type, unit_type):
+    connection = sqlite3.connect(database)
+    with connection:
+        item_type_id = connection.execute("INSERT INTO item_type (item_type) VALUES (?)",
+            (item_type,)).lastrowid
+        unit_type_id = connection.execute("INSERT INTO unit_type (unit_type) VALUES (?)",
+            (unit_type,)).lastrowid
+        transaction_id = connection.execute("INSERT INTO \"transaction\" (loyalty_id, store_id, date, "
+            "tax_year) VALUES (67417, 1, ?, ?)", (f"{year}-03-04 10:00:00.000000", year)).lastrowid
+        connection.execute("INSERT INTO transaction_line (transaction_id, item_type_id, unit_type_id, "
+            "quantity, description) VALUES (?, ?, ?, 1, 'Lamp')", (transaction_id, item_type_id, unit_type_id))
+    connection.close()
+
+def test_history_of_new_types():
+    # Loads the reference data
+    assert client.get("/customer/history/year/2019", headers=customer).status_code == 200
+
+    add_transaction_of_new_types(2019, "Furniture", "Each")
+    req = client.get("/customer/history/year/2019", headers=customer)
+    assert req.status_code == 200
+    items = req.get_json()["history"][0]["items"]
+    assert [(item["itemType"], item["unit"]) for item in items] == [("Furniture", "Each")]
+
+def test_snapshot_of_new_types():
+    with app.app_context():
+        build_snapshots(2018, [67417])
+        add_transaction_of_new_types(2018, "Electronics", "Box")
+        assert build_snapshots(2018, [67417]) == 1
+
+        payload = json.loads(HistorySnapshot.query.filter_by(loyalty_id=67417, tax_year=2018).one().payload)
+        assert [(item["itemType"], item["unit"]) for item in payload[0]["items"]] == [("Electronics", "Box")]
@@ -0,0 +1,98 @@
+import os
+import shutil
+import tempfile
+
+import pytest
+
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+from application import create_api_app
+from app_init import db
+from models import Customer, Employee, RefreshToken, User
+
+# Checks the refresh token flow (RefreshToken in models.py) through the Flask
+# test client, on a throwaway SQLite file.
+
+def setup_module(mod):
+    mod.directory = tempfile.mkdtemp()
+    mod.app = create_api_app({
+        "SQLALCHEMY_DATABASE_URI": "sqlite:///" + os.path.join(mod.directory, "refresh.db"),
+        "BCRYPT_LOG_ROUNDS": 4,
+        "BCRYPT_POOL_SIZE": 0,
+        "METRICS_ENABLED": False,
+        "TOKEN_CACHE_TTL": 0,
+        "LOGIN_ATTEMPTS_PER_ACCOUNT": 0,
+        "LOGIN_RATE_LIMIT_PATH": os.path.join(mod.directory, "login-attempts.db"),
+    })
+    with mod.app.app_context():
+        db.create_all()
+        db.session.add(Customer(67417, "hunter2", "Test", "Customer"))
+        db.session.add(Employee(67416, "hunter3", "Test", "User"))
+        db.session.commit()
+    mod.client = mod.app.test_client()
+
+def teardown_module(mod):
+    shutil.rmtree(mod.directory)
+
+def login():
+    req = client.post("/employee/login", json={"employeeID": "67416", "password": "hunter3"})
+    assert req.status_code == 200
+    return req.get_json()
+
+def refresh(refresh_token):
+    return client.post("/token/refresh", json={"refreshToken": refresh_token})
+
+def test_refresh_without_password(monkeypatch):
+    tokens = login()
+
+    monkeypatch.setattr(User, "is_authentic", lambda *args: pytest.fail("password checked"))
+    for i in range(3):
+        req = refresh(tokens["refreshToken"])
+        assert req.status_code == 200
+        assert req.get_json()["refreshToken"] != tokens["refreshToken"]
+        tokens = req.get_json()
+
+    info = client.get("/customer/67417/info", headers={"Authorization": "Bearer " + tokens["accessToken"]})
+    assert info.status_code == 200
+
+def test_reused_token_ends_session():
+    first = login()["refreshToken"]
+    second = refresh(first).get_json()["refreshToken"]
+
+    # Using `first` again means it was replayed, so `second` stops working too
+    req = refresh(first)
+    assert req.status_code == 401
+    assert req.get_json()["errorCode"] == "BAD_REFRESH_TOKEN"
+    assert refresh(second).status_code == 401
+
+    # Other sessions of the same user carry on
+    assert refresh(login()["refreshToken"]).status_code == 200
+
+def test_revoke():
+    refresh_token = login()["refreshToken"]
+    assert client.post("/token/revoke", json={"refreshToken": refresh_token}).status_code == 200
+    assert refresh(refresh_token).status_code == 401
+
+    refresh_tokens = [login()["refreshToken"] for i in range(2)]
+    with app.app_context():
+        user_id = Employee.query.filter_by(employee_id=67416).one().user_id
+        assert RefreshToken.revoke_user(user_id) >= 2
+        db.session.commit()
+    assert [refresh(refresh_token).status_code for refresh_token in refresh_tokens] == [401, 401]
+
+def test_tokens_are_not_interchangeable():
+    tokens = login()
+    assert refresh(tokens["accessToken"]).status_code == 401
+    assert refresh("not a token").status_code == 401
+
+    info = client.get("/customer/67417/info", headers={"Authorization": "Bearer " + tokens["refreshToken"]})
+    assert info.status_code == 401
+
+def test_expired_token(monkeypatch):
+    monkeypatch.setitem(app.config, "REFRESH_TOKEN_TTL", -1)
+    refresh_token = login()["refreshToken"]
+    assert refresh(refresh_token).status_code == 401
+
+    with app.app_context():
+        assert RefreshToken.purge_expired() >= 1
+        db.session.commit()
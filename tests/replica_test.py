@@ -0,0 +1,92 @@
+import os
+import shutil
+import tempfile
+
+from sqlalchemy import event
+
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+from application import create_api_app
+from app_init import db
+from models import Customer, Employee, Store, ItemType, UnitType, Transaction
+
+# Checks the read replica routing of replicas.py, with two SQLite files
+# standing in for the primary and its replica. The replica is a copy of the
+# primary taken before the test customer's name was changed, so responses show
+# which of the two they were read from.
+
+TEST_CONFIG = {
+    "BCRYPT_LOG_ROUNDS": 4,
+    "BCRYPT_POOL_SIZE": 0,
+}
+
+def setup_module(mod):
+    mod.directory = tempfile.mkdtemp()
+    mod.primary_url = "sqlite:///" + os.path.join(mod.directory, "primary.db")
+    mod.replica_url = "sqlite:///" + os.path.join(mod.directory, "replica.db")
+
+    app = create_api_app(dict(TEST_CONFIG, SQLALCHEMY_DATABASE_URI=mod.primary_url))
+    with app.app_context():
+        db.create_all()
+        db.session.add(Customer(67417, "hunter2", "Replicated", "Customer"))
+        db.session.add(Employee(67416, "hunter3", "Test", "User"))
+        db.session.add(Store("Goodwill Omaha Headquarters"))
+        db.session.add(ItemType("Clothing"))
+        db.session.add(UnitType("Bag"))
+        db.session.commit()
+
+        shutil.copy(os.path.join(mod.directory, "primary.db"), os.path.join(mod.directory, "replica.db"))
+
+        Customer.query.filter_by(loyalty_id=67417).one().first_name = "Primary"
+        db.session.commit()
+
+def teardown_module(mod):
+    shutil.rmtree(mod.directory)
+
+def create_client(replica_urls):
+    app = create_api_app(dict(TEST_CONFIG, SQLALCHEMY_DATABASE_URI=primary_url,
+        DATABASE_REPLICA_URLS=replica_urls,
+        LOGIN_RATE_LIMIT_PATH=os.path.join(directory, "login-attempts.db")))
+    client = app.test_client()
+    login = client.post("/employee/login", json={"employeeID": "67416", "password": "hunter3"})
+    authorization = {"Authorization": "Bearer " + login.get_json()["accessToken"]}
+    return app, client, authorization
+
+def test_reads_use_replica():
+    app, client, authorization = create_client([replica_url])
+    result = client.get("/customer/67417/info", headers=authorization).get_json()
+    assert result["firstName"] == "Replicated"
+
+def test_writes_use_primary():
+    app, client, authorization = create_client([replica_url])
+    req = client.post("/customer/transaction", headers=authorization, json={
+        "loyaltyID": 67417, "storeID": 1, "date": "2019-12-31",
+        "items": [{"itemType": "Clothing", "unit": "Bag", "quantity": 1, "description": "Replica test"}]
+    })
+    assert req.status_code == 200
+    transaction_id = req.get_json()["transactionID"]
+
+    with app.app_context():
+        assert Transaction.query.get(transaction_id) is not None
+        replica = db.get_engine(app, bind="replica0")
+        assert replica.execute(db.text("SELECT count(*) FROM \"transaction\"")).scalar() == 0
+
+def test_one_checkout_per_request():
+    app, client, authorization = create_client([replica_url])
+    with app.app_context():
+        replica = db.get_engine(app, bind="replica0")
+    checkouts = []
+    event.listen(replica.pool, "checkout", lambda *args: checkouts.append(1))
+    assert client.get("/customer/67417/info", headers=authorization).status_code == 200
+    assert len(checkouts) == 1
+
+def test_falls_back_to_primary():
+    unreachable_url = "sqlite:///" + os.path.join(directory, "missing", "replica.db")
+    app, client, authorization = create_client([unreachable_url])
+    req = client.get("/customer/67417/info", headers=authorization)
+    assert req.status_code == 200
+    assert req.get_json()["firstName"] == "Primary"
+
+    # Until REPLICA_RETRY_INTERVAL has passed, the replica isn't tried again
+    with app.test_request_context():
+        assert app.extensions["replicas"].choose(app) is None
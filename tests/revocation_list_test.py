@@ -0,0 +1,79 @@
+import datetime
+import os
+import shutil
+import tempfile
+import threading
+
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+from app_init import create_app, db
+from models import JWTBlacklist, RevocationList
+
+# Checks how RevocationList (in models.py) picks up revoked tokens, on a
+# throwaway SQLite file.
+
+def setup_module(mod):
+    mod.directory = tempfile.mkdtemp()
+    mod.app = create_app({"SQLALCHEMY_DATABASE_URI": "sqlite:///" + os.path.join(mod.directory, "revoked.db")})
+    with mod.app.app_context():
+        db.create_all()
+
+def teardown_module(mod):
+    shutil.rmtree(mod.directory)
+
+# Adds a blacklist row with the given id, in SQL, as another process would
+def blacklist(id, jti):
+    db.session.execute(JWTBlacklist.__table__.insert(), {
+        "jwt_blacklist_id": id, "token": "token-" + jti, "jti": jti,
+        "blacklisted_on": datetime.datetime.now(),
+        "expires_on": datetime.datetime.utcnow() + datetime.timedelta(hours=1),
+    })
+    db.session.commit()
+
+# Runs in another thread, with its own app context
+def check(revoked, key, answers):
+    with app.app_context():
+        answers.append(revoked.is_revoked(key))
+
+def test_rows_committed_out_of_order():
+    revoked = RevocationList(refresh_interval=3600)
+    with app.app_context():
+        blacklist(10, "first")
+        assert revoked.is_revoked("first")
+
+        # Ids 11 and 12 were taken by transactions that commit later than 13
+        blacklist(13, "third")
+        revoked.refresh()
+        blacklist(11, "second")
+        revoked.refresh()
+        assert revoked.is_revoked("third") and revoked.is_revoked("second")
+        assert 12 in revoked._gaps and 11 not in revoked._gaps
+
+def test_checks_wait_for_first_load(monkeypatch):
+    revoked = RevocationList(refresh_interval=3600)
+    loading, loaded = threading.Event(), threading.Event()
+    load = RevocationList._refresh
+
+    def slow_load(self):
+        loading.set()
+        loaded.wait(5)
+        load(self)
+    monkeypatch.setattr(RevocationList, "_refresh", slow_load)
+
+    with app.app_context():
+        blacklist(20, "revoked before start")
+        first = threading.Thread(target=check, args=(revoked, "some token", []))
+        first.start()
+        loading.wait(5)
+
+        # Checked while the first thread is still loading: must not answer
+        # from the empty set
+        answers = []
+        second = threading.Thread(target=check, args=(revoked, "revoked before start", answers))
+        second.start()
+        second.join(0.2)
+        assert answers == []
+        loaded.set()
+        second.join(5)
+        first.join(5)
+        assert answers == [True]
@@ -0,0 +1,145 @@
+from datetime import date
+
+from app_init import db
+from history_snapshots import invalidate_snapshots
+from models import Customer, Transaction, TransactionLine
+from utility import APIError
+
+# Shared write path for POST /customer/transaction and the bulk variant used by
+# stores for their end-of-day sync. Both check transactions the same way, with
+# the same error codes.
+
+# How many rows go into one multi-row INSERT. Postgres allows at most 65535 bind
+# parameters per statement; transaction lines have 5 columns.
+INSERT_CHUNK_SIZE = 1000
+
+# How many transactions of a bulk request are checked and inserted at a time,
+# while the rest of the request is still being read
+BULK_BATCH_SIZE = INSERT_CHUNK_SIZE
+
+# Checks one transaction against the reference data (see reference_data.py) and
+# converts it into rows ready for insert_transactions().
+#
+# reference: a ReferenceSnapshot
+# loyalty_id, store_id, date_, items: the values as sent in the request JSON
+# returns: a tuple of (transaction row dict, list of line row dicts)
+# raises APIError: with HTTP 400 if anything is wrong with the transaction
+def check_transaction(reference, loyalty_id, store_id, date_, items):
+    try:
+        loyalty_id = int(loyalty_id)
+    except (TypeError, ValueError):
+        raise APIError(400, "BAD_LOYALTY_ID", "Loyalty ID must be an integer")
+
+    try:
+        date_of_transaction = date.fromisoformat(date_)
+    except (TypeError, ValueError):
+        raise APIError(400, "BAD_DATE", "Date must be formatted as YYYY-MM-DD")
+
+    if not isinstance(items, list) or len(items) == 0:
+        raise APIError(400, "EMPTY_SET", "No items in list")
+
+    if not reference.store_exists(store_id):
+        raise APIError(400, "BAD_STORE", "Store does not exist")
+
+    lines = []
+    for item in items:
+        if not isinstance(item, dict):
+            raise APIError(400, "BAD_ITEM", "Each item must be an object")
+
+        item_type_id = reference.item_type_id(item.get("itemType"))
+        if item_type_id is None:
+            raise APIError(400, "BAD_ITEM_TYPE", "Item Type does not exist")
+
+        unit_type_id = reference.unit_type_id(item.get("unit"))
+        if unit_type_id is None:
+            raise APIError(400, "BAD_UNIT_TYPE", "Unit Type does not exist")
+
+        quantity = item.get("quantity")
+        if not isinstance(quantity, int) or isinstance(quantity, bool):
+            raise APIError(400, "BAD_QUANTITY", "Quantity must be an integer")
+
+        description = item.get("description")
+        if description is not None and not isinstance(description, str):
+            raise APIError(400, "BAD_DESCRIPTION", "Description must be a string")
+
+        lines.append({
+            "item_type_id": item_type_id,
+            "unit_type_id": unit_type_id,
+            "quantity": quantity,
+            "description": description
+        })
+
+    transaction = {
+        "date": date_of_transaction,
+        "loyalty_id": loyalty_id,
+        "store_id": int(store_id),
+        "tax_year": date_of_transaction.year
+    }
+    return transaction, lines
+
+# Returns the subset of `loyalty_ids` that belong to existing customers, using
+# one query per INSERT_CHUNK_SIZE ids.
+def existing_loyalty_ids(loyalty_ids):
+    loyalty_ids = list(set(loyalty_ids))
+    found = set()
+    for start in range(0, len(loyalty_ids), INSERT_CHUNK_SIZE):
+        chunk = loyalty_ids[start:start + INSERT_CHUNK_SIZE]
+        found.update(loyalty_id for loyalty_id, in
+            db.session.query(Customer.loyalty_id).filter(Customer.loyalty_id.in_(chunk)))
+    return found
+
+# Inserts already checked transactions (as returned by check_transaction) using
+# multi-row INSERTs, and deletes the history snapshots of the years they are
+# added to. This does not commit; the caller decides when the whole batch is
+# done.
+#
+# transactions: a list of (transaction row dict, list of line row dicts)
+# returns: the list of assigned transaction ids, in the same order
+def insert_transactions(transactions):
+    if not transactions:
+        return []
+
+    if db.session.get_bind().dialect.name == "postgresql":
+        # Take all the ids from the table's sequence in one round trip, so the
+        # headers can go in as multi-row INSERTs too
+        transaction_ids = [transaction_id for transaction_id, in db.session.execute(
+            db.text("SELECT nextval(pg_get_serial_sequence('transaction', 'transaction_id')) "
+                "FROM generate_series(1, :count)"), {"count": len(transactions)})]
+        _insert_chunked(Transaction.__table__, [
+            dict(transaction, transaction_id=transaction_id)
+            for transaction_id, (transaction, lines) in zip(transaction_ids, transactions)
+        ])
+    elif db.session.get_bind().dialect.name == "sqlite":
+        # SQLite numbers the rows of one INSERT consecutively, and reports the
+        # id of the last one
+        transaction_ids = []
+        for start in range(0, len(transactions), INSERT_CHUNK_SIZE):
+            chunk = [transaction for transaction, lines in transactions[start:start + INSERT_CHUNK_SIZE]]
+            last_id = db.session.execute(Transaction.__table__.insert().values(chunk)).lastrowid
+            transaction_ids.extend(range(last_id - len(chunk) + 1, last_id + 1))
+    else:
+        # Other databases let the ORM insert the headers and report back their
+        # ids
+        headers = [
+            Transaction(transaction["date"], transaction["loyalty_id"],
+                transaction["store_id"], transaction["tax_year"])
+            for transaction, lines in transactions
+        ]
+        db.session.add_all(headers)
+        db.session.flush()
+        transaction_ids = [header.transaction_id for header in headers]
+
+    _insert_chunked(TransactionLine.__table__, [
+        dict(line, transaction_id=transaction_id)
+        for transaction_id, (transaction, lines) in zip(transaction_ids, transactions)
+        for line in lines
+    ])
+
+    invalidate_snapshots({(transaction["loyalty_id"], transaction["tax_year"])
+        for transaction, lines in transactions})
+
+    return transaction_ids
+
+def _insert_chunked(table, rows):
+    for start in range(0, len(rows), INSERT_CHUNK_SIZE):
+        db.session.execute(table.insert().values(rows[start:start + INSERT_CHUNK_SIZE]))
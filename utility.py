@@ -1,6 +1,12 @@
-from flask import request, abort, jsonify
-import phonenumbers
-import phonenumbers.geocoder
+import json
+import threading
+import time
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+from functools import lru_cache
+from urllib.parse import urlencode
+
+from flask import current_app, request, abort, jsonify, Response
 
 # Reads in the `request` object from flask, and grabs the requested parameters
 # (`params`) from the request. It can accept HTTP form arguments (as in
@@ -34,6 +40,86 @@ def parse_request(*params):
     else:
         return values
 
+# Reads newline-delimited JSON (one JSON value per line) from a file-like
+# `stream`, such as flask's `request.stream`, without loading the whole body
+# into memory first. Blank lines are skipped.
+#
+# returns: a generator of the decoded values. A line that isn't valid JSON
+#          produces an APIError (rather than raising it), so callers can report
+#          it against that line and carry on with the rest.
+def parse_ndjson(stream):
+    for line in stream:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            yield APIError(400, "BAD_JSON", "Line is not valid JSON")
+
+# Endpoints that can match many rows return them a page at a time, using keyset
+# pagination: each page ends with an opaque cursor encoding the sort key of its
+# last row, and the next page starts right after it.
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+# Reads the `limit` and `cursor` query string parameters.
+#
+# returns: a tuple of (page size, list of values decoded from the cursor, or
+#          None for the first page). The page size defaults to
+#          DEFAULT_PAGE_SIZE and is capped at MAX_PAGE_SIZE.
+# raises APIError: with HTTP 400 if either parameter is invalid
+def request_page():
+    try:
+        limit = int(request.args.get("limit", DEFAULT_PAGE_SIZE))
+    except ValueError:
+        limit = 0
+    if limit < 1:
+        raise APIError(400, "BAD_LIMIT", "Limit must be a positive integer")
+
+    cursor = request.args.get("cursor")
+    return min(limit, MAX_PAGE_SIZE), decode_cursor(cursor) if cursor else None
+
+# Encodes the sort key of the last row on a page (a few JSON-serializable
+# values) into an opaque, URL-safe cursor.
+def encode_cursor(*values):
+    return urlsafe_b64encode(json.dumps(values, separators=(",", ":")).encode()).decode().rstrip("=")
+
+def decode_cursor(cursor):
+    try:
+        values = json.loads(urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except ValueError:
+        raise APIError.bad_cursor()
+    if not isinstance(values, list):
+        raise APIError.bad_cursor()
+    return values
+
+# Returns a `Link` header value (RFC 8288) pointing to the next page of the
+# current request.
+def next_page_link(limit, cursor):
+    return '<{}?{}>; rel="next"'.format(request.path, urlencode({"limit": limit, "cursor": cursor}))
+
+# Answers a conditional GET for a response that only the requesting user may
+# see. If the client's copy is still current (per If-None-Match), this returns
+# a 304 without calling `build_response` at all.
+#
+# etag: identifies the response's current content. Derive it from something
+#       cheap to look up, such as a row version, rather than from the body.
+# build_response: a function returning the full (200) response
+# returns: the response, with ETag, Cache-Control and Vary headers set. Clients
+#          may reuse it without asking again for HTTP_CACHE_MAX_AGE seconds.
+def conditional_response(etag, build_response):
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    else:
+        response = build_response()
+
+    response.set_etag(etag)
+    response.cache_control.private = True
+    response.cache_control.max_age = current_app.config["HTTP_CACHE_MAX_AGE"]
+    response.vary.add("Authorization")
+    return response
+
 def request_access_token():
     try:
         if not "Authorization" in request.headers:
@@ -53,8 +139,21 @@ def request_access_token():
 #
 # Returns a tuple of (the humanized phone number, the RFC 3966 phone number).
 # The former is suitable for display to a user, the latter can be used in an <a
-# href="...">, or similar contexts
+# href="...">, or similar contexts. Both are None if there is no phone number.
+#
+# Parsing and geocoding are slow, so results are memoized. Users also store
+# both forms when their phone is set (see serializers.customer_dict), so this is
+# mostly only needed for rows that haven't been backfilled yet.
+@lru_cache(maxsize=4096)
 def format_phone_number(phone_number):
+    if phone_number is None:
+        return (None, None)
+
+    # Imported on first use: loading the geocoder's data takes about half of
+    # the app's whole import time, and most requests never need it
+    import phonenumbers
+    import phonenumbers.geocoder
+
     phone_number_info = phonenumbers.parse(phone_number)
 
     # XXX: this assumes that the user is in the US themselves. If there is a
@@ -72,10 +171,61 @@ def format_phone_number(phone_number):
 # Returns an E.164 formatted phone_number, which should be string-comparable
 # with the `phone` field in the database.
 def normalize_phone_number(phone_number):
+    import phonenumbers
     return phonenumbers.format_number(
         phonenumbers.parse(phone_number, "US"),
         phonenumbers.PhoneNumberFormat.E164)
 
+# A thread-safe, size-bounded LRU cache whose entries each carry their own
+# expiry time (in seconds since the epoch, as in `time.time()`). Expired entries
+# count as misses and are dropped when found. `hits` and `misses` are running
+# counters for monitoring.
+class LRUCache:
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] <= time.time():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value, expires_at):
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def discard(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    # Drops every entry whose value satisfies `predicate`. This walks the whole
+    # cache, so it's meant for rare events (e.g. a write), not the hot path.
+    def discard_if(self, predicate):
+        with self._lock:
+            for key in [key for key, (value, expires_at) in self._entries.items() if predicate(value)]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        return {"size": len(self._entries), "hits": self.hits, "misses": self.misses}
+
 class APIError(Exception):
     # Returns a flask response object for errors specified by the API. This consists
     # of a JSON object describing the error.
@@ -95,16 +245,19 @@ class APIError(Exception):
     #
     # Use within an "@app.route(...) def" as follows:
     #    raise APIError(403, "FAILURE_REASON", "Human explanation...")
-    def __init__(self, httpError, errorCode, error):
+    # headers: optionally, a dict of extra HTTP headers to send with the error
+    #          (e.g. "Retry-After")
+    def __init__(self, httpError, errorCode, error, headers=None):
         self.httpError = httpError
         self.errorCode = errorCode
         self.error = error
+        self.headers = headers or {}
 
     def api_error_response(self):
         return (jsonify({
             "errorCode": self.errorCode,
             "error": self.error
-        }), self.httpError)
+        }), self.httpError, self.headers)
 
     @staticmethod
     def customer_authentication_failure():
@@ -121,6 +274,24 @@ class APIError(Exception):
         else:
             return APIError(401, "BAD_ACCESS_TOKEN", "Please log in again.")
 
+    @staticmethod
+    def bad_refresh_token():
+        return APIError(401, "BAD_REFRESH_TOKEN", "Your session has ended. Please log in again.")
+
     @staticmethod
     def forbidden():
         return APIError(403, "FORBIDDEN", "You do not have access to this resource.")
+
+    @staticmethod
+    def bad_cursor():
+        return APIError(400, "BAD_CURSOR", "The pagination cursor is invalid.")
+
+    @staticmethod
+    def service_unavailable(retry_after):
+        return APIError(503, "SERVICE_UNAVAILABLE", "The service is busy. Please try again shortly.",
+            {"Retry-After": str(retry_after)})
+
+    @staticmethod
+    def too_many_requests(retry_after):
+        return APIError(429, "TOO_MANY_REQUESTS", "Too many attempts. Please try again shortly.",
+            {"Retry-After": str(retry_after)})